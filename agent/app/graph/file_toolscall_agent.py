@@ -1,15 +1,20 @@
 from __future__ import annotations
 
-import json
 import os
-from typing import Any, Dict
+from functools import partial
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
 
 from langchain_core.runnables import RunnableConfig
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 
 from app.graph.state import RequirementsValidationState
 from app.services.llm import get_chat_model
+from app.services.json_repair import parse_llm_json, record_parse
+from app.services.llm_cache import cached_chain, is_json_object
+from app.services.extraction import ExtractionResult, Job, get_extraction_pool
+from app.services.retrieval import relevance_query, select_relevant
+from app.utils.env import get_file_fastpath_max_bytes, get_file_context_tokens
 from app.prompt.file_toolscall_agent_prompt import (
     FILE_TOOLSCALL_SYSTEM,
     FILE_TOOLSCALL_HUMAN,
@@ -42,6 +47,170 @@ def _build_llm_input(state: RequirementsValidationState) -> dict:
     }
 
 
+def _build_chain(mp: Dict[str, Any]):
+    llm = get_chat_model(mp, json_mode=True)
+    # 等价于 prompt | llm | StrOutputParser()；启用缓存时相同规划输入直接复用历史结果
+    return cached_chain("file_toolscall_agent", prompt, llm, cacheable=is_json_object)
+
+
+def _parse_commands(raw_output: str) -> list:
+    """容错解析规划输出；截断时丢弃截断处不完整的命令，保留之前的完整命令。"""
+    parsed = record_parse("file_toolscall_agent", parse_llm_json(raw_output))
+    commands = parsed.value.get("commands") if isinstance(parsed.value, dict) else None
+    if not isinstance(commands, list):
+        return []
+    if parsed.cut_inside("commands") and len(parsed.truncated_at) > 1:
+        commands = commands[: parsed.truncated_at[1]]
+    return [c for c in commands if isinstance(c, dict)]
+
+
+def _select_targets(files_by_id: Dict[str, Any], commands: list, current_message_id: Any) -> List[Tuple[dict, dict]]:
+    """将规划命令过滤为待提取的 (file, command) 列表。"""
+    targets: Dict[Any, Tuple[dict, dict]] = {}
+    for cmd in commands:
+        if cmd.get("tool") != "file_extract":
+            continue
+        fid = cmd.get("file_id")
+        f = files_by_id.get(fid)
+        if not f or fid in targets:
+            continue
+        # 幂等：已有内容则跳过
+        if f.get("file_content"):
+            continue
+        # 仅处理当前 human_message 关联的文件或未提取过的文件
+        if f.get("message_id") not in (None, current_message_id):
+            continue
+        targets[fid] = (f, cmd)
+    return list(targets.values())
+
+
+def _fallback_targets(files_by_id: Dict[str, Any]) -> List[Tuple[dict, dict]]:
+    # 无外部 LLM：启用兜底策略（最多处理 3 个尚未提取的文本/代码类文件）
+    targets = []
+    for f in files_by_id.values():
+        if len(targets) >= 3:
+            break
+        if f.get("file_content"):
+            continue
+        ft = (f.get("file_type") or "").lower()
+        if any(t in ft for t in ["text", "markdown", "md", "json", "yaml", "yml", "xml", "csv", "python", "typescript", "javascript", "java", "go", "rust", "c", "cpp"]):
+            targets.append((f, {}))
+    return targets
+
+
+def _extract_relevant(file_path: str, file_type: str, query: str) -> Tuple[str, Optional[str]]:
+    # 执行“文件提取”工具（按文件类型选择提取器，见 app.services.extractors）。
+    # file_content 保存本轮的相关性选段（提取缓存不可用时的兜底）；全文留在提取缓存中，
+    # 之后每轮构造分析 prompt 时凭 content_key 按当轮查询重新选段（retrieval.relevant_file_content）
+    from app.services.tools import file_tools
+
+    text, key = file_tools.extract_file_with_key(file_path=file_path, file_type=file_type)
+    return select_relevant(text, query, get_file_context_tokens()), key
+
+
+def _extraction_jobs(targets: List[Tuple[dict, dict]], query: str) -> List[Job]:
+    return [
+        (
+            f.get("file_id"),
+            partial(
+                _extract_relevant,
+                cmd.get("file_path") or f.get("file_path"),
+                cmd.get("file_type") or f.get("file_type"),
+                query,
+            ),
+        )
+        for f, cmd in targets
+    ]
+
+
+def _apply_results(targets: List[Tuple[dict, dict]], results: Dict[str, ExtractionResult]) -> None:
+    for f, _ in targets:
+        r = results.get(f.get("file_id"))
+        if r is None:
+            continue
+        f["extract_latency_ms"] = round(r.latency_ms, 1) if r.latency_ms is not None else None
+        if r.error is None:
+            f["file_content"] = r.content
+            f["content_key"] = r.content_key
+            f["extract_error"] = None
+        else:
+            f["extract_error"] = r.error
+
+
+def _extract(targets: List[Tuple[dict, dict]], query: str) -> None:
+    if targets:
+        _apply_results(targets, get_extraction_pool().extract_many(_extraction_jobs(targets, query)))
+
+
+async def _aextract(targets: List[Tuple[dict, dict]], query: str) -> None:
+    if targets:
+        _apply_results(targets, await get_extraction_pool().aextract_many(_extraction_jobs(targets, query)))
+
+
+# 快速路径：可在本地直接判定的文本类文件（扩展名或 MIME）
+_TEXT_EXTENSIONS = {
+    ".txt", ".md", ".markdown", ".json", ".yaml", ".yml", ".xml", ".csv", ".log", ".ini", ".toml",
+    ".py", ".ts", ".tsx", ".js", ".jsx", ".java", ".go", ".rs", ".c", ".h", ".cpp", ".hpp",
+    ".html", ".css", ".sql", ".sh",
+}
+_TEXT_MIME_TYPES = {"application/json", "application/xml", "application/x-yaml", "application/yaml"}
+
+_stats_lock = Lock()
+_planner_stats: Dict[str, Any] = {"llm_calls": 0, "skipped": {"no_files": 0, "all_extracted": 0, "small_text": 0}}
+
+
+def planner_stats() -> Dict[str, Any]:
+    """规划器计数：LLM 规划次数、按原因统计的本地决策（跳过 LLM）次数。"""
+    with _stats_lock:
+        skipped = dict(_planner_stats["skipped"])
+        llm_calls = _planner_stats["llm_calls"]
+    total = llm_calls + sum(skipped.values())
+    return {
+        "llm_calls": llm_calls,
+        "llm_skipped": sum(skipped.values()),
+        "skip_ratio": round(sum(skipped.values()) / total, 4) if total else 0.0,
+        "skipped_by_reason": skipped,
+    }
+
+
+def _count(reason: Optional[str]) -> None:
+    with _stats_lock:
+        if reason is None:
+            _planner_stats["llm_calls"] += 1
+        else:
+            _planner_stats["skipped"][reason] += 1
+
+
+def _is_small_text(f: Dict[str, Any], max_bytes: int) -> bool:
+    size = f.get("file_size")
+    if not isinstance(size, int) or size > max_bytes:
+        return False
+    ft = (f.get("file_type") or "").lower()
+    name = (f.get("file_name") or f.get("file_path") or "").lower()
+    return ft.startswith("text/") or ft in _TEXT_MIME_TYPES or os.path.splitext(name)[1] in _TEXT_EXTENSIONS
+
+
+def _plan_locally(files_by_id: Dict[str, Any], current_message_id: Any) -> Tuple[Optional[List[dict]], Optional[str]]:
+    """确定性规划：能在本地判定时返回 (commands, 原因)，需要 LLM 判断时返回 (None, None)。
+
+    - 无文件 / 本轮文件均已提取 → 无需提取；
+    - 待提取文件全部为字节预算内的文本类文件 → 全部提取（与 LLM 的选择一致，且无歧义）；
+    - 其他（二进制/超大/大小未知的文件）→ 交给 LLM 按用户意图挑选。
+    """
+    if not files_by_id:
+        return [], "no_files"
+    pending = [
+        f for f in files_by_id.values()
+        if not f.get("file_content") and f.get("message_id") in (None, current_message_id)
+    ]
+    if not pending:
+        return [], "all_extracted"
+    max_bytes = get_file_fastpath_max_bytes()
+    if all(_is_small_text(f, max_bytes) for f in pending):
+        return [{"tool": "file_extract", "file_id": f.get("file_id")} for f in pending], "small_text"
+    return None, None
+
+
 def file_toolscall_agent(state: RequirementsValidationState, config: RunnableConfig) -> RequirementsValidationState:
     files_by_id = {f.get("file_id"): f for f in state.get("multi_files", [])}
 
@@ -54,69 +223,49 @@ def file_toolscall_agent(state: RequirementsValidationState, config: RunnableCon
     api_key = mp.get("api_key") or os.getenv("OPENAI_API_KEY")
 
     if api_key:
-        # 单轮 LLM 规划：根据当前状态规划一次需要提取的文件
-        llm = get_chat_model(mp)
-        chain = prompt | llm | StrOutputParser()
-
-        llm_input = _build_llm_input({**state, "multi_files": list(files_by_id.values())})
-        raw_output = chain.invoke(llm_input)
-
-        commands = []
-        try:
-            data = json.loads(raw_output)
-            commands = data.get("commands", [])
-        except Exception:
-            commands = []
-
-        for cmd in commands:
-            if cmd.get("tool") != "file_extract":
-                continue
-            fid = cmd.get("file_id")
-            f = files_by_id.get(fid)
-            if not f:
-                continue
-            # 幂等：已有内容则跳过
-            if f.get("file_content"):
-                continue
-            # 仅处理当前 human_message 关联的文件或未提取过的文件
-            if f.get("message_id") not in (None, current_message_id):
-                continue
-
-            # 执行“文件提取”工具（占位实现由 tools.py 负责）
-            from app.services.tools import FileTools
-
-            try:
-                extracted = FileTools.extract_file(
-                    file_path=cmd.get("file_path") or f.get("file_path"),
-                    file_type=cmd.get("file_type") or f.get("file_type"),
-                )
-                f["file_content"] = extracted
-                f["error"] = None
-            except Exception as e:
-                f["error"] = str(e)
-
-        # 将更新写回 state
-        state["multi_files"] = list(files_by_id.values())
-        return state
+        # 分层规划：规则可判定时本地决策，仅在有歧义时调用 LLM 规划一次
+        commands, reason = _plan_locally(files_by_id, current_message_id)
+        _count(reason)
+        if commands is None:
+            chain = _build_chain(mp)
+            llm_input = _build_llm_input({**state, "multi_files": list(files_by_id.values())})
+            raw_output = chain.invoke(llm_input, config=config)
+            commands = _parse_commands(raw_output)
+        targets = _select_targets(files_by_id, commands, current_message_id)
+    else:
+        targets = _fallback_targets(files_by_id)
 
-    # 无外部 LLM：启用兜底策略（最多处理 3 个尚未提取的文本/代码类文件）
-    from app.services.tools import FileTools
+    # 有界线程池并发提取：单文件超时 + 本轮截止时间，超时文件记录 extract_error
+    _extract(targets, relevance_query(state))
 
-    picked = 0
-    for f in files_by_id.values():
-        if picked >= 3:
-            break
-        if f.get("file_content"):
-            continue
-        ft = (f.get("file_type") or "").lower()
-        if any(t in ft for t in ["text", "markdown", "md", "json", "yaml", "yml", "xml", "csv", "python", "typescript", "javascript", "java", "go", "rust", "c", "cpp"]):
-            try:
-                extracted = FileTools.extract_file(file_path=f.get("file_path"), file_type=f.get("file_type"))
-                f["file_content"] = extracted
-                f["error"] = None
-                picked += 1
-            except Exception as e:
-                f["error"] = str(e)
+    # 将更新写回 state
+    state["multi_files"] = list(files_by_id.values())
+    return state
+
+
+async def afile_toolscall_agent(state: RequirementsValidationState, config: RunnableConfig) -> RequirementsValidationState:
+    """file_toolscall_agent 的异步版本：LLM 规划走 ainvoke，文件提取在线程池中并发执行、不阻塞事件循环。"""
+    files_by_id = {f.get("file_id"): f for f in state.get("multi_files", [])}
+
+    latest = (state.get("messages") or [{}])[-1]
+    current_message_id = latest.get("message_id")
+
+    mp = state.get("model_params", {}) or {}
+    api_key = mp.get("api_key") or os.getenv("OPENAI_API_KEY")
+
+    if api_key:
+        commands, reason = _plan_locally(files_by_id, current_message_id)
+        _count(reason)
+        if commands is None:
+            chain = _build_chain(mp)
+            llm_input = _build_llm_input({**state, "multi_files": list(files_by_id.values())})
+            raw_output = await chain.ainvoke(llm_input, config=config)
+            commands = _parse_commands(raw_output)
+        targets = _select_targets(files_by_id, commands, current_message_id)
+    else:
+        targets = _fallback_targets(files_by_id)
+
+    await _aextract(targets, relevance_query(state))
 
     state["multi_files"] = list(files_by_id.values())
-    return state
\ No newline at end of file
+    return state
@@ -1,17 +1,33 @@
 from __future__ import annotations
 
 from typing import Optional
-import sys
 import atexit
+from contextlib import AsyncExitStack
 
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, START, END
 from langgraph.checkpoint.memory import MemorySaver
 
 from app.graph.state import RequirementsValidationState
 from app.graph.nodes import start as start_node, input_processor as input_processor_node
-from app.graph.file_toolscall_agent import file_toolscall_agent as file_toolscall_agent_node
-from app.graph.requirements_analysis_agent import requirements_analysis_agent as requirements_analysis_agent_node
-from app.utils.env import get_redis_url, get_postgres_url
+from app.graph.file_toolscall_agent import (
+    file_toolscall_agent as file_toolscall_agent_node,
+    afile_toolscall_agent as afile_toolscall_agent_node,
+)
+from app.graph.requirements_analysis_agent import (
+    requirements_analysis_agent as requirements_analysis_agent_node,
+    arequirements_analysis_agent as arequirements_analysis_agent_node,
+)
+from app.graph.parallel_analysis_agent import (
+    document_update_agent as document_update_agent_node,
+    adocument_update_agent as adocument_update_agent_node,
+    question_generation_agent as question_generation_agent_node,
+    aquestion_generation_agent as aquestion_generation_agent_node,
+    analysis_join as analysis_join_node,
+)
+from app.services.metrics import instrument_checkpointer, node_duration
+from app.utils.env import get_redis_url, get_postgres_url, get_analysis_fanout
+from app.utils.log import get_logger
 
 
 # Optional: Redis checkpointer if available
@@ -26,6 +42,19 @@ try:
 except Exception:  # pragma: no cover
     PostgresSaver = None  # type: ignore
 
+# Async variants used by the FastAPI (astream/aget_state) execution path
+try:
+    from langgraph.checkpoint.redis.aio import AsyncRedisSaver  # type: ignore
+except Exception:  # pragma: no cover
+    AsyncRedisSaver = None  # type: ignore
+
+try:
+    from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver  # type: ignore
+except Exception:  # pragma: no cover
+    AsyncPostgresSaver = None  # type: ignore
+
+log = get_logger("graph")
+
 # Keep opened context managers to close gracefully at process exit
 _cm_stack = []  # type: ignore[var-annotated]
 
@@ -67,18 +96,10 @@ def get_checkpointer():
             except Exception:
                 # setup best-effort; if it fails due to existing tables or perms, continue
                 pass
-            try:
-                sys.stdout.write(f"[graph] Using PostgresSaver checkpointer at {pg_url}\n")
-                sys.stdout.flush()
-            except Exception:
-                pass
+            log.info("checkpointer", backend="PostgresSaver", url=pg_url)
             return cp
         except Exception as e:
-            try:
-                sys.stdout.write(f"[graph] Failed to init PostgresSaver ({e}), will try Redis next.\n")
-                sys.stdout.flush()
-            except Exception:
-                pass
+            log.warning("checkpointer_init_failed", backend="PostgresSaver", error=str(e), next="redis")
 
     # Fallback: Redis
     redis_url = get_redis_url()
@@ -86,64 +107,143 @@ def get_checkpointer():
         try:
             cp = RedisSaver.from_conn_string(redis_url) if hasattr(RedisSaver, 'from_conn_string') else RedisSaver(redis_url)  # type: ignore
             cp = _enter_if_context(cp)
-            try:
-                sys.stdout.write(f"[graph] Using RedisSaver checkpointer at {redis_url}\n")
-                sys.stdout.flush()
-            except Exception:
-                pass
+            log.info("checkpointer", backend="RedisSaver", url=redis_url)
             return cp
         except Exception as e:
+            log.warning("checkpointer_init_failed", backend="RedisSaver", error=str(e), next="memory")
+
+    # Default: in-memory
+    log.info("checkpointer", backend="MemorySaver", reason="no Postgres/Redis available")
+    return MemorySaver()
+
+
+# Async checkpointers are async context managers; they are closed on app shutdown
+_acm_stack = AsyncExitStack()
+
+
+async def _aenter_if_context(obj):
+    """Async counterpart of _enter_if_context for AsyncPostgresSaver/AsyncRedisSaver."""
+    if hasattr(obj, "__aenter__") and hasattr(obj, "__aexit__") and not hasattr(obj, "get_next_version"):
+        return await _acm_stack.enter_async_context(obj)
+    return obj
+
+
+async def aclose_checkpointer() -> None:
+    await _acm_stack.aclose()
+
+
+async def aget_checkpointer():
+    """Same selection order as get_checkpointer (Postgres → Redis → memory), but returns
+    checkpointers that implement aget_tuple/aput so the graph can run via astream without
+    blocking the event loop. MemorySaver supports both sync and async access."""
+    pg_url = get_postgres_url()
+    if pg_url and AsyncPostgresSaver is not None:
+        try:
+            cp = await _aenter_if_context(AsyncPostgresSaver.from_conn_string(pg_url))
             try:
-                sys.stdout.write(f"[graph] Failed to init RedisSaver ({e}), fallback to MemorySaver.\n")
-                sys.stdout.flush()
+                await cp.setup()
             except Exception:
                 pass
+            log.info("checkpointer", backend="AsyncPostgresSaver", url=pg_url)
+            return cp
+        except Exception as e:
+            log.warning("checkpointer_init_failed", backend="AsyncPostgresSaver", error=str(e), next="redis")
 
-    # Default: in-memory
-    try:
-        sys.stdout.write("[graph] Using MemorySaver checkpointer (no Postgres/Redis available).\n")
-        sys.stdout.flush()
-    except Exception:
-        pass
+    redis_url = get_redis_url()
+    if redis_url and AsyncRedisSaver is not None:
+        try:
+            cp = AsyncRedisSaver.from_conn_string(redis_url) if hasattr(AsyncRedisSaver, 'from_conn_string') else AsyncRedisSaver(redis_url)  # type: ignore
+            cp = await _aenter_if_context(cp)
+            log.info("checkpointer", backend="AsyncRedisSaver", url=redis_url)
+            return cp
+        except Exception as e:
+            log.warning("checkpointer_init_failed", backend="AsyncRedisSaver", error=str(e), next="memory")
+
+    log.info("checkpointer", backend="MemorySaver", reason="no Postgres/Redis available")
     return MemorySaver()
 
 
 # 轻量包装：在节点执行后标记来源节点，供下一节点判断中断
+# 每个节点同时提供 sync/async 两个入口：graph.stream 走同步函数，graph.astream 走协程；
+# 未提供 async 实现的节点（纯 CPU 的 start/input_processor）在事件循环内直接调用，避免占用线程池。
+
+def _merge_from(tag, state: RequirementsValidationState, out) -> RequirementsValidationState:
+    prev = state.get("from_node")
+    # 合并旧状态与节点输出，避免节点只返回部分字段时丢失其余状态
+    new_state = {**state, **out, "prev_node": prev, "from_node": tag}
+    log.debug("after_node", node=tag, prev=prev, interrupt=new_state.get("interrupt"), status=new_state.get("current_status"))
+    return new_state
+
 
-def _wrap_with_from(tag, fn):
+def _timed(node, fn, afn=None):
+    """节点耗时计入 /metrics 的 agent_node_duration_seconds{node}。"""
     def _inner(state: RequirementsValidationState, config):
-        out = fn(state, config)
-        prev = state.get("from_node")
-        # 合并旧状态与节点输出，避免节点只返回部分字段时丢失其余状态
-        new_state = {**state, **out, "prev_node": prev, "from_node": tag}
-        try:
-            sys.stdout.write(f"[graph] after {tag}: prev={prev}, from={tag}, interrupt={new_state.get('interrupt')}, status={new_state.get('current_status')}\n")
-            sys.stdout.flush()
-        except Exception:
-            pass
-        return new_state
-    return _inner
+        with node_duration.time(node=node):
+            return fn(state, config)
+
+    async def _ainner(state: RequirementsValidationState, config):
+        with node_duration.time(node=node):
+            return await afn(state, config) if afn is not None else fn(state, config)
 
+    return _inner, _ainner
+
+
+def _wrap_with_from(tag, fn, afn=None, node=None):
+    timed, atimed = _timed(node or tag, fn, afn)
+
+    def _inner(state: RequirementsValidationState, config):
+        return _merge_from(tag, state, timed(state, config))
 
-def build_graph():
+    async def _ainner(state: RequirementsValidationState, config):
+        return _merge_from(tag, state, await atimed(state, config))
+
+    return RunnableLambda(_inner, afunc=_ainner, name=tag)
+
+
+def _timed_node(node, fn, afn=None):
+    timed, atimed = _timed(node, fn, afn)
+    return RunnableLambda(timed, afunc=atimed, name=node)
+
+
+def build_graph(fanout: Optional[bool] = None):
+    """装配工作流。fanout=True（默认取 AGENT_ANALYSIS_FANOUT）时，需求分析拆为并行的文档更新与问题生成两个分支：
+    file_toolscall_agent → {document_update_agent, question_generation_agent} → analysis_join → END
+    """
+    if fanout is None:
+        fanout = get_analysis_fanout()
     workflow = StateGraph(RequirementsValidationState)
 
     # 注册节点（带 from_node 包装）
     workflow.add_node("start", _wrap_with_from("start", start_node))
     workflow.add_node("input_processor", _wrap_with_from("input_processor", input_processor_node))
-    workflow.add_node("file_toolscall_agent", _wrap_with_from("file_toolscall_agent", file_toolscall_agent_node))
-    workflow.add_node("requirements_analysis_agent", _wrap_with_from("requirements_analysis_agent", requirements_analysis_agent_node))
+    workflow.add_node(
+        "file_toolscall_agent",
+        _wrap_with_from("file_toolscall_agent", file_toolscall_agent_node, afile_toolscall_agent_node),
+    )
+    if fanout:
+        # 分支只返回各自的字段（不经 _merge_from 回写整份状态），同一 superstep 内并行执行不会冲突
+        workflow.add_node(
+            "document_update_agent",
+            _timed_node("document_update_agent", document_update_agent_node, adocument_update_agent_node),
+        )
+        workflow.add_node(
+            "question_generation_agent",
+            _timed_node("question_generation_agent", question_generation_agent_node, aquestion_generation_agent_node),
+        )
+        # join 完成的是单节点模式下 requirements_analysis_agent 的职责，沿用其 from_node 标记
+        workflow.add_node("analysis_join", _wrap_with_from("requirements_analysis_agent", analysis_join_node, node="analysis_join"))
+    else:
+        workflow.add_node(
+            "requirements_analysis_agent",
+            _wrap_with_from("requirements_analysis_agent", requirements_analysis_agent_node, arequirements_analysis_agent_node),
+        )
 
     workflow.add_edge(START, "start")
     workflow.add_edge("start", "input_processor")
 
     # 条件路由：input_processor → (interrupt? END : file_toolscall_agent)
     def route_after_input(state: RequirementsValidationState):
-        try:
-            sys.stdout.write(f"[graph] route_after_input: interrupt={state.get('interrupt')} (from={state.get('from_node')}, prev={state.get('prev_node')})\n")
-            sys.stdout.flush()
-        except Exception:
-            pass
+        log.debug("route_after_input", interrupt=state.get("interrupt"), from_node=state.get("from_node"), prev=state.get("prev_node"))
         return END if state.get("interrupt") else "file_toolscall_agent"
 
     workflow.add_conditional_edges(
@@ -154,22 +254,24 @@ def build_graph():
 
     # 条件路由：requirements_analysis_agent → (completed? END : input_processor)
     def route_after_analysis(state: RequirementsValidationState):
-        try:
-            sys.stdout.write(f"[graph] route_after_analysis: status={state.get('current_status')}\n")
-            sys.stdout.flush()
-        except Exception:
-            pass
+        log.debug("route_after_analysis", status=state.get("current_status"))
         status = state.get("current_status") or "clarifying"
         # 单轮执行策略：分析节点后直接结束本轮，等待下一次用户输入，避免在同一轮内回流造成递归
         return END
 
+    analysis_node = "analysis_join" if fanout else "requirements_analysis_agent"
     workflow.add_conditional_edges(
-        "requirements_analysis_agent",
+        analysis_node,
         route_after_analysis,
         {"input_processor": "input_processor", END: END},
     )
 
-    workflow.add_edge("file_toolscall_agent", "requirements_analysis_agent")
+    if fanout:
+        workflow.add_edge("file_toolscall_agent", "document_update_agent")
+        workflow.add_edge("file_toolscall_agent", "question_generation_agent")
+        workflow.add_edge(["document_update_agent", "question_generation_agent"], "analysis_join")
+    else:
+        workflow.add_edge("file_toolscall_agent", "requirements_analysis_agent")
 
     return workflow
 
@@ -178,5 +280,11 @@ def get_compiled_graph():
     checkpointer = get_checkpointer()
     return build_graph().compile(checkpointer=checkpointer)
 
+
+async def aget_compiled_graph():
+    """Compile the graph with an async-capable checkpointer (for astream/aget_state)."""
+    checkpointer = instrument_checkpointer(await aget_checkpointer())
+    return build_graph().compile(checkpointer=checkpointer)
+
 # For LangGraph CLI: export a graph without checkpointer (platform manages persistence)
 graph = build_graph().compile()
\ No newline at end of file
@@ -8,6 +8,9 @@ from langchain_core.runnables import RunnableConfig
 # REMOVED: from langgraph.types import interrupt as lg_interrupt
 
 from app.graph.state import RequirementsValidationState, FileInfo
+from app.utils.log import get_logger
+
+log = get_logger("nodes")
 
 
 # ============
@@ -65,10 +68,7 @@ def start(state: RequirementsValidationState, config: RunnableConfig) -> Require
         # 从 start 路由进入 input_processor 不中断
         "interrupt": False,
     }
-    try:
-        print(f"[nodes.start] init thread={thread_id}, state_version={state_version}, status={current_status}")
-    except Exception:
-        pass
+    log.debug("start", state_version=state_version, status=current_status)
     return new_state
 
 
@@ -113,14 +113,15 @@ def input_processor(state: RequirementsValidationState, config: RunnableConfig)
         "multi_files": new_files,
         "interrupt": should_interrupt,
     }
-    try:
-        print(
-            f"[nodes.input_processor] from={from_node}, prev={prev_node}, "
-            f"came_from_start={came_from_start}, came_from_analysis={came_from_analysis}, "
-            f"status={status}, set interrupt={new_state.get('interrupt')}"
-        )
-    except Exception:
-        pass
+    log.debug(
+        "input_processor",
+        from_node=from_node,
+        prev=prev_node,
+        came_from_start=came_from_start,
+        came_from_analysis=came_from_analysis,
+        status=status,
+        interrupt=should_interrupt,
+    )
     return new_state
 
 
@@ -0,0 +1,206 @@
+"""
+需求分析的并行分支（AGENT_ANALYSIS_FANOUT=true 时由 build_graph 装配）
+
+单节点模式下一次 LLM 调用同时输出更新后的文档与下一轮的 3 个问题，输出越长，轮次越慢。
+并行模式把它拆成同一 superstep 内同时执行的两个分支，再由 join 节点合并：
+
+- document_update_agent：根据用户的回答更新需求文档（长文档同样走章节 patch），输出 requirements_document / current_status；
+- question_generation_agent：基于上一版文档与用户的回答生成下一轮问题，输出 question_list；
+- analysis_join：两个分支都完成后追加助手消息并推进 state_version（与单节点模式的节点输出一致）。
+
+两个分支只返回各自负责的字段（互不重叠），因此无需为状态字段定义 reducer。
+"""
+from __future__ import annotations
+
+from typing import Any, Dict
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableConfig
+
+from app.graph.state import RequirementsValidationState
+from app.graph import requirements_analysis_agent as ra
+from app.services import metrics
+from app.services.id_alias import QuestionIdCodec
+from app.services.json_repair import ParseResult, parse_llm_json, record_parse, record_salvage
+from app.services.llm_cache import cached_chain, is_json_object
+from app.services.prompt_budget import Section, compact_json, fit_sections, prompt_stats, trim_text
+from app.utils.env import get_prompt_max_tokens
+from app.utils.log import get_logger
+from app.utils.tokens import approx_tokens
+from app.prompt.parallel_analysis_agent_prompt import (
+    DOCUMENT_UPDATE_SYSTEM,
+    DOCUMENT_PATCH_SYSTEM,
+    DOCUMENT_HUMAN,
+    QUESTION_GENERATION_SYSTEM,
+    QUESTION_GENERATION_HUMAN,
+)
+
+log = get_logger("parallel_analysis_agent")
+
+document_prompt = ChatPromptTemplate.from_messages([("system", DOCUMENT_UPDATE_SYSTEM), ("human", DOCUMENT_HUMAN)])
+document_patch_prompt = ChatPromptTemplate.from_messages([("system", DOCUMENT_PATCH_SYSTEM), ("human", DOCUMENT_HUMAN)])
+question_prompt = ChatPromptTemplate.from_messages([("system", QUESTION_GENERATION_SYSTEM), ("human", QUESTION_GENERATION_HUMAN)])
+
+_DOCUMENT_TEMPLATE_TOKENS = approx_tokens(DOCUMENT_UPDATE_SYSTEM + DOCUMENT_HUMAN)
+_DOCUMENT_PATCH_TEMPLATE_TOKENS = approx_tokens(DOCUMENT_PATCH_SYSTEM + DOCUMENT_HUMAN)
+_QUESTION_TEMPLATE_TOKENS = approx_tokens(QUESTION_GENERATION_SYSTEM + QUESTION_GENERATION_HUMAN)
+
+
+def _placeholder(state: RequirementsValidationState, node: str, reason: str, *keys: str) -> Dict[str, Any]:
+    metrics.fallbacks.inc(node=node, reason=reason)
+    out = ra._create_placeholder_response(state)
+    return {k: out[k] for k in keys}
+
+
+def _codec(state: RequirementsValidationState) -> QuestionIdCodec:
+    return QuestionIdCodec(state.get("question_list", []) or [])
+
+
+# ===== document_update_agent =====
+
+def _document_chain(mp: Dict[str, Any], patch: bool):
+    return cached_chain(
+        "document_update_agent",
+        document_patch_prompt if patch else document_prompt,
+        ra.get_chat_model(mp, json_mode=True),
+        cacheable=is_json_object,
+    )
+
+
+def _document_input(state: RequirementsValidationState, patch: bool) -> Dict[str, Any]:
+    tokens = _DOCUMENT_PATCH_TEMPLATE_TOKENS if patch else _DOCUMENT_TEMPLATE_TOKENS
+    return ra._build_llm_input(state, _codec(state), tokens, node="document_update_agent", rewrite=not patch)
+
+
+def _document_output(raw_output: "str | ParseResult", state: RequirementsValidationState) -> Dict[str, Any]:
+    """文档不可用（解析失败或截断在文档内）时沿用上一版文档。"""
+    parsed = raw_output if isinstance(raw_output, ParseResult) else record_parse("document_update_agent", parse_llm_json(raw_output))
+    data = parsed.value if isinstance(parsed.value, dict) else {}
+    req_doc = None if parsed.cut_inside("requirements_document") else data.get("requirements_document")
+    previous = state.get("requirements_document")
+    if not ra._is_document(req_doc) and ra._is_document(previous):
+        record_salvage("document_update_agent", "previous_document")
+    return {
+        "requirements_document": ra._fix_document(req_doc, previous),
+        "current_status": ra._fix_status(data.get("current_status", "clarifying")),
+    }
+
+
+def document_update_agent(state: RequirementsValidationState, config: RunnableConfig) -> Dict[str, Any]:
+    mp = state.get("model_params", {}) or {}
+    if not ra._get_api_key(mp):
+        return _placeholder(state, "document_update_agent", "no_api_key", "requirements_document", "current_status")
+    try:
+        if ra._use_patch_mode(state):
+            ra._count_patch("patch_turns")
+            raw_output = _document_chain(mp, True).invoke(_document_input(state, True), config=config)
+            merged = ra._merge_patch(raw_output, ra._current_content(state), node="document_update_agent")
+            if merged is not None:
+                return _document_output(merged, state)
+        ra._count_patch("full_turns")
+        raw_output = _document_chain(mp, False).invoke(_document_input(state, False), config=config)
+        return _document_output(raw_output, state)
+    except Exception as e:
+        log.warning("llm_error", node="document_update_agent", error=str(e))
+        return _placeholder(state, "document_update_agent", "llm_error", "requirements_document", "current_status")
+
+
+async def adocument_update_agent(state: RequirementsValidationState, config: RunnableConfig) -> Dict[str, Any]:
+    mp = state.get("model_params", {}) or {}
+    if not ra._get_api_key(mp):
+        return _placeholder(state, "document_update_agent", "no_api_key", "requirements_document", "current_status")
+    try:
+        if ra._use_patch_mode(state):
+            ra._count_patch("patch_turns")
+            raw_output = await _document_chain(mp, True).ainvoke(_document_input(state, True), config=config)
+            merged = ra._merge_patch(raw_output, ra._current_content(state), node="document_update_agent")
+            if merged is not None:
+                return _document_output(merged, state)
+        ra._count_patch("full_turns")
+        raw_output = await _document_chain(mp, False).ainvoke(_document_input(state, False), config=config)
+        return _document_output(raw_output, state)
+    except Exception as e:
+        log.warning("llm_error", node="document_update_agent", error=str(e))
+        return _placeholder(state, "document_update_agent", "llm_error", "requirements_document", "current_status")
+
+
+# ===== question_generation_agent =====
+
+def _question_chain(mp: Dict[str, Any]):
+    return cached_chain(
+        "question_generation_agent", question_prompt, ra.get_chat_model(mp, json_mode=True), cacheable=is_json_object
+    )
+
+
+def _question_input(state: RequirementsValidationState, codec: QuestionIdCodec) -> Dict[str, Any]:
+    """上一版文档 + 用户的回答 + 本轮输入；超出预算时只裁剪文档。"""
+    messages = state.get("messages", [])
+    latest = messages[-1] if messages else {"message_content": ""}
+    current = ra._current_content(state) or "无现有文档"
+    texts, breakdown = fit_sections(
+        [
+            Section("message", latest.get("message_content", "") or "", priority=100, occurrences=2),
+            Section("questions", compact_json(codec.encode()), priority=50, occurrences=2),
+            Section("document", current, priority=20, trim=trim_text),
+        ],
+        budget=get_prompt_max_tokens(),
+        fixed_tokens=_QUESTION_TEMPLATE_TOKENS,
+    )
+    prompt_stats.record("question_generation_agent", breakdown)
+    return {
+        "human_message": texts["message"],
+        "current_document": texts["document"],
+        "question_list": texts["questions"],
+        "next_question_id": codec.next_alias,
+    }
+
+
+def _question_output(raw_output: str, codec: QuestionIdCodec) -> Dict[str, Any]:
+    """截断时保留截断处之前的完整问题，其余由兜底问题补齐。"""
+    parsed = record_parse("question_generation_agent", parse_llm_json(raw_output))
+    questions = parsed.value.get("question_list") if isinstance(parsed.value, dict) else None
+    if isinstance(questions, list) and parsed.cut_inside("question_list"):
+        cut = parsed.truncated_at[1] if len(parsed.truncated_at) > 1 else 0
+        questions = questions[: cut if isinstance(cut, int) else 0]
+        record_salvage("question_generation_agent", "partial_questions")
+    return {"question_list": ra._fix_questions(questions, codec)}
+
+
+def question_generation_agent(state: RequirementsValidationState, config: RunnableConfig) -> Dict[str, Any]:
+    mp = state.get("model_params", {}) or {}
+    if not ra._get_api_key(mp):
+        return _placeholder(state, "question_generation_agent", "no_api_key", "question_list")
+    try:
+        codec = _codec(state)
+        raw_output = _question_chain(mp).invoke(_question_input(state, codec), config=config)
+        return _question_output(raw_output, codec)
+    except Exception as e:
+        log.warning("llm_error", node="question_generation_agent", error=str(e))
+        return _placeholder(state, "question_generation_agent", "llm_error", "question_list")
+
+
+async def aquestion_generation_agent(state: RequirementsValidationState, config: RunnableConfig) -> Dict[str, Any]:
+    mp = state.get("model_params", {}) or {}
+    if not ra._get_api_key(mp):
+        return _placeholder(state, "question_generation_agent", "no_api_key", "question_list")
+    try:
+        codec = _codec(state)
+        raw_output = await _question_chain(mp).ainvoke(_question_input(state, codec), config=config)
+        return _question_output(raw_output, codec)
+    except Exception as e:
+        log.warning("llm_error", node="question_generation_agent", error=str(e))
+        return _placeholder(state, "question_generation_agent", "llm_error", "question_list")
+
+
+# ===== analysis_join =====
+
+def analysis_join(state: RequirementsValidationState, config: RunnableConfig) -> Dict[str, Any]:
+    """两个分支的结果已写入状态；这里补齐与单节点模式一致的助手消息与 state_version。"""
+    return ra._build_turn_output(
+        state,
+        {
+            "requirements_document": state.get("requirements_document"),
+            "question_list": state.get("question_list", []),
+            "current_status": state.get("current_status", "clarifying"),
+        },
+    )
@@ -3,25 +3,44 @@ from __future__ import annotations
 import json
 import os
 from datetime import datetime
-from typing import Any, Dict, List
+from threading import Lock
+from typing import Any, Dict, List, Optional
 from uuid import uuid4, UUID
 
 from langchain_core.runnables import RunnableConfig
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 
 from app.graph.state import RequirementsValidationState
 from app.services.llm import get_chat_model
+from app.services.doc_patch import PatchError, apply_patch, parse_sections
+from app.services import metrics
+from app.services.id_alias import QuestionIdCodec
+from app.services.json_repair import ParseResult, parse_llm_json, record_parse, record_salvage
+from app.services.llm_cache import cached_chain, is_json_object
+from app.services.prompt_budget import Section, compact_json, fit_sections, prompt_stats, trim_text
+from app.services.retrieval import relevance_query, relevant_file_content
+from app.utils.env import get_doc_patch_min_chars, get_prompt_max_tokens
+from app.utils.log import get_logger
+from app.utils.tokens import approx_tokens
 from app.prompt.requirements_analysis_agent_prompt import (
     REQUIREMENTS_SYSTEM,
     REQUIREMENTS_HUMAN,
+    REQUIREMENTS_PATCH_SYSTEM,
+    REQUIREMENTS_PATCH_HUMAN,
 )
 
+log = get_logger("requirements_analysis_agent")
+
 # 载入 prompt
 prompt = ChatPromptTemplate.from_messages([
     ("system", REQUIREMENTS_SYSTEM),
     ("human", REQUIREMENTS_HUMAN),
 ])
+# 增量模式 prompt：文档只输出章节级 patch
+patch_prompt = ChatPromptTemplate.from_messages([
+    ("system", REQUIREMENTS_PATCH_SYSTEM),
+    ("human", REQUIREMENTS_PATCH_HUMAN),
+])
 
 
 def _is_uuid(value: Any) -> bool:
@@ -54,21 +73,78 @@ def _ensure_requirements_document(d: Dict[str, Any]) -> Dict[str, Any]:
     return {"version": version, "last_updated": last_updated, "content": content}
 
 
-def _build_llm_input(state: RequirementsValidationState) -> Dict[str, Any]:
+# 模板本身（不含变量）的 token 数，从预算中预先扣除
+_TEMPLATE_TOKENS = approx_tokens(REQUIREMENTS_SYSTEM + REQUIREMENTS_HUMAN)
+_PATCH_TEMPLATE_TOKENS = approx_tokens(REQUIREMENTS_PATCH_SYSTEM + REQUIREMENTS_PATCH_HUMAN)
+
+
+def _compact_files(files: List[Dict[str, Any]], query: str) -> List[Dict[str, Any]]:
+    """文件列表仅保留分析所需字段（名称、类型、内容或提取错误），去掉 id/路径/大小等噪声。
+    文件内容按本轮查询（最新 human_message + 待澄清问题）从全文重新做相关性选段。"""
+    out = []
+    for f in files:
+        item = {"file_name": f.get("file_name"), "file_type": f.get("file_type")}
+        content = relevant_file_content(f, query) if f.get("file_content") else None
+        if content:
+            item["file_content"] = content
+        elif f.get("extract_error"):
+            item["extract_error"] = f.get("extract_error")
+        out.append(item)
+    return out
+
+
+def _files_trimmer(files: List[Dict[str, Any]]):
+    """按“水位线”裁剪文件内容：先压缩最长的文件，使序列化结果不超过给定 token 数。"""
+
+    def trim(_text: str, max_tokens: int) -> str:
+        bare = [{k: v for k, v in f.items() if k != "file_content"} for f in files]
+        avail = max_tokens - approx_tokens(compact_json(bare))
+        sizes = sorted(approx_tokens(f.get("file_content") or "") for f in files)
+        cap, remaining = 0, max(avail, 0)
+        for i, n in enumerate(sizes):
+            share = remaining // (len(sizes) - i)
+            if n > share:
+                cap = share
+                break
+            remaining -= n
+            cap = n
+        while True:
+            out = compact_json(
+                [{**f, "file_content": trim_text(f["file_content"], cap)} if f.get("file_content") else f for f in files]
+            )
+            excess = approx_tokens(out) - max_tokens
+            # 转义与截断标记会带来少量偏差，按超出量收紧水位线直至满足预算
+            if excess <= 0 or cap <= 0:
+                return out
+            cap = max(0, cap - max(excess, 1))
+
+    return trim
+
+
+def _build_llm_input(
+    state: RequirementsValidationState,
+    codec: QuestionIdCodec,
+    template_tokens: int = _TEMPLATE_TOKENS,
+    node: str = "requirements_analysis_agent",
+    rewrite: bool = False,
+) -> Dict[str, Any]:
     """构造 LLM 输入上下文
     要求：
-    1) 文件列表（含内容与错误信息）：来自 state.multi_files；
+    1) 文件列表（含内容与错误信息）：来自 state.multi_files，内容按本轮查询从全文重新选段；
     2) 当前文档：仅 requirements_document.content；
-    3) 现有问题：完整的 state.question_list；
+    3) 现有问题：state.question_list 经 codec 编码为短别名（q1/A），已回答的问题仅保留选中项；
     4) 当前状态：state.current_status；
     5) 版本：state.state_version。
+    各段紧凑序列化后按 token 预算（AGENT_PROMPT_MAX_TOKENS）组装：超出时依次裁剪文件内容、当前文档，
+    用户输入与现有问题不裁剪；每次调用的分段 token 明细记录到 prompt_stats。
+    rewrite=True（整篇重写：模型需返回完整的 requirements_document.content）时当前文档不裁剪，否则被省略的
+    章节会从保存的文档中消失；改为依次裁剪文件内容与现有问题，仍超出时照常调用并记录超预算（overrun）。
     """
     messages = state.get("messages", [])
     latest = messages[-1] if messages else {"message_content": ""}
 
-    # 1) 文件列表（原始结构，避免丢失字段；如含文本内容过长，可由上游裁剪）
-    files = state.get("multi_files", []) or []
-    files_json = json.dumps(files, ensure_ascii=False, indent=2)
+    # 1) 文件列表（仅保留分析所需字段）
+    files = _compact_files(state.get("multi_files", []) or [], relevance_query(state))
 
     # 2) 当前文档：仅 content
     current_doc = state.get("requirements_document") or {}
@@ -76,121 +152,156 @@ def _build_llm_input(state: RequirementsValidationState) -> Dict[str, Any]:
     if current_doc_content is None:
         current_doc_content = "无现有文档"
 
-    # 3) 现有问题：完整结构
-    questions = state.get("question_list", []) or []
-    question_list_json = json.dumps(questions, ensure_ascii=False, indent=2)
+    # 3) 现有问题：短别名编码，输出中的别名由 codec 映射回原 UUID
+    questions = codec.encode()
+
+    # system 与 human 模板都引用了 human_message 与 question_list
+    texts, breakdown = fit_sections(
+        [
+            Section("message", latest.get("message_content", "") or "", priority=100, occurrences=2),
+            Section("questions", compact_json(questions), priority=50, occurrences=2, trim=trim_text if rewrite else None),
+            Section("document", current_doc_content, priority=20, trim=None if rewrite else trim_text),
+            Section("files", compact_json(files), priority=10, trim=_files_trimmer(files)),
+        ],
+        budget=get_prompt_max_tokens(),
+        fixed_tokens=template_tokens,
+    )
+    prompt_stats.record(node, breakdown)
+    if breakdown["trimmed"]:
+        log.info("prompt_trimmed", node=node, trimmed=breakdown["trimmed"], sections=breakdown["sections"], budget=breakdown["budget"])
+    if breakdown["overrun"]:
+        log.warning("prompt_over_budget", node=node, overrun=breakdown["overrun"], sections=breakdown["sections"], budget=breakdown["budget"])
 
     return {
-        "human_message": latest.get("message_content", ""),
-        "files": files_json,
-        "current_document": current_doc_content,
-        "question_list": question_list_json,
+        "human_message": texts["message"],
+        "files": texts["files"],
+        "current_document": texts["document"],
+        "question_list": texts["questions"],
+        "next_question_id": codec.next_alias,
         "current_status": state.get("current_status", "clarifying"),
         "state_version": state.get("state_version", 0),
     }
 
 
-def _validate_and_fix_json_output(raw_output: str) -> Dict[str, Any]:
+def _validate_and_fix_json_output(
+    raw_output: "str | ParseResult",
+    codec: Optional[QuestionIdCodec] = None,
+    previous: Any = None,
+    node: str = "requirements_analysis_agent",
+) -> Dict[str, Any]:
     """验证并修复 LLM 输出的 JSON 结构。关键点：
-    - 统一将 question_id/option_id 修正为 UUIDv4 字符串（带连字符的 canonical 形式）。
+    - 容错解析（代码块包裹、多余逗号、截断的 JSON），按字段补救：文档与问题分别校验，
+      一方损坏不影响另一方；截断处所在的字段视为不完整而丢弃；
+    - 文档不可用时沿用上一版文档（previous），没有上一版时才返回失败提示文档；
+    - 统一将 question_id/option_id 修正为 UUIDv4 字符串（带连字符的 canonical 形式）；
+      提供 codec 时，沿用未回答问题的别名映射回原 UUID，其余别名生成新 UUID。
     - 始终产出恰好 3 个问题，每题 3 个选项。
+    raw_output 也可以是已解析（并已计数）的 ParseResult，如 _merge_patch 的结果。
     """
-    try:
-        data = json.loads(raw_output.strip())
-    except json.JSONDecodeError:
-        # JSON 解析失败，返回占位结构（内部已使用 UUID）
-        return _create_fallback_response()
-    
-    # 验证必需字段
-    if not isinstance(data, dict):
-        return _create_fallback_response()
-    
-    # 验证 requirements_document
-    req_doc = data.get("requirements_document", {})
-    if not isinstance(req_doc, dict) or not all(k in req_doc for k in ["version", "content", "last_updated"]):
-        req_doc = {
+    parsed = raw_output if isinstance(raw_output, ParseResult) else record_parse(node, parse_llm_json(raw_output))
+    data = parsed.value if isinstance(parsed.value, dict) else {}
+
+    req_doc = None if parsed.cut_inside("requirements_document") else data.get("requirements_document")
+    questions = data.get("question_list")
+    if isinstance(questions, list) and parsed.cut_inside("question_list"):
+        # 截断处所在的问题不完整，只保留其之前的完整问题
+        cut = parsed.truncated_at[1] if len(parsed.truncated_at) > 1 else 0
+        questions = questions[: cut if isinstance(cut, int) else 0]
+
+    doc_ok, questions_ok = _is_document(req_doc), isinstance(questions, list) and len(questions) == 3
+    if parsed.ok and doc_ok and not questions_ok:
+        record_salvage(node, "document_only")
+    elif parsed.ok and questions_ok and not doc_ok:
+        record_salvage(node, "questions_only")
+    if not doc_ok and _is_document(previous):
+        record_salvage(node, "previous_document")
+
+    return {
+        **data,
+        "requirements_document": _fix_document(req_doc, previous),
+        "question_list": _fix_questions(questions, codec),
+        "current_status": _fix_status(data.get("current_status", "clarifying")),
+    }
+
+
+def _is_document(req_doc: Any) -> bool:
+    return isinstance(req_doc, dict) and isinstance(req_doc.get("content"), str) and bool(req_doc["content"].strip())
+
+
+def _fix_document(req_doc: Any, previous: Any = None) -> Dict[str, Any]:
+    """校验 requirements_document：缺少正文时沿用上一版文档（previous），都没有时返回失败提示文档；否则规范化。"""
+    if not _is_document(req_doc):
+        if _is_document(previous):
+            return _ensure_requirements_document(previous)
+        return {
             "version": "0.1", 
             "content": "文档生成失败，请重试", 
             "last_updated": datetime.utcnow().strftime("%Y-%m-%d")
         }
-        data["requirements_document"] = req_doc
-    else:
-        # 规范化文档字段
-        data["requirements_document"] = _ensure_requirements_document(req_doc)
-    
-    # 验证 question_list
-    questions = data.get("question_list", [])
-    if not isinstance(questions, list) or len(questions) != 3:
-        questions = _create_fallback_questions()
-    else:
-        # 验证每个问题的结构
-        fixed_questions = []
-        for i, q in enumerate(questions[:3]):
-            if not isinstance(q, dict):
-                fixed_questions.append(_create_fallback_question())
-                continue
-            
-            # question 基础字段
+    # 规范化文档字段
+    return _ensure_requirements_document(req_doc)
+
+
+def _fix_questions(questions: Any, codec: Optional[QuestionIdCodec] = None) -> List[Dict[str, Any]]:
+    """校验 question_list：恰好 3 题、每题 3 个选项；ID 统一为 UUID（提供 codec 时别名映射回原 UUID）。
+    有效问题不足 3 个时保留已有的问题，缺少的用兜底问题补齐。"""
+    if not isinstance(questions, list):
+        return _create_fallback_questions()
+    questions = questions[:3] + [None] * (3 - len(questions[:3]))
+    # 验证每个问题的结构
+    fixed_questions = []
+    for i, q in enumerate(questions):
+        if not isinstance(q, dict) or not q.get("content"):
+            fixed_questions.append(_create_fallback_question())
+            continue
+        
+        # question 基础字段
+        option_id_for = None
+        if codec is not None:
+            qid, option_id_for = codec.decode(q)
+        else:
             qid = q.get("question_id")
             if not _is_uuid(qid):
                 qid = _uuid()
-            content = q.get("content") or f"问题 {i+1}"
-            question = {
-                "question_id": qid,
-                "content": content,
-                "suggestion_options": []
-            }
-            
-            # 验证选项
-            options = q.get("suggestion_options", [])
-            if not isinstance(options, list) or len(options) != 3:
-                question["suggestion_options"] = _create_fallback_options()
-            else:
-                fixed_options = []
-                for j, opt in enumerate(options[:3]):
-                    if isinstance(opt, dict) and all(k in opt for k in ["option_id", "content", "selected"]):
-                        oid = opt.get("option_id")
-                        if not _is_uuid(oid):
-                            oid = _uuid()
-                        fixed_options.append({
-                            "option_id": oid,
-                            "content": opt.get("content") or f"选项 {j+1}",
-                            "selected": bool(opt.get("selected", False))
-                        })
-                    else:
-                        fixed_options.append({
-                            "option_id": _uuid(),
-                            "content": f"选项 {j+1}",
-                            "selected": False
-                        })
-                question["suggestion_options"] = fixed_options
-            
-            fixed_questions.append(question)
+        content = q.get("content") or f"问题 {i+1}"
+        question = {
+            "question_id": qid,
+            "content": content,
+            "suggestion_options": []
+        }
         
-        questions = fixed_questions
-    
-    data["question_list"] = questions
-    
-    # 验证 current_status
-    status = data.get("current_status", "clarifying")
-    if status not in ["clarifying", "completed"]:
-        status = "clarifying"
-    data["current_status"] = status
-    
-    return data
+        # 验证选项
+        options = q.get("suggestion_options", [])
+        if not isinstance(options, list) or len(options) != 3:
+            question["suggestion_options"] = _create_fallback_options()
+        else:
+            fixed_options = []
+            for j, opt in enumerate(options[:3]):
+                if isinstance(opt, dict) and all(k in opt for k in ["option_id", "content", "selected"]):
+                    oid = opt.get("option_id")
+                    if option_id_for is not None:
+                        oid = option_id_for(oid, opt.get("content"))
+                    elif not _is_uuid(oid):
+                        oid = _uuid()
+                    fixed_options.append({
+                        "option_id": oid,
+                        "content": opt.get("content") or f"选项 {j+1}",
+                        "selected": bool(opt.get("selected", False))
+                    })
+                else:
+                    fixed_options.append({
+                        "option_id": _uuid(),
+                        "content": f"选项 {j+1}",
+                        "selected": False
+                    })
+            question["suggestion_options"] = fixed_options
+        
+        fixed_questions.append(question)
+    return fixed_questions
 
 
-def _create_fallback_response() -> Dict[str, Any]:
-    """创建兜底响应（使用 UUIDv4 作为 ID）。"""
-    return {
-        "requirements_document": {
-            "version": "0.1",
-            "content": "文档生成失败，请重试或提供更详细信息",
-            "last_updated": datetime.utcnow().strftime("%Y-%m-%d")
-        },
-        "question_list": _create_fallback_questions(),
-        "current_status": "clarifying"
-    }
+def _fix_status(status: Any) -> str:
+    return status if status in ["clarifying", "completed"] else "clarifying"
 
 
 def _create_fallback_questions() -> List[Dict[str, Any]]:
@@ -220,6 +331,107 @@ def _create_fallback_options() -> List[Dict[str, Any]]:
     ]
 
 
+_patch_lock = Lock()
+_patch_stats: Dict[str, Any] = {"full_turns": 0, "patch_turns": 0, "applied": 0, "ops": 0, "fallbacks": {}}
+
+
+def doc_patch_stats() -> Dict[str, Any]:
+    """文档更新方式计数：整篇重写 / 增量 patch 轮次、成功应用的操作数、按原因统计的回退次数。"""
+    with _patch_lock:
+        return {**_patch_stats, "fallbacks": dict(_patch_stats["fallbacks"])}
+
+
+def _count_patch(key: str, n: int = 1) -> None:
+    with _patch_lock:
+        _patch_stats[key] += n
+
+
+def _count_fallback(reason: str) -> None:
+    with _patch_lock:
+        _patch_stats["fallbacks"][reason] = _patch_stats["fallbacks"].get(reason, 0) + 1
+
+
+def _current_content(state: RequirementsValidationState) -> str:
+    doc = state.get("requirements_document") or {}
+    content = doc.get("content") if isinstance(doc, dict) else None
+    return content if isinstance(content, str) else ""
+
+
+def _use_patch_mode(state: RequirementsValidationState) -> bool:
+    """文档足够长（AGENT_DOC_PATCH_MIN_CHARS）且含 markdown 标题时使用增量模式；短文档整篇重写的代价可以忽略。
+    整篇重写放不下当前文档（文档本身已超出 prompt 预算）时，即使关闭了增量模式也强制使用。"""
+    min_chars = get_doc_patch_min_chars()
+    content = _current_content(state)
+    too_long = approx_tokens(content) + _TEMPLATE_TOKENS > get_prompt_max_tokens()
+    return (too_long or (min_chars > 0 and len(content) >= min_chars)) and bool(parse_sections(content.split("\n")))
+
+
+def _merge_patch(raw_output: str, current: str, node: str = "requirements_analysis_agent") -> ParseResult | None:
+    """将增量输出中的 patch 应用到当前文档，返回等价整篇输出的解析结果；无法应用时返回 None。
+    截断在文档内的输出（patch 可能不完整）不应用。"""
+    parsed = record_parse(node, parse_llm_json(raw_output))
+    if not parsed.ok:
+        _count_fallback("invalid_json")
+        return None
+    data = parsed.value
+    doc = data.get("requirements_document") if isinstance(data, dict) else None
+    if not isinstance(doc, dict):
+        _count_fallback("missing_document")
+        return None
+    if parsed.cut_inside("requirements_document"):
+        _count_fallback("truncated")
+        return None
+    if "patch" not in doc:
+        # 模型直接给出了整篇文档，按整篇结果处理
+        if _is_document(doc):
+            return parsed
+        _count_fallback("missing_patch")
+        return None
+    ops = doc.pop("patch")
+    try:
+        doc["content"] = apply_patch(current, ops)
+    except PatchError as e:
+        log.info("patch_rejected", node="requirements_analysis_agent", error=str(e), fallback="full_rewrite")
+        _count_fallback("rejected")
+        return None
+    _count_patch("applied")
+    _count_patch("ops", len(ops))
+    return parsed
+
+
+def _get_api_key(mp: Dict[str, Any]) -> str | None:
+    return mp.get("api_key") or os.getenv("DASHSCOPE_API_KEY") or os.getenv("OPENAI_API_KEY")
+
+
+def _build_chain(mp: Dict[str, Any], patch: bool = False):
+    llm = get_chat_model(mp, json_mode=True)
+    # 等价于 prompt | llm | StrOutputParser()；启用缓存时相同输入直接复用历史结果
+    return cached_chain("requirements_analysis_agent", patch_prompt if patch else prompt, llm, cacheable=is_json_object)
+
+
+def _generate(state: RequirementsValidationState, mp: Dict[str, Any], codec: QuestionIdCodec, config: RunnableConfig) -> "str | ParseResult":
+    """生成本轮原始输出：长文档先尝试增量 patch，无法应用时回退为整篇重写。"""
+    if _use_patch_mode(state):
+        _count_patch("patch_turns")
+        raw_output = _build_chain(mp, patch=True).invoke(_build_llm_input(state, codec, _PATCH_TEMPLATE_TOKENS), config=config)
+        merged = _merge_patch(raw_output, _current_content(state))
+        if merged is not None:
+            return merged
+    _count_patch("full_turns")
+    return _build_chain(mp).invoke(_build_llm_input(state, codec, rewrite=True), config=config)
+
+
+async def _agenerate(state: RequirementsValidationState, mp: Dict[str, Any], codec: QuestionIdCodec, config: RunnableConfig) -> "str | ParseResult":
+    if _use_patch_mode(state):
+        _count_patch("patch_turns")
+        raw_output = await _build_chain(mp, patch=True).ainvoke(_build_llm_input(state, codec, _PATCH_TEMPLATE_TOKENS), config=config)
+        merged = _merge_patch(raw_output, _current_content(state))
+        if merged is not None:
+            return merged
+    _count_patch("full_turns")
+    return await _build_chain(mp).ainvoke(_build_llm_input(state, codec, rewrite=True), config=config)
+
+
 def requirements_analysis_agent(state: RequirementsValidationState, config: RunnableConfig) -> RequirementsValidationState:
     """
     需求分析智能体节点
@@ -232,28 +444,49 @@ def requirements_analysis_agent(state: RequirementsValidationState, config: Runn
     """
     # 检查是否有可用的 LLM 配置
     mp = state.get("model_params", {}) or {}
-    api_key = mp.get("api_key") or os.getenv("DASHSCOPE_API_KEY") or os.getenv("OPENAI_API_KEY")
-    
-    if not api_key:
+    if not _get_api_key(mp):
         # 无 LLM 配置，使用占位实现
+        metrics.fallbacks.inc(node="requirements_analysis_agent", reason="no_api_key")
         return _create_placeholder_response(state)
     
     try:
         # 使用真实 LLM 生成结构化输出
-        llm = get_chat_model(mp)
-        chain = prompt | llm | StrOutputParser()
-        
-        llm_input = _build_llm_input(state)
-        raw_output = chain.invoke(llm_input)
+        codec = QuestionIdCodec(state.get("question_list", []) or [])
+        raw_output = _generate(state, mp, codec, config)
         
-        # 验证并修复 JSON 输出（含 UUID 统一）
-        result_data = _validate_and_fix_json_output(raw_output)
+        # 验证并修复 JSON 输出（别名映射回 UUID）
+        result_data = _validate_and_fix_json_output(raw_output, codec, state.get("requirements_document"))
         
     except Exception as e:
         # LLM 调用失败，使用占位实现
-        print(f"[requirements_analysis_agent] LLM error: {e}")
+        log.warning("llm_error", node="requirements_analysis_agent", error=str(e))
+        metrics.fallbacks.inc(node="requirements_analysis_agent", reason="llm_error")
         return _create_placeholder_response(state)
     
+    return _build_turn_output(state, result_data)
+
+
+async def arequirements_analysis_agent(state: RequirementsValidationState, config: RunnableConfig) -> RequirementsValidationState:
+    """requirements_analysis_agent 的异步版本：通过 chain.ainvoke 调用 LLM，等待网络期间不占用线程。"""
+    mp = state.get("model_params", {}) or {}
+    if not _get_api_key(mp):
+        metrics.fallbacks.inc(node="requirements_analysis_agent", reason="no_api_key")
+        return _create_placeholder_response(state)
+
+    try:
+        codec = QuestionIdCodec(state.get("question_list", []) or [])
+        raw_output = await _agenerate(state, mp, codec, config)
+        result_data = _validate_and_fix_json_output(raw_output, codec, state.get("requirements_document"))
+    except Exception as e:
+        log.warning("llm_error", node="requirements_analysis_agent", error=str(e))
+        metrics.fallbacks.inc(node="requirements_analysis_agent", reason="llm_error")
+        return _create_placeholder_response(state)
+
+    return _build_turn_output(state, result_data)
+
+
+def _build_turn_output(state: RequirementsValidationState, result_data: Dict[str, Any]) -> Dict[str, Any]:
+    """将校验后的 LLM 结果组装为节点输出（追加助手消息并推进 state_version）。"""
     # 构造新的助手消息
     messages = state.get("messages", [])
     last_user = None
@@ -34,7 +34,9 @@ class FileInfo(TypedDict, total=False):
     file_size: int
     file_path: str
     file_content: str
+    content_key: str  # 提取缓存键：每轮据此取回全文重新选段（见 retrieval.relevant_file_content）
     extract_error: str
+    extract_latency_ms: float
 
 
 class RequirementsDocument(TypedDict):
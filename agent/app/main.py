@@ -12,11 +12,18 @@
   - start：初始化 thread_id/state_version/current_status 与消息
   - input_processor：追加并裁剪 messages；将 files 与本轮 message_id 绑定；去重
   - file_toolscall_agent：基于文件元信息按需提取内容（幂等：已有 file_content 跳过）
-  - requirements_analysis_agent：更新 requirements_document、question_list、current_status，并将 state_version += 1，然后路由（completed→end；否则→input_processor）
+  - requirements_analysis_agent：更新 requirements_document、question_list、current_status，并将 state_version += 1，然后路由（completed→end；否则→input_processor）；
+    长文档按章节 patch 增量更新（app.services.doc_patch），patch 无法应用时回退为整篇重写
+  - AGENT_ANALYSIS_FANOUT=true 时改为并行分支（app.graph.parallel_analysis_agent）：document_update_agent 与
+    question_generation_agent 同时执行，analysis_join 合并结果后推进 state_version
   - end：收敛节点，无副作用
 - app.graph.graph：装配并编译 StateGraph，配置 Checkpointer（Redis 或内存）
 - app.services.tools：文件提取工具（占位实现，支持重试，可替换为 MCP/解析器）
-- app.services.state_repo：内存态快照仓库，支撑 /v1/poll 与 /v1/state
+- app.services.state_repo：有界内存快照仓库（LRU + 空闲 TTL + 字节上限），作为 checkpointer 的写穿缓存，
+  支撑 /v1/poll、/v1/state 与轮次前的状态读取；未命中时回读 checkpointer；按 thread 的版本通知器支撑长轮询
+- app.services.runs：后台 run 登记表与有界 worker 池，支撑 /v1/submit?background=true 与 /v1/runs/{run_id}
+- app.services.turn_scheduler：按 thread 串行执行轮次；运行期间到达的多条消息合并为一次后续轮次（节省 LLM 调用）
+- app.services.json_stream：增量 JSON 字段解析，供 /v1/submit/stream 边生成边推送文档正文
 - app.schemas：HTTP 接口的 Pydantic 入/出参 Schema
 - app.utils.env：环境变量读取工具
 
@@ -42,28 +49,65 @@
    - messages: MessageOut[]（仅保留最近1条 human 和最近1条 assistant（若有）；当前示例仅有人类消息）
    - multi_files: FileInfoOut[]（含提取的 file_content 或 extract_error）
 
-2) GET /v1/poll 入参：thread_id, client_state_version → 出参 PollResponse：
+   后台模式 POST /v1/submit?background=true → 202 RunAccepted：
+   - run_id, thread_id, status("queued"), state_version（当前版本）, target_state_version（本轮完成后的版本）
+   - 本轮在 RunManager 的有界 worker 池中执行，不再占用 HTTP 连接等待 LLM
+
+2) GET /v1/poll 入参：thread_id, client_state_version, wait?（长轮询秒数，0–60，默认 0 立即返回）→ 出参 PollResponse：
    - thread_id, client_state_version, current_state_version, has_update（通过 state_version 对比判断）
+   - run_id, run_status（queued|running|done|failed，最近一次后台 run；无则为空）
 
 3) GET /v1/state 入参：thread_id → 出参：与 SubmitResponse 一致（完整快照）
 
+4) GET /v1/runs/{run_id} → 出参 RunResponse：status、target_state_version、state_version、error 及时间戳
+
+5) POST /v1/submit/stream 入参同 SubmitRequest → text/event-stream：
+   - accepted {thread_id} → start {thread_id, state_version} → token {text}* / document {delta}* / node {node}* → state（SubmitResponse）或 error {detail}
+   - 基于 LangGraph stream_mode=["messages","updates"]；document 事件由增量 JSON 解析器从 token 流中提取文档正文
+
+6) GET /v1/stats → 进程内服务计数：turn_scheduler（turns_executed / requests_coalesced / llm_calls_saved 等）、
+   state_repo（entries / bytes / hits / misses / loads / evictions）、llm_pool（size / hits / misses / evictions）、
+   llm_cache（hits / misses / hit_ratio / saved_tokens，未启用时为 null）、
+   file_planner（llm_calls / llm_skipped / skipped_by_reason）、extraction（extracted / failed / timed_out / 延迟）、
+   extraction_cache（hits / misses / hit_ratio / hashes_computed）、
+   prompt（按节点的分段 token 均值、裁剪次数与最近一次明细）、
+   question_ids（问题/选项 ID 别名映射：questions_reused / questions_minted / options_reused 等）、
+   doc_patch（文档整篇重写 / 增量 patch 轮次、应用的操作数、按原因统计的回退）、
+   speculation（推测执行：scheduled / hits / misses / cancelled / hit_ratio / 估算 token，未启用时为 null）、runs
+
+7) GET /metrics → Prometheus 文本格式（app.services.metrics）：节点耗时、按 provider/model 的 LLM 调用耗时与 token、
+   checkpointer 读写耗时、占位兜底次数、LLM 输出 JSON 解析/补救次数、进行中的轮次与整轮耗时
+
 四、核心函数/方法/类说明
 - app.services.state_repo.StateRepository：
   - upsert(state: dict)：按 thread_id 存储当前快照（线程安全）
-  - get(thread_id: str) -> Optional[dict]：读取快照
+  - get(thread_id: str) -> Optional[dict]：读取快照（仅内存）
+  - aget(thread_id: str)：读取快照，未命中时回读 checkpointer 并缓存
+  - wait_for_version(thread_id, after_version, timeout)：挂起直到 state_version > after_version 或超时
+- app.services.state_repo.RedisStateRepository：同上接口，快照存 Redis（zlib + orjson），本地 LRU 作 L1，
+  写入后经 pub/sub 广播版本号，其它 worker 据此失效 L1 并唤醒长轮询
 - app.graph.graph.get_compiled_graph()：构建并编译 LangGraph（含节点、边、条件路由）；内部自动选择 Checkpointer（Redis/内存）
+- app.graph.graph.aget_compiled_graph()：异步版本，使用 AsyncPostgresSaver/AsyncRedisSaver/MemorySaver；HTTP 服务在启动时调用，
+  /v1/submit 以 astream + aget_state 执行一轮，LLM 节点使用 ainvoke，等待网络期间不占用线程池
 - app.graph.nodes：
   - start(state, config) → RequirementsValidationState：初始化 thread_id/state_version/current_status，规范化消息ID与时间
   - input_processor(state, config) → RequirementsValidationState：裁剪消息窗口为“最近一条”；为本轮文件绑定 message_id 并去重
   - file_toolscall_agent(state, config) → RequirementsValidationState：对“本轮文件”按需提取内容，失败记录 extract_error；已提取跳过
+    • 分层规划：无文件/均已提取/小文本文件由规则直接决定，仅在有歧义时调用 LLM 规划
+    • 提取在有界线程池中并发执行：单文件超时 + 本轮截止时间，超时文件记录 extract_error，记录 extract_latency_ms
+    • 全文切块后按 human_message 与待澄清问题做 BM25 相关性选段（AGENT_FILE_CONTEXT_TOKENS），prompt 中的文件上下文大小与文件大小无关；
+      全文留在提取缓存（content_key），每轮构造分析 prompt 时按当轮的消息与问题重新选段
   - requirements_analysis_agent(state, config) → RequirementsValidationState：
     • 汇总最近一轮上下文与文件摘要，生成“自动生成草稿”的 requirements_document
+    • prompt 各段紧凑序列化并按 token 预算组装（AGENT_PROMPT_MAX_TOKENS），超出时先裁剪文件内容、再裁剪当前文档
     • 产出三条澄清问题（带建议选项）
     • 根据用户意图（如包含“直接输出/完成/提交”）决定 current_status
     • 完成写入后 state_version += 1（与方案保持一致）
   - end(state, config)：收敛节点，无副作用
-- app.services.tools.FileTools.extract_file(file_path: str) -> str：
-  - 简化实现：直接以 UTF-8 读取文本；超长截断；失败抛出异常（由重试器兜底）
+- app.services.tools.FileTools.extract_file(file_path: str, file_type: Optional[str] = None) -> str：
+  - 按 MIME/扩展名从 app.services.extractors 注册表选择提取器（PDF/DOCX/XLSX/PPTX/文本）
+  - 逐页/逐表流式读取，达到字符预算（AGENT_EXTRACT_MAX_CHARS）即停止；仅 I/O 错误重试
+  - 结果按内容哈希缓存在本地磁盘（app.services.extraction_cache，AGENT_EXTRACT_CACHE_MAX_MB=0 关闭）
 
 五、幂等性与一致性
 - 文件提取：若目标 file_id 已有 file_content 则默认跳过，避免重复成本
@@ -77,6 +121,14 @@
   LANGSMITH_PROJECT=Best Partners Agent
 - Checkpointer：
   - REDIS_URL=redis://:password@host:6379/0（存在则优先使用 RedisSaver；否则使用 MemorySaver）
+- LLM 响应缓存（可选）：AGENT_LLM_CACHE_NODES=requirements_analysis_agent,file_toolscall_agent
+  AGENT_LLM_CACHE_PATH / AGENT_LLM_CACHE_TTL_SECONDS / AGENT_LLM_CACHE_MAX_ENTRIES / AGENT_LLM_CACHE_MAX_MB（SQLite 持久化）
+- 推测执行（可选）：AGENT_SPECULATION=true 时，每轮结束后在空闲容量上预先执行“每题选第一个选项”的下一轮，
+  提交内容一致时直接返回；AGENT_SPECULATION_MAX_INFLIGHT / AGENT_SPECULATION_TOKENS_PER_HOUR / AGENT_SPECULATION_TTL_SECONDS
+- 日志（app.utils.log）：结构化日志经有界队列由后台线程写出，不阻塞请求路径；每轮绑定 thread_id/run_id；
+  AGENT_LOG_LEVEL（默认 INFO，节点切换/路由为 DEBUG）/ AGENT_LOG_FORMAT=text|json / AGENT_LOG_DEBUG_SAMPLE_RATE / AGENT_LOG_ASYNC
+- 快照仓库：REDIS_URL 存在时使用 RedisStateRepository（压缩快照 + pub/sub 版本通知），
+  多 worker/多副本下 /v1/poll、/v1/state 可落在任意实例；否则为进程内 StateRepository
 
 七、运行方式
 1) Python 3.10+
@@ -86,67 +138,138 @@
 
 注意
 - uuid6 规范：当前以 uuid4 hex 占位（uuid6-like），可在生产替换为 uuid6 实现
-- 文件工具：当前为文本直读占位实现，生产建议接入 MCP/解析库并带指数退避重试
+- 文件工具：PDF 依赖 pypdf；旧版二进制 Office 格式（.doc/.xls/.ppt）不支持
 """
 from __future__ import annotations
 
+import asyncio
+import copy
 import os
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import Any, Awaitable, Callable, Optional, Sequence
 import uuid
 from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import ORJSONResponse
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 import orjson 
 
-from app.schemas import SubmitRequest, SubmitResponse, PollResponse, StateResponse
-from app.graph.graph import get_compiled_graph
-from app.services.state_repo import StateRepository
-from app.utils.env import get_redis_url
+from app.schemas import SubmitRequest, SubmitResponse, PollResponse, StateResponse, RunAccepted, RunResponse
+from app.graph.graph import aget_compiled_graph, aclose_checkpointer, graph as uncheckpointed_graph
+from app.services.state_repo import create_state_repository
+from app.services.llm import llm_pool_stats
+from app.services.llm_cache import llm_cache_stats
+from app.graph.file_toolscall_agent import planner_stats
+from app.graph.requirements_analysis_agent import doc_patch_stats
+from app.services.extraction import get_extraction_pool
+from app.services.extraction_cache import extraction_cache_stats
+from app.services.prompt_budget import prompt_stats
+from app.services.id_alias import id_alias_stats
+from app.services import metrics
+from app.services.json_repair import structured_output_stats
+from app.services.rate_limit import rate_limit_stats
+from app.services.resilience import resilience_stats
+from app.services.runs import RunManager
+from app.services.speculation import SpeculationManager, predict_message
+from app.services.json_stream import JSONStringFieldStream
+from app.services.turn_scheduler import TurnScheduler, coalesce_requests
+from app.utils.log import get_logger, log_context, log_stats
+from app.utils.env import (
+    get_analysis_fanout,
+    get_redis_url,
+    get_run_workers,
+    get_run_retention_seconds,
+    get_state_cache_max_bytes,
+    get_state_cache_max_entries,
+    get_state_cache_ttl_seconds,
+    get_speculation_max_inflight,
+    get_speculation_tokens_per_hour,
+    get_speculation_ttl_seconds,
+    is_speculation_enabled,
+)
 # 移除：from langgraph.types import Command  # 兼容性：不再依赖不同版本的 Command/interrupt
 
+log = get_logger("submit")
+
 
 class ORJSONResponseCustom(ORJSONResponse):
     def render(self, content: object) -> bytes:
         return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
 
 
-app = FastAPI(title="Best Partners Agent", default_response_class=ORJSONResponseCustom)
-
+# Compiled graph with an async-capable checkpointer; built on startup because
+# AsyncPostgresSaver/AsyncRedisSaver must be opened inside the running event loop.
+compiled_graph = None
+# Bounded snapshot cache for polling/state/pre-turn reads; reads through to the checkpointer on a miss.
+# Shared through Redis when REDIS_URL is set, so polls may land on any worker/replica.
+state_repo = create_state_repository(
+    max_bytes=get_state_cache_max_bytes(),
+    max_entries=get_state_cache_max_entries(),
+    ttl_seconds=get_state_cache_ttl_seconds(),
+)
+# Background runs (/v1/submit?background=true) executed on a bounded worker pool
+run_manager = RunManager(
+    # 同一 thread 排队中的 run 合并为一个轮次执行（与 TurnScheduler 的合并规则一致）
+    execute=lambda thread_id, reqs: turn_scheduler.submit(thread_id, coalesce_requests(reqs)),
+    workers=get_run_workers(),
+    retention=get_run_retention_seconds(),
+    # 失败的 run 不会推进 state_version，需主动唤醒长轮询以便及时返回 run_status=failed
+    on_finish=lambda run: state_repo.notify(run.thread_id),
+)
+
+async def _run_speculative(init_state: dict) -> dict:
+    # 推测轮次不带 checkpointer 执行，不写入任何 thread；命中后才由 _commit_speculation 提交
+    return await uncheckpointed_graph.ainvoke(init_state, config={"recursion_limit": 8})
+
+
+# Opt-in speculative next turns (AGENT_SPECULATION=true), only while no background run is queued
+speculator = (
+    SpeculationManager(
+        _run_speculative,
+        max_inflight=get_speculation_max_inflight(),
+        tokens_per_hour=get_speculation_tokens_per_hour(),
+        ttl_seconds=get_speculation_ttl_seconds(),
+        has_capacity=lambda: run_manager.queued() == 0,
+    )
+    if is_speculation_enabled()
+    else None
+)
+# 写入轮次结果的节点（speculation 命中后以该节点的名义提交到 checkpointer）
+_ANALYSIS_NODE = "analysis_join" if get_analysis_fanout() else "requirements_analysis_agent"
+# Turns started by /v1/submit/stream (strong refs so they finish even if the client disconnects)
+_stream_tasks: set = set()
+_STREAM_DOC_PATH = ("requirements_document", "content")
+# 产出文档正文的节点（单节点模式 / 并行模式的文档分支）；问题分支的 token 不推送
+_STREAM_DOC_NODES = ("requirements_analysis_agent", "document_update_agent")
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    global compiled_graph
+    compiled_graph = await aget_compiled_graph()
+    state_repo.set_loader(_aload_values)
+    await state_repo.start()
+    run_manager.start()
+    try:
+        yield
+    finally:
+        if speculator is not None:
+            await speculator.aclose()
+        await run_manager.stop()
+        await state_repo.aclose()
+        await aclose_checkpointer()
 
-# Compile graph with selected checkpointer
-compiled_graph = get_compiled_graph()
-# Repository for polling/state snapshot (works with or without Redis)
-state_repo = StateRepository()
 
+app = FastAPI(title="Best Partners Agent", default_response_class=ORJSONResponseCustom, lifespan=lifespan)
 
-@app.post("/v1/submit", response_model=SubmitResponse)
-def submit(req: SubmitRequest) -> SubmitResponse:
-    """Run one step of the Agent graph.
-    - Accepts a new user message and optional files.
-    - Invokes the compiled graph which runs: start → input_processor → file_toolscall_agent → requirements_analysis_agent → (route)
-    - Returns the updated snapshot of the Agent state for this thread.
-    """
-    # Compose initial input state for the graph from the HTTP request
-    try:
-        init_state = req.to_graph_state()
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
 
-    # Ensure the LangGraph configurable.thread_id matches the thread id inside state.
-    # If client didn't supply one, we must generate it here BEFORE running the graph,
-    # so the checkpointer stores under the correct session id and subsequent rounds can load it.
-    thread_id = init_state.get("thread_id") or req.thread_id
-    if not thread_id:
-        thread_id = uuid.uuid4().hex  # server-side new session id
-        init_state["thread_id"] = thread_id
+def _thread_config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
 
-    # ==== NEW: Preload previous state and merge to preserve requirements_document/question_list across turns ====
-    prev_state = None
-    try:
-        current_prev = compiled_graph.get_state({"configurable": {"thread_id": thread_id}})
-        prev_state = current_prev.values if hasattr(current_prev, "values") else None
-    except Exception:
-        prev_state = None
 
+def _merge_turn_state(req: SubmitRequest, init_state: dict, prev_state: Optional[dict]) -> dict:
+    """Merge this turn's input with the previous snapshot (or backend preload_state),
+    preserving requirements_document/question_list across turns."""
+    thread_id = init_state["thread_id"]
     if prev_state:
         # Start from previous snapshot
         merged_state = {**prev_state}
@@ -166,87 +289,348 @@ def submit(req: SubmitRequest) -> SubmitResponse:
         # Reset routing markers so a new turn won't be misdetected as returning from analysis
         merged_state.pop("from_node", None)
         merged_state.pop("prev_node", None)
-        init_state = merged_state
-    else:
-        # 无历史状态：若后端提供 preload_state，则以其为基线合并本轮输入
-        if getattr(req, "preload_state", None):
-            pl = getattr(req, "preload_state") or {}
-            merged_state = {**pl}
-            merged_state["thread_id"] = thread_id
-            # 覆盖为本轮用户输入与文件
-            merged_state["messages"] = init_state.get("messages", [])
-            if init_state.get("multi_files"):
-                merged_state["multi_files"] = init_state["multi_files"]
-            # 状态与模型参数：优先使用请求显式传入，其次使用预载值，最后使用默认
-            merged_state["current_status"] = (
-                req.current_status if req.current_status is not None else merged_state.get("current_status", "clarifying")
-            )
-            if init_state.get("model_params"):
-                merged_state["model_params"] = init_state["model_params"]
-            merged_state["state_version"] = int(pl.get("state_version", 0) or 0)
-            # Reset routing markers for a clean new-turn start
-            merged_state.pop("from_node", None)
-            merged_state.pop("prev_node", None)
-            init_state = merged_state
-        else:
-            # New thread: ensure version starts at 0
-            init_state["state_version"] = int(init_state.get("state_version", 0) or 0)
+        return merged_state
+
+    # 无历史状态：若后端提供 preload_state，则以其为基线合并本轮输入
+    if getattr(req, "preload_state", None):
+        pl = getattr(req, "preload_state") or {}
+        merged_state = {**pl}
+        merged_state["thread_id"] = thread_id
+        # 覆盖为本轮用户输入与文件
+        merged_state["messages"] = init_state.get("messages", [])
+        if init_state.get("multi_files"):
+            merged_state["multi_files"] = init_state["multi_files"]
+        # 状态与模型参数：优先使用请求显式传入，其次使用预载值，最后使用默认
+        merged_state["current_status"] = (
+            req.current_status if req.current_status is not None else merged_state.get("current_status", "clarifying")
+        )
+        if init_state.get("model_params"):
+            merged_state["model_params"] = init_state["model_params"]
+        merged_state["state_version"] = int(pl.get("state_version", 0) or 0)
+        # Reset routing markers for a clean new-turn start
+        merged_state.pop("from_node", None)
+        merged_state.pop("prev_node", None)
+        return merged_state
+
+    # New thread: ensure version starts at 0
+    init_state["state_version"] = int(init_state.get("state_version", 0) or 0)
+    return init_state
+
+
+async def _aload_values(thread_id: str) -> Optional[dict]:
+    try:
+        current = await compiled_graph.aget_state(_thread_config(thread_id))
+        return current.values if hasattr(current, "values") else None
+    except Exception:
+        return None
+
+
+def _resolve_thread_id(req: SubmitRequest) -> str:
+    """Validate the request and resolve its thread_id.
+
+    Ensure the LangGraph configurable.thread_id matches the thread id inside state.
+    If client didn't supply one, we must generate it here BEFORE running the graph,
+    so the checkpointer stores under the correct session id and subsequent rounds can load it.
+    """
+    if not req.human_message:
+        raise HTTPException(status_code=400, detail="human_message is required")
+    return req.thread_id or uuid.uuid4().hex  # server-side new session id
+
+
+async def _prepare_turn(thread_id: str, req: SubmitRequest) -> dict:
+    """Build this turn's input state, merged with the previous snapshot.
+    Runs inside the thread's scheduler lane, i.e. only after the previous turn has been written."""
+    # Compose initial input state for the graph from the HTTP request
+    try:
+        init_state = req.to_graph_state()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    init_state["thread_id"] = thread_id
+
+    # Preload previous state and merge to preserve requirements_document/question_list across turns
+    # (served from the state_repo cache for hot threads; read-through to the checkpointer otherwise)
+    prev_state = await state_repo.aget(thread_id)
+    return _merge_turn_state(req, init_state, prev_state)
+
+
+async def _run_request(thread_id: str, req: SubmitRequest) -> dict:
+    """Default TurnScheduler executor: prepare + execute one (possibly coalesced) turn."""
+    init_state = await _prepare_turn(thread_id, req)
+    hit = await _take_speculation(thread_id, init_state)
+    if hit is not None:
+        return hit
+    return await _execute_turn(thread_id, init_state)
+
+
+def _speculate(result_state: dict) -> None:
+    """Precompute the likely next turn (first option of every question) in the background."""
+    if speculator is None or result_state.get("current_status") == "completed":
+        return
+    mp = result_state.get("model_params") or {}
+    if not (mp.get("api_key") or os.getenv("DASHSCOPE_API_KEY") or os.getenv("OPENAI_API_KEY")):
+        # 占位实现本身是即时的，没有推测的价值
+        return
+    message = predict_message(result_state)
+    thread_id = result_state.get("thread_id")
+    if message is None or not thread_id:
+        return
+    req = SubmitRequest(
+        user_id=result_state.get("user_id") or "speculation",
+        human_message=message,
+        timestamp=datetime.utcnow(),
+        thread_id=thread_id,
+    )
+    init_state = req.to_graph_state()
+    speculator.schedule(thread_id, _merge_turn_state(req, init_state, copy.deepcopy(result_state)))
+
+
+async def _take_speculation(thread_id: str, init_state: dict) -> Optional[dict]:
+    """Serve this turn from a matching speculation, if any; other speculations of the thread are cancelled."""
+    if speculator is None:
+        return None
+    result = await speculator.take(thread_id, init_state)
+    if result is None:
+        return None
+    # 推测结果中的用户消息替换为本次真实提交的消息（内容/时间/ID）
+    actual = (init_state.get("messages") or [{}])[-1]
+    messages = []
+    for m in result.get("messages", []):
+        if m.get("message_role") == "user":
+            m = {**m, "message_content": actual.get("message_content", ""), "timestamp": actual.get("timestamp") or m.get("timestamp")}
+            if actual.get("message_id") and actual.get("message_id") != "auto":
+                m["message_id"] = actual["message_id"]
+        messages.append(m)
+    result = {**result, "messages": messages}
+    await compiled_graph.aupdate_state(_thread_config(thread_id), result, as_node=_ANALYSIS_NODE)
+    try:
+        await state_repo.aupsert(result)
+    except Exception:
+        pass
+    _speculate(result)
+    return result
+
+
+# Per-thread serialization: concurrent submits of one thread never overlap, and messages that
+# arrive while a turn runs are coalesced into a single follow-up turn
+turn_scheduler = TurnScheduler(_run_request)
+
 
+async def _current_version(thread_id: str, req: SubmitRequest) -> int:
+    snapshot = await state_repo.aget(thread_id) or req.preload_state or {}
+    return int(snapshot.get("state_version", 0) or 0)
+
+
+async def _execute_turn(
+    thread_id: str,
+    init_state: dict,
+    stream_modes: Sequence[str] = (),
+    on_chunk: Optional[Callable[[Any], Awaitable[None]]] = None,
+) -> dict:
+    """Run one graph turn and write the result through to the snapshot repository.
+    The final state is taken from the last "values" chunk (the same state the checkpointer
+    just saved), so no extra checkpointer read is needed. on_chunk receives (mode, data) for
+    the additional stream_modes (used by the SSE endpoint with ("messages", "updates"))."""
+    # 每轮一个 run_id：作为 LangChain 根 run 的 id（与 LangSmith trace 一致），并绑定到本轮的日志上下文
+    run_id = uuid.uuid4()
     config = {
-        "configurable": {
-            # LangGraph uses "thread_id" to identify sessions/checkpoints
-            "thread_id": thread_id,
-        },
+        **_thread_config(thread_id),
         # 显式限制单次调用的递归/步数，避免在 clarifying 状态下循环
         "recursion_limit": 8,
+        "run_id": run_id,
     }
 
-    # 统一执行路径：直接 stream 执行一轮，然后从 checkpointer 读取最新状态
-    try:
-        for _ in compiled_graph.stream(init_state, config=config, stream_mode="values"):
-            pass
-        current = compiled_graph.get_state({"configurable": {"thread_id": thread_id}})
-        result_state = current.values if hasattr(current, "values") else init_state
-    except Exception as ex:
-        import traceback
-        print(f"[submit] Graph execution error: {ex}")
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"graph execution failed: {ex}")
+    # 统一执行路径：直接 astream 执行一轮，最后一个 values 块即本轮写入 checkpointer 的最新状态
+    result_state = init_state
+    metrics.turns_inflight.inc()
+    with log_context(thread_id=thread_id, run_id=run_id.hex):
+        try:
+            with metrics.turn_duration.time(mode="stream" if stream_modes else "invoke"):
+                async for mode, data in compiled_graph.astream(init_state, config=config, stream_mode=["values", *stream_modes]):
+                    if mode == "values":
+                        result_state = data
+                    elif on_chunk is not None:
+                        await on_chunk((mode, data))
+        except Exception as ex:
+            log.exception("graph_execution_error", error=str(ex))
+            raise
+        finally:
+            metrics.turns_inflight.dec()
 
     # Update snapshot repository for /v1/poll and /v1/state
     try:
-        state_repo.upsert(result_state)
+        await state_repo.aupsert(result_state)
     except Exception:
         pass
+    _speculate(result_state)
+    return result_state
+
+
+@app.post("/v1/submit", response_model=SubmitResponse, responses={202: {"model": RunAccepted}})
+async def submit(
+    req: SubmitRequest,
+    background: bool = Query(False, description="Queue the turn and return 202 with a run id instead of waiting for it"),
+):
+    """Run one step of the Agent graph.
+    - Accepts a new user message and optional files.
+    - Invokes the compiled graph which runs: start → input_processor → file_toolscall_agent → requirements_analysis_agent → (route)
+    - Returns the updated snapshot of the Agent state for this thread.
+    - Fully async (astream/aget_state + ainvoke in nodes): a turn waiting on the LLM does not hold a threadpool worker.
+    - background=true: the turn is queued on the run worker pool and 202 RunAccepted is returned at once;
+      completion is reported by /v1/poll (state_version reaches target_state_version) and /v1/runs/{run_id}.
+    """
+    thread_id = _resolve_thread_id(req)
+
+    if background:
+        state_version = await _current_version(thread_id, req)
+        # 目标版本由 RunManager 按本 thread 已排队/执行中的轮次给出；前台轮次进行中时顺延一轮
+        run = run_manager.submit(thread_id, state_version, req, busy=turn_scheduler.is_busy(thread_id))
+        accepted = RunAccepted(
+            run_id=run.run_id,
+            thread_id=thread_id,
+            status=run.status,
+            state_version=state_version,
+            target_state_version=run.target_state_version,
+        )
+        return ORJSONResponseCustom(status_code=202, content=accepted.dict())
+
+    try:
+        result_state = await turn_scheduler.submit(thread_id, req)
+    except HTTPException:
+        raise
+    except Exception as ex:
+        raise HTTPException(status_code=500, detail=f"graph execution failed: {ex}")
 
     # Shape HTTP response
     try:
         return SubmitResponse.from_graph_state(result_state)
     except Exception as ex:
-        import traceback, orjson as _orjson
-        print("[submit] Response build error:", ex)
-        try:
-            print("[submit] result_state keys:", list(result_state.keys()))
-            print("[submit] result_state sample:", _orjson.dumps({k: result_state.get(k) for k in ["thread_id","state_version","current_status","requirements_document"]}).decode())
-        except Exception:
-            pass
-        traceback.print_exc()
+        log.exception(
+            "response_build_error",
+            error=str(ex),
+            keys=list(result_state.keys()),
+            sample={k: result_state.get(k) for k in ["thread_id", "state_version", "current_status", "requirements_document"]},
+        )
         raise HTTPException(status_code=500, detail=f"response build failed: {ex}")
 
 
+def _sse(event: str, data: object) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS) + b"\n\n"
+
+
+async def _stream_turn(thread_id: str, req: SubmitRequest, queue: "asyncio.Queue[Optional[bytes]]") -> dict:
+    """Run one turn with LangGraph message streaming and push SSE frames into queue.
+    Runs as a non-coalescable entry of the thread's scheduler lane.
+
+    - token：requirements_analysis_agent（并行模式下为 document_update_agent）的 LLM 原始 token；
+    - document：增量解析出的 requirements_document.content 正文增量（可边生成边渲染）；
+      文档按章节 patch 增量更新的轮次不产生 document 事件，合并后的全文随 state 返回；
+      节点内发起新的 LLM 调用（如 patch 被拒绝后的全文重写）时解析器重新开始，此前已发出过正文增量的，
+      先发送 {"reset": true} 让客户端清空已渲染的内容；
+    - node：节点完成事件；
+    - state：本轮结束后的完整快照（与 SubmitResponse 一致）；error：执行失败。
+    """
+    # 每次 LLM 调用一个解析器：消息 id 按调用区分（langchain 流式 chunk 的 id 为 "run-<run_id>"）
+    doc = {"run": None, "stream": JSONStringFieldStream([_STREAM_DOC_PATH]), "emitted": False}
+
+    async def on_chunk(chunk) -> None:
+        mode, data = chunk
+        if mode == "messages":
+            msg, meta = data
+            if (meta or {}).get("langgraph_node") not in _STREAM_DOC_NODES:
+                return
+            token = msg.content if isinstance(msg.content, str) else ""
+            if not token:
+                return
+            await queue.put(_sse("token", {"text": token}))
+            run = getattr(msg, "id", None)
+            if run != doc["run"]:
+                if doc["run"] is not None:
+                    doc["stream"] = JSONStringFieldStream([_STREAM_DOC_PATH])
+                    if doc["emitted"]:
+                        await queue.put(_sse("document", {"reset": True}))
+                        doc["emitted"] = False
+                doc["run"] = run
+            for _, delta in doc["stream"].feed(token):
+                doc["emitted"] = True
+                await queue.put(_sse("document", {"delta": delta}))
+        elif mode == "updates":
+            for node in (data or {}):
+                await queue.put(_sse("node", {"node": node}))
+
+    result_state: dict = {}
+    try:
+        init_state = await _prepare_turn(thread_id, req)
+        await queue.put(_sse("start", {"thread_id": thread_id, "state_version": int(init_state.get("state_version", 0) or 0)}))
+        result_state = await _take_speculation(thread_id, init_state)
+        if result_state is None:
+            result_state = await _execute_turn(thread_id, init_state, stream_modes=("messages", "updates"), on_chunk=on_chunk)
+        await queue.put(_sse("state", SubmitResponse.from_graph_state(result_state).dict()))
+    except Exception as ex:
+        await queue.put(_sse("error", {"detail": f"graph execution failed: {ex}"}))
+    finally:
+        await queue.put(None)
+    return result_state
+
+
+@app.post("/v1/submit/stream")
+async def submit_stream(req: SubmitRequest) -> StreamingResponse:
+    """SSE variant of /v1/submit: streams LLM tokens and partial document text while the turn runs.
+    The turn runs in its own task, so a client disconnect does not abort it (the result still lands
+    in the checkpointer and /v1/poll)."""
+    thread_id = _resolve_thread_id(req)
+    queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue()
+    task = asyncio.create_task(
+        turn_scheduler.submit(thread_id, req, fn=lambda r: _stream_turn(thread_id, r, queue))
+    )
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+
+    async def frames():
+        yield _sse("accepted", {"thread_id": thread_id})
+        while True:
+            frame = await queue.get()
+            if frame is None:
+                break
+            yield frame
+
+    return StreamingResponse(
+        frames(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/v1/runs/{run_id}", response_model=RunResponse)
+async def get_run(run_id: str) -> RunResponse:
+    """Status of a background run: queued | running | done | failed."""
+    run = run_manager.get(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return RunResponse.from_run(run)
+
+
 @app.get("/v1/poll", response_model=PollResponse)
-def poll(
+async def poll(
     thread_id: str = Query(..., description="Session/thread id"),
     client_state_version: int = Query(..., ge=0, description="Client-side last known state version"),
+    wait: float = Query(0, ge=0, le=60, description="Long-poll: seconds to wait for state_version > client_state_version"),
 ) -> PollResponse:
-    """Polling endpoint to check if server-side state_version has advanced."""
-    snapshot = state_repo.get(thread_id)
+    """Polling endpoint to check if server-side state_version has advanced.
+    With wait > 0 the request is parked on the thread's version notifier and returns as soon as
+    the version advances (or a background run finishes), otherwise after `wait` seconds."""
+    if wait > 0:
+        snapshot = await state_repo.wait_for_version(thread_id, client_state_version, wait)
+    else:
+        snapshot = await state_repo.aget(thread_id)
+    run = run_manager.latest_for_thread(thread_id)
+    run_fields = {"run_id": run.run_id, "run_status": run.status} if run else {}
     if not snapshot:
         return PollResponse(
             thread_id=thread_id,
             client_state_version=client_state_version,
             current_state_version=client_state_version,
             has_update=False,
+            **run_fields,
         )
     cur = int(snapshot.get("state_version", 0))
     return PollResponse(
@@ -254,20 +638,15 @@ def poll(
         client_state_version=client_state_version,
         current_state_version=cur,
         has_update=(cur > client_state_version),
+        **run_fields,
     )
 
 
 @app.get("/v1/state", response_model=StateResponse)
-def get_state(thread_id: str = Query(..., description="Session/thread id")) -> StateResponse:
+async def get_state(thread_id: str = Query(..., description="Session/thread id")) -> StateResponse:
     """Return the full current snapshot for a given thread_id."""
-    snapshot = state_repo.get(thread_id)
-    if not snapshot:
-        # Try reading from graph/checkpointer as a secondary source
-        try:
-            current = compiled_graph.get_state({"configurable": {"thread_id": thread_id}})
-            snapshot = current.values if hasattr(current, "values") else None
-        except Exception:
-            snapshot = None
+    # Memory first; on a miss the repository reads through to the graph/checkpointer
+    snapshot = await state_repo.aget(thread_id)
 
     if not snapshot:
         raise HTTPException(status_code=404, detail="Thread not found")
@@ -275,8 +654,37 @@ def get_state(thread_id: str = Query(..., description="Session/thread id")) -> S
     return StateResponse.from_graph_state(snapshot)
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics() -> PlainTextResponse:
+    """Prometheus text-format metrics (node/LLM/checkpointer latency histograms, fallbacks, JSON repair, in-flight turns)."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/v1/stats")
+async def stats() -> dict:
+    """Runtime counters of the in-process services (turn scheduler, background runs)."""
+    return {
+        "turn_scheduler": turn_scheduler.stats(),
+        "state_repo": state_repo.stats(),
+        "llm_pool": llm_pool_stats(),
+        "llm_resilience": resilience_stats(),
+        "llm_limits": rate_limit_stats(),
+        "logging": log_stats(),
+        "llm_cache": llm_cache_stats(),
+        "file_planner": planner_stats(),
+        "extraction": get_extraction_pool().stats(),
+        "extraction_cache": extraction_cache_stats(),
+        "prompt": prompt_stats.snapshot(),
+        "question_ids": id_alias_stats(),
+        "doc_patch": doc_patch_stats(),
+        "structured_output": structured_output_stats(),
+        "speculation": speculator.stats() if speculator is not None else None,
+        "runs": {"queued": run_manager.queued()},
+    }
+
+
 @app.get("/health")
-def health() -> dict:
+async def health() -> dict:
     return {
         "status": "ok",
         "redis": bool(get_redis_url()),
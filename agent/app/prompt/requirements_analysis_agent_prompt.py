@@ -15,12 +15,12 @@ REQUIREMENTS_SYSTEM = (
     "   - current_status: 必须是\"clarifying\"或\"completed\"\n"
     "\n"
     "2. 每个问题必须包含以下字段：\n"
-    "   - question_id: 字符串，如\"q1\"、\"q2\"、\"q3\"\n"
+    "   - question_id: 字符串；继续追问“现有问题”中未回答的问题时沿用其 question_id，新问题从\"{next_question_id}\"起顺序编号\n"
     "   - content: 字符串，问题的具体内容\n"
     "   - suggestion_options: 必须是包含恰好3个选项的数组\n"
     "\n"
     "3. 每个选项必须包含以下字段：\n"
-    "   - option_id: 字符串，如\"A\"、\"B\"、\"C\"\n"
+    "   - option_id: 字符串，题内依次为\"A\"、\"B\"、\"C\"（沿用的问题保留原选项的 option_id）\n"
     "   - content: 字符串，选项的具体内容\n"
     "   - selected: 布尔值，必须为false\n"
     "\n"
@@ -59,7 +59,7 @@ REQUIREMENTS_HUMAN = (
     "用户输入：{human_message}\n\n"
     "文件列表（含内容与错误信息）：{files}\n\n"
     "当前文档：{current_document}\n\n"
-    "现有问题：{question_list}\n\n"
+    "现有问题（已回答的问题仅列出 selected_options，未回答的问题列出 suggestion_options）：{question_list}\n\n"
     "当前状态：{current_status}，版本：{state_version}\n\n"
     "请基于以上信息：\n"
     "1. 更新需求文档内容，尽量保持文档的连贯性和完整，文档需要是markdown格式，标题、子标题、内容层次分明，有条理\n"
@@ -74,4 +74,68 @@ REQUIREMENTS_HUMAN = (
     "- 日期格式必须为YYYY-MM-DD\n"
     "\n"
     "请严格按照上述格式输出JSON："
-)
\ No newline at end of file
+)
+
+# 增量模式：文档较长时，LLM 只输出章节级修改（patch），由 app.services.doc_patch 合并进当前文档
+REQUIREMENTS_PATCH_SYSTEM = (
+    "你是资深需求工程师。\n"
+    "目标：在每轮交互中迭代完善需求文档，并生成3个由浅入深的问题，每个问题必须提供3个具体的建议选项。\n"
+    "\n"
+    "task：\n"
+    "1、根据用户输入中的现有问题内容，确定用户对该问题的解答 {question_list} 中包含本轮问题与用户给出的答案，同时参考 {human_message} 中用户的补充说明\n"
+    "2、如果用户对某一问题的回答是结合最佳实践提供建议，需要找到该问题在当下的最佳实践作为该问题的答案\n"
+    "3、将问题的答案合并进当前需求文档：只输出需要修改或新增的章节（patch），不要重复输出未变化的内容；修改的章节必须完整陈述，禁止提炼、精简\n"
+    "4、审查更新后的需求文档，找出可以继续跟进澄清的三个问题，并为每个问题提供三个可选择项\n"
+    "输出格式要求（必须严格遵守）：\n"
+    "1. 必须输出完整的JSON对象，包含且仅包含以下三个字段：\n"
+    "   - requirements_document: 包含version(string)、last_updated(string, YYYY-MM-DD格式)和patch(数组)\n"
+    "   - question_list: 必须是包含恰好3个问题的数组\n"
+    "   - current_status: 必须是\"clarifying\"或\"completed\"\n"
+    "\n"
+    "2. patch 中每个操作按标题路径（path，由各级标题文字组成的数组，可省略文档总标题）定位章节：\n"
+    "   - {{\"op\": \"replace\", \"path\": [...], \"content\": \"...\"}}：替换该章节标题下的全部正文（含其子章节），content 不含该章节标题行\n"
+    "   - {{\"op\": \"append\", \"path\": [...], \"content\": \"...\"}}：在该章节末尾追加 markdown 内容；path 为空数组表示追加到文末\n"
+    "   - {{\"op\": \"insert\", \"path\": [...], \"heading\": \"新章节标题\", \"content\": \"...\", \"after\": \"兄弟章节标题(可选)\"}}：在 path 指定章节下新增子章节（heading 不含 #）\n"
+    "   - path 必须与当前文档中的标题文字完全一致且唯一；文档无需修改时 patch 为空数组\n"
+    "\n"
+    "3. 每个问题必须包含以下字段：\n"
+    "   - question_id: 字符串；继续追问“现有问题”中未回答的问题时沿用其 question_id，新问题从\"{next_question_id}\"起顺序编号\n"
+    "   - content: 字符串，问题的具体内容\n"
+    "   - suggestion_options: 必须是包含恰好3个选项的数组，每个选项包含 option_id（题内依次为\"A\"、\"B\"、\"C\"）、content、selected（必须为false）\n"
+    "\n"
+    "4. 其他要求：\n"
+    "   - 仅输出JSON，不包含任何解释、前后缀、Markdown或代码块标记\n"
+    "   - 所有字段名称必须与上述完全一致\n"
+    "\n"
+    "示例输出（严格按此结构）：\n"
+    "{{\n"
+    '  "requirements_document": {{"version": "3", "last_updated": "2024-09-01", "patch": [\n'
+    '    {{"op": "replace", "path": ["目标用户"], "content": "面向中小企业的行政人员..."}},\n'
+    '    {{"op": "insert", "path": ["非功能需求"], "heading": "安全", "content": "- 登录需支持双因素认证"}}\n'
+    '  ]}},\n'
+    '  "question_list": [\n'
+    '    {{"question_id": "q1", "content": "问题1", "suggestion_options": [\n'
+    '      {{"option_id": "A", "content": "建议选项1", "selected": false}},\n'
+    '      {{"option_id": "B", "content": "建议选项2", "selected": false}},\n'
+    '      {{"option_id": "C", "content": "建议选项3", "selected": false}}\n'
+    '    ]}}\n'
+    '  ],\n'
+    '  "current_status": "clarifying"\n'
+    "}}\n"
+    "   - question_list 必须有恰好3个问题（示例仅展示1个）\n"
+    "   - 当识别到用户明确要求终止澄清时，将current_status设置为\"completed\"；否则保持为\"clarifying\"\n"
+)
+
+REQUIREMENTS_PATCH_HUMAN = (
+    "用户输入：{human_message}\n\n"
+    "文件列表（含内容与错误信息）：{files}\n\n"
+    "当前文档：{current_document}\n\n"
+    "现有问题（已回答的问题仅列出 selected_options，未回答的问题列出 suggestion_options）：{question_list}\n\n"
+    "当前状态：{current_status}，版本：{state_version}\n\n"
+    "请基于以上信息：\n"
+    "1. 以 patch 的形式更新需求文档，只包含需要修改或新增的章节，保持 markdown 标题层次\n"
+    "2. 生成3个澄清问题，每个问题提供3个选项，选项需要符合问题在当下的最佳实践\n"
+    "3. 判断是否需要继续澄清（除非用户明确要求终止，否则保持clarifying状态）\n"
+    "\n"
+    "请严格按照上述格式输出JSON："
+)
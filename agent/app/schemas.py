@@ -56,6 +56,7 @@ class FileInfoOut(FileInfoIn):
     message_id: Optional[str] = None
     file_content: Optional[str] = None
     extract_error: Optional[str] = None
+    extract_latency_ms: Optional[float] = None
 
 
 class SubmitRequest(BaseModel):
@@ -149,11 +150,55 @@ class SubmitResponse(BaseModel):
         )
 
 
+RunStatus = Literal["queued", "running", "done", "failed"]
+
+
 class PollResponse(BaseModel):
     thread_id: str
     client_state_version: int
     current_state_version: int
     has_update: bool
+    # 最近一次后台 run（/v1/submit?background=true）的状态；同步提交时为空
+    run_id: Optional[str] = None
+    run_status: Optional[RunStatus] = None
+
+
+class RunAccepted(BaseModel):
+    """202 响应：本轮已排队，客户端通过 /v1/poll 或 /v1/runs/{run_id} 等待完成。"""
+    run_id: str
+    thread_id: str
+    status: RunStatus
+    state_version: int
+    target_state_version: int
+
+
+class RunResponse(BaseModel):
+    run_id: str
+    thread_id: str
+    status: RunStatus
+    target_state_version: int
+    state_version: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    @classmethod
+    def from_run(cls, run) -> "RunResponse":
+        def ts(v):
+            return datetime.fromtimestamp(v) if v is not None else None
+
+        return cls(
+            run_id=run.run_id,
+            thread_id=run.thread_id,
+            status=run.status,
+            target_state_version=run.target_state_version,
+            state_version=run.state_version,
+            error=run.error,
+            created_at=ts(run.created_at),
+            started_at=ts(run.started_at),
+            finished_at=ts(run.finished_at),
+        )
 
 
 class StateResponse(SubmitResponse):
@@ -0,0 +1,144 @@
+"""
+需求文档的章节级增量更新（patch）
+
+成熟会话的需求文档很长，每轮让 LLM 在 JSON 中重新输出整篇 markdown，输出 token（最慢、最贵的部分）随文档线性增长。
+增量模式下 LLM 只返回按标题路径定位的章节操作，由本模块确定性地合并进 requirements_document.content：
+
+    {"op": "replace", "path": ["功能需求", "登录"], "content": "..."}   # 替换该章节正文（含其子章节）
+    {"op": "append",  "path": ["非功能需求"], "content": "..."}         # 追加到该章节末尾（子章节之后）；path 为空表示文末
+    {"op": "insert",  "path": ["功能需求"], "heading": "支付", "content": "...", "after": "登录"}
+                                                                        # 新增子章节：默认作为最后一个子章节，after 指定插在某个兄弟章节之后
+
+- 标题按 ATX（# ~ ######）解析，忽略代码块内的 #；比较时去掉首尾空白与结尾的 #，不区分大小写；
+- path 可以省略开头的祖先标题（如文档总标题），但必须唯一定位一个章节，否则抛出 PatchError；
+- 操作按顺序逐条应用，每条之后重新解析；任何一条失败则整份 patch 作废（由调用方回退为整篇重写）。
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence
+
+_HEADING_RE = re.compile(r"^(#{1,6})[ \t]+(.*?)[ \t]*#*[ \t]*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_OPS = ("replace", "append", "insert")
+
+
+class PatchError(ValueError):
+    pass
+
+
+@dataclass
+class _Section:
+    level: int
+    title: str
+    path: List[str]
+    start: int  # 标题行
+    end: int  # 下一个同级或更高级标题（不含）
+
+
+def _norm(title: Any) -> str:
+    return str(title).strip().strip("#").strip().lower()
+
+
+def parse_sections(lines: Sequence[str]) -> List[_Section]:
+    sections: List[_Section] = []
+    stack: List[_Section] = []
+    in_fence = False
+    for i, line in enumerate(lines):
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+            continue
+        m = None if in_fence else _HEADING_RE.match(line)
+        if not m:
+            continue
+        level = len(m.group(1))
+        while stack and stack[-1].level >= level:
+            stack.pop().end = i
+        sec = _Section(level, m.group(2), [s.title for s in stack] + [m.group(2)], i, len(lines))
+        sections.append(sec)
+        stack.append(sec)
+    return sections
+
+
+def _find(sections: List[_Section], path: Sequence[str]) -> _Section:
+    want = [_norm(p) for p in path]
+    matches = [s for s in sections if [_norm(t) for t in s.path[-len(want):]] == want and len(s.path) >= len(want)]
+    if not matches:
+        raise PatchError(f"section not found: {' > '.join(map(str, path))}")
+    if len(matches) > 1:
+        raise PatchError(f"ambiguous section path: {' > '.join(map(str, path))}")
+    return matches[0]
+
+
+def _body(content: Any) -> List[str]:
+    text = str(content or "").strip("\n")
+    return text.split("\n") if text else []
+
+
+def _apply_one(lines: List[str], op: Dict[str, Any]) -> List[str]:
+    if not isinstance(op, dict) or op.get("op") not in _OPS:
+        raise PatchError(f"invalid op: {op!r}")
+    path = op.get("path") or []
+    if isinstance(path, str):
+        path = [path]
+    if not isinstance(path, list) or not all(isinstance(p, str) and p.strip() for p in path):
+        raise PatchError(f"invalid path: {path!r}")
+    if not isinstance(op.get("content", ""), str):
+        raise PatchError("content must be a string")
+    sections = parse_sections(lines)
+    kind = op["op"]
+    content = _body(op.get("content"))
+
+    if kind == "replace":
+        if not path:
+            raise PatchError("replace requires a section path")
+        sec = _find(sections, path)
+        return lines[: sec.start + 1] + content + ([""] if content else []) + lines[sec.end :]
+
+    if kind == "append":
+        end = _find(sections, path).end if path else len(lines)
+        head = lines[:end]
+        while head and not head[-1].strip():
+            head.pop()
+        return head + [""] + content + [""] + lines[end:]
+
+    # insert：新建子章节
+    heading = op.get("heading")
+    if not isinstance(heading, str) or not heading.strip():
+        raise PatchError("insert requires a heading")
+    if path:
+        parent = _find(sections, path)
+        level, end = parent.level + 1, parent.end
+        siblings = [s for s in sections if s.path[:-1] == parent.path and s.level == level]
+    else:
+        top = min((s.level for s in sections), default=1)
+        level, end = top, len(lines)
+        siblings = [s for s in sections if s.level == top]
+    if level > 6:
+        raise PatchError("heading too deep")
+    if _norm(heading) in {_norm(s.title) for s in siblings}:
+        raise PatchError(f"section already exists: {heading}")
+    after = op.get("after")
+    if after:
+        anchor = [s for s in siblings if _norm(s.title) == _norm(after)]
+        if len(anchor) != 1:
+            raise PatchError(f"insert anchor not found: {after}")
+        end = anchor[0].end
+    head = lines[:end]
+    while head and not head[-1].strip():
+        head.pop()
+    block = ["#" * level + " " + heading.strip().lstrip("#").strip()] + content
+    return head + ([""] if head else []) + block + [""] + lines[end:]
+
+
+def apply_patch(document: str, ops: Any) -> str:
+    """将 ops 依次应用到 document；任一操作无效时抛出 PatchError（document 不变）。"""
+    if not isinstance(ops, list):
+        raise PatchError("patch must be a list of operations")
+    lines = (document or "").split("\n")
+    for op in ops:
+        lines = _apply_one(lines, op)
+    out = "\n".join(lines)
+    return re.sub(r"\n{3,}", "\n\n", out).strip("\n") + "\n"
+
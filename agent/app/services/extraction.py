@@ -0,0 +1,176 @@
+"""
+并发、有界的文件提取
+
+file_toolscall_agent 选出本轮需要提取的文件后，交由 ExtractionPool 在有界线程池中并发执行：
+- 单文件超时：从该文件开始执行起计时（排队时间不计入），超时的文件记录 extract_error，不阻塞本轮；
+- 本轮截止时间：到期后尚未完成的文件全部记录 extract_error，已完成的结果照常返回（部分结果）；
+- 每个文件记录提取耗时（latency_ms），池级累计计数通过 stats() 暴露。
+
+注意：线程无法被强制终止，超时文件的工作线程会在后台自然结束，其结果被丢弃。
+"""
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures as cf
+import time
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.utils.env import (
+    get_extract_workers,
+    get_extract_file_timeout_seconds,
+    get_extract_turn_timeout_seconds,
+)
+
+# (file_id, fn)：fn 返回 (写入 file_content 的文本, 提取缓存键)
+Job = Tuple[str, Callable[[], Tuple[str, Optional[str]]]]
+
+
+@dataclass
+class ExtractionResult:
+    file_id: str
+    content: Optional[str] = None
+    content_key: Optional[str] = None
+    error: Optional[str] = None
+    latency_ms: Optional[float] = None
+
+
+class ExtractionPool:
+    def __init__(self, workers: int = 8, file_timeout: float = 20.0, turn_timeout: float = 45.0) -> None:
+        self.workers = workers
+        self.file_timeout = file_timeout
+        self.turn_timeout = turn_timeout
+        self._executor = cf.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract")
+        self._lock = Lock()
+        self.extracted = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.total_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+
+    def extract_many(self, jobs: List[Job]) -> Dict[str, ExtractionResult]:
+        """同步版本（sync 节点在工作线程中调用）。"""
+        run = _Batch(self, jobs)
+        while run.pending:
+            timeout = run.expire()
+            if not run.pending:
+                break
+            done, _ = cf.wait(run.pending, timeout=timeout, return_when=cf.FIRST_COMPLETED)
+            run.collect(done)
+        return self._finish(run)
+
+    async def aextract_many(self, jobs: List[Job]) -> Dict[str, ExtractionResult]:
+        """异步版本：等待期间不占用事件循环。"""
+        run = _Batch(self, jobs)
+        wrapped = {asyncio.wrap_future(f): f for f in run.pending}
+        while run.pending:
+            timeout = run.expire()
+            if not run.pending:
+                break
+            waiting = [w for w, f in wrapped.items() if f in run.pending]
+            done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            run.collect({wrapped[w] for w in done})
+        for w in wrapped:
+            if not w.done():
+                w.cancel()
+            elif not w.cancelled():
+                w.exception()  # 结果已从 concurrent future 读取，这里仅标记为已获取
+        return self._finish(run)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self.extracted + self.failed
+            return {
+                "workers": self.workers,
+                "extracted": self.extracted,
+                "failed": self.failed,
+                "timed_out": self.timed_out,
+                "avg_latency_ms": round(self.total_latency_ms / finished, 1) if finished else 0.0,
+                "max_latency_ms": round(self.max_latency_ms, 1),
+            }
+
+    def _finish(self, run: "_Batch") -> Dict[str, ExtractionResult]:
+        with self._lock:
+            for r in run.results.values():
+                if r.error is None:
+                    self.extracted += 1
+                else:
+                    self.failed += 1
+                if r.latency_ms is not None:
+                    self.total_latency_ms += r.latency_ms
+                    self.max_latency_ms = max(self.max_latency_ms, r.latency_ms)
+            self.timed_out += run.timed_out
+        return run.results
+
+
+class _Batch:
+    """一轮提取的簿记：提交、按开始时间计算单文件截止、收集结果。"""
+
+    def __init__(self, pool: ExtractionPool, jobs: List[Job]) -> None:
+        self.pool = pool
+        self.deadline = time.monotonic() + pool.turn_timeout
+        self.started: Dict[str, float] = {}
+        self.results: Dict[str, ExtractionResult] = {}
+        self.timed_out = 0
+        self.pending: Dict[cf.Future, str] = {}
+        for file_id, fn in jobs:
+            self.pending[pool._executor.submit(self._run, file_id, fn)] = file_id
+
+    def _run(self, file_id: str, fn: Callable[[], Tuple[str, Optional[str]]]) -> Tuple[Tuple[str, Optional[str]], float]:
+        t0 = time.monotonic()
+        self.started[file_id] = t0
+        output = fn()
+        return output, (time.monotonic() - t0) * 1000
+
+    def collect(self, done) -> None:
+        for fut in done:
+            file_id = self.pending.pop(fut)
+            try:
+                (content, content_key), latency_ms = fut.result()
+                self.results[file_id] = ExtractionResult(file_id, content=content, content_key=content_key, latency_ms=latency_ms)
+            except Exception as e:
+                started = self.started.get(file_id)
+                latency_ms = (time.monotonic() - started) * 1000 if started else None
+                self.results[file_id] = ExtractionResult(file_id, error=str(e) or type(e).__name__, latency_ms=latency_ms)
+
+    def expire(self) -> Optional[float]:
+        """将已超时的文件记为失败；返回距离下一个截止点的等待秒数。"""
+        now = time.monotonic()
+        turn_over = now >= self.deadline
+        next_deadline = self.deadline
+        for fut, file_id in list(self.pending.items()):
+            if fut.done():
+                continue
+            started = self.started.get(file_id)
+            if turn_over:
+                self._timeout(fut, file_id, started, now, "extraction exceeded the turn deadline")
+            elif started is not None and now >= started + self.pool.file_timeout:
+                self._timeout(fut, file_id, started, now, f"extraction timed out after {self.pool.file_timeout:g}s")
+            else:
+                # 尚未开始的文件：截止点不早于 now + file_timeout（开始时间只会更晚）
+                next_deadline = min(next_deadline, (started if started is not None else now) + self.pool.file_timeout)
+        return max(0.0, next_deadline - now)
+
+    def _timeout(self, fut: cf.Future, file_id: str, started: Optional[float], now: float, message: str) -> None:
+        fut.cancel()
+        del self.pending[fut]
+        self.timed_out += 1
+        latency_ms = (now - started) * 1000 if started is not None else None
+        self.results[file_id] = ExtractionResult(file_id, error=message, latency_ms=latency_ms)
+
+
+_pool: Optional[ExtractionPool] = None
+_pool_lock = Lock()
+
+
+def get_extraction_pool() -> ExtractionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExtractionPool(
+                workers=get_extract_workers(),
+                file_timeout=get_extract_file_timeout_seconds(),
+                turn_timeout=get_extract_turn_timeout_seconds(),
+            )
+        return _pool
@@ -0,0 +1,192 @@
+"""
+内容寻址的文件提取缓存
+
+同一份规格书 PDF 常被附加到多个 thread、或在后续轮次重复附加；每次都重新解析代价很高。
+本缓存位于所有提取器之前（FileTools.extract_file 调用）：
+
+- 键：文件内容 sha256 + 字符预算（同一内容、同一预算的提取结果相同）；
+- 快速路径：(path, size, mtime_ns) → sha256 的索引，文件未变化时连哈希都不用重算；
+  索引未命中时流式计算哈希再查内容表（不同路径的相同文件也能命中）；
+- 存储：本地 SQLite（AGENT_EXTRACT_CACHE_PATH，默认 .cache/extractions.sqlite3），
+  保存提取文本与元数据（提取器、原始大小、耗时），按总字节数做 LRU 淘汰；
+- AGENT_EXTRACT_CACHE_MAX_MB=0 关闭缓存。
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import time
+from threading import RLock
+from typing import Any, Dict, Optional
+
+from app.utils.env import get_extract_cache_path, get_extract_cache_max_bytes
+from app.utils.log import get_logger
+
+log = get_logger("extraction_cache")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extractions (
+    key TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    file_size INTEGER NOT NULL,
+    extractor TEXT,
+    extract_ms REAL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_extractions_last_access ON extractions(last_access);
+CREATE TABLE IF NOT EXISTS file_index (
+    path TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (path, file_size, mtime_ns)
+);
+"""
+
+_HASH_CHUNK = 1024 * 1024
+_PRUNE_EVERY = 16
+
+
+def file_sha256(file_path: str) -> str:
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ExtractionCache:
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = RLock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.hashes_computed = 0
+        self.evictions = 0
+        self._prune()
+
+    def content_hash(self, file_path: str) -> str:
+        """(path, size, mtime_ns) 索引命中时直接返回哈希，否则流式计算并写入索引。"""
+        st = os.stat(file_path)
+        ident = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256 FROM file_index WHERE path = ? AND file_size = ? AND mtime_ns = ?", ident
+            ).fetchone()
+        if row is not None:
+            return row[0]
+        digest = file_sha256(file_path)
+        with self._lock:
+            self.hashes_computed += 1
+            # 同一路径只保留最新版本的索引
+            self._conn.execute("DELETE FROM file_index WHERE path = ?", (ident[0],))
+            self._conn.execute("INSERT OR REPLACE INTO file_index VALUES (?, ?, ?, ?)", (*ident, digest))
+        return digest
+
+    @staticmethod
+    def make_key(digest: str, max_chars: int) -> str:
+        return f"{digest}:{max_chars}"
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT content FROM extractions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE extractions SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, content: str, file_size: int, extractor: Optional[str], extract_ms: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, content, len(content.encode("utf-8")), file_size, extractor, extract_ms, now, now),
+            )
+            self._puts += 1
+            if self._puts % _PRUNE_EVERY == 0:
+                self._prune()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "hashes_computed": self.hashes_computed,
+                "evictions": self.evictions,
+            }
+
+    def _prune(self) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._evict()
+                # 索引中指向已淘汰（或从未写入，如提取失败）内容的行一并删除，否则索引随上传路径数无限增长。
+                # 键为 "<sha256>:<max_chars>"，按前缀范围查找（':' 之后的字符是 ';'），可走主键索引
+                self._conn.execute(
+                    "DELETE FROM file_index WHERE NOT EXISTS ("
+                    "SELECT 1 FROM extractions WHERE key >= file_index.sha256 || ':' AND key < file_index.sha256 || ';')"
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self) -> None:
+        (size,) = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()
+        if size <= self.max_bytes:
+            return
+        # 超限：按最近访问从旧到新删除，直到回到上限的 90%
+        target = int(self.max_bytes * 0.9)
+        doomed = []
+        for key, row_size in self._conn.execute("SELECT key, size FROM extractions ORDER BY last_access"):
+            if size <= target:
+                break
+            doomed.append((key,))
+            size -= row_size
+        self._conn.executemany("DELETE FROM extractions WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+
+_cache: Optional[ExtractionCache] = None
+_cache_lock = RLock()
+_disabled = False
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    global _cache, _disabled
+    if _disabled or get_extract_cache_max_bytes() <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = ExtractionCache(get_extract_cache_path(), get_extract_cache_max_bytes())
+            except Exception as e:
+                _disabled = True
+                log.warning("disabled", path=get_extract_cache_path(), error=str(e))
+                return None
+        return _cache
+
+
+def extraction_cache_stats() -> Optional[Dict[str, Any]]:
+    cache = get_extraction_cache()
+    return cache.stats() if cache is not None else None
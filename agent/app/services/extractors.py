@@ -0,0 +1,297 @@
+"""
+按文件类型注册的文本提取器
+
+- 以 MIME 类型与扩展名为键注册提取器；FileTools.extract_file 通过 resolve_extractor 选择；
+- 每个提取器是生成器：按页（PDF）/段落（DOCX）/工作表行（XLSX）/幻灯片（PPTX）逐块产出文本，
+  调用方在达到字符预算后关闭生成器，因此大文件无需完整解析，也不会整体载入内存；
+- 纯 Python 实现：PDF 使用 pypdf（可选依赖，缺失时报错提示安装）；
+  DOCX/XLSX/PPTX 为 OOXML（zip + XML），使用标准库 zipfile + ElementTree.iterparse 流式解析。
+
+扩展：
+    @register_extractor(mimes=("application/rtf",), extensions=(".rtf",))
+    def _extract_rtf(file_path: str) -> Iterator[str]:
+        ...
+"""
+from __future__ import annotations
+
+import os
+import re
+import zipfile
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from xml.etree import ElementTree
+
+try:
+    from pypdf import PdfReader  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    PdfReader = None  # type: ignore
+
+Extractor = Callable[[str], Iterator[str]]
+
+_BY_MIME: Dict[str, Extractor] = {}
+_BY_EXT: Dict[str, Extractor] = {}
+
+# 编码探测时读取的字节数
+_SNIFF_BYTES = 64 * 1024
+_TEXT_READ_CHARS = 64 * 1024
+
+
+class UnsupportedFileType(Exception):
+    pass
+
+
+def register_extractor(mimes: Iterable[str] = (), extensions: Iterable[str] = ()):
+    def decorator(fn: Extractor) -> Extractor:
+        for m in mimes:
+            _BY_MIME[m.lower()] = fn
+        for e in extensions:
+            _BY_EXT[e.lower()] = fn
+        return fn
+
+    return decorator
+
+
+def resolve_extractor(file_path: str, file_type: Optional[str] = None) -> Extractor:
+    """扩展名 → MIME 精确匹配 → text/* → 内容嗅探（无 NUL 字节视为文本）。
+
+    扩展名优先：浏览器上报的 MIME 常为 application/octet-stream 或与实际格式不符。
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext in _BY_EXT:
+        return _BY_EXT[ext]
+    mime = (file_type or "").split(";")[0].strip().lower()
+    if mime in _BY_MIME:
+        return _BY_MIME[mime]
+    if mime.startswith("text/") or _looks_like_text(file_path):
+        return extract_plain_text
+    raise UnsupportedFileType(f"unsupported file type: {file_type or ext or 'unknown'}")
+
+
+def extract_text(file_path: str, file_type: Optional[str] = None, max_chars: int = 8000) -> str:
+    """逐块读取直到达到 max_chars，超出部分截断并标注。"""
+    chunks = resolve_extractor(file_path, file_type)(file_path)
+    parts: List[str] = []
+    total = 0
+    truncated = False
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if total + len(chunk) > max_chars:
+                parts.append(chunk[: max_chars - total])
+                truncated = True
+                break
+            parts.append(chunk)
+            total += len(chunk)
+    finally:
+        # 提前结束时关闭生成器，释放文件句柄，不再解析剩余页/表
+        chunks.close()  # type: ignore[attr-defined]
+    content = "".join(parts).strip()
+    if truncated:
+        content += "\n... [truncated]"
+    return content
+
+
+# ---- plain text ----
+
+def _looks_like_text(file_path: str) -> bool:
+    try:
+        with open(file_path, "rb") as f:
+            head = f.read(4096)
+    except OSError:
+        return False
+    return b"\x00" not in head
+
+
+def _detect_encoding(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        head = f.read(_SNIFF_BYTES)
+    for encoding in ("utf-8-sig", "gb18030"):
+        try:
+            head.decode(encoding)
+            return encoding
+        except UnicodeDecodeError as e:
+            # 截断在多字节字符中间不算失败
+            if e.start >= len(head) - 4:
+                return encoding
+    return "utf-8"
+
+
+@register_extractor(
+    mimes=("text/plain", "text/markdown", "text/csv", "application/json", "application/xml", "application/x-yaml"),
+    extensions=(".txt", ".md", ".markdown", ".csv", ".json", ".xml", ".yaml", ".yml", ".log"),
+)
+def extract_plain_text(file_path: str) -> Iterator[str]:
+    if not _looks_like_text(file_path):
+        raise UnsupportedFileType("binary content cannot be extracted as text")
+    with open(file_path, "r", encoding=_detect_encoding(file_path), errors="replace") as f:
+        while True:
+            chunk = f.read(_TEXT_READ_CHARS)
+            if not chunk:
+                return
+            yield chunk
+
+
+# ---- PDF ----
+
+@register_extractor(mimes=("application/pdf",), extensions=(".pdf",))
+def extract_pdf(file_path: str) -> Iterator[str]:
+    if PdfReader is None:
+        raise UnsupportedFileType("PDF extraction requires pypdf: pip install pypdf")
+    reader = PdfReader(file_path)  # 仅解析交叉引用表，页面内容按需解析
+    for i, page in enumerate(reader.pages, start=1):
+        text = page.extract_text() or ""
+        if text.strip():
+            yield f"[Page {i}]\n{text.strip()}\n\n"
+
+
+# ---- OOXML (DOCX / XLSX / PPTX) ----
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _iter_paragraphs(zf: zipfile.ZipFile, member: str, paragraph_tag: str = "p", keep_empty: bool = False) -> Iterator[str]:
+    """流式遍历 XML，按段落产出 <t> 文本；处理完的元素立即清理以限制内存。
+
+    只有 run（<r>）内的 <tab> 是文本中的制表符；段落属性里的 <tabs>/<tabLst> 是制表位定义，不输出。
+    """
+    with zf.open(member) as fh:
+        texts: List[str] = []
+        in_run = 0
+        for event, el in ElementTree.iterparse(fh, events=("start", "end")):
+            name = _local(el.tag)
+            if event == "start":
+                if name == "r":
+                    in_run += 1
+                continue
+            if name == "r":
+                in_run -= 1
+            elif name == "t" and el.text:
+                texts.append(el.text)
+            elif name == "tab" and in_run:
+                texts.append("\t")
+            elif name == paragraph_tag:
+                if texts or keep_empty:
+                    yield "".join(texts)
+                texts = []
+                el.clear()
+
+
+@register_extractor(
+    mimes=("application/vnd.openxmlformats-officedocument.wordprocessingml.document",),
+    extensions=(".docx",),
+)
+def extract_docx(file_path: str) -> Iterator[str]:
+    with zipfile.ZipFile(file_path) as zf:
+        for paragraph in _iter_paragraphs(zf, "word/document.xml"):
+            yield paragraph + "\n"
+
+
+def _natural_key(name: str):
+    return [int(t) if t.isdigit() else t for t in re.split(r"(\d+)", name)]
+
+
+@register_extractor(
+    mimes=("application/vnd.openxmlformats-officedocument.presentationml.presentation",),
+    extensions=(".pptx",),
+)
+def extract_pptx(file_path: str) -> Iterator[str]:
+    with zipfile.ZipFile(file_path) as zf:
+        slides = sorted(
+            (n for n in zf.namelist() if re.fullmatch(r"ppt/slides/slide\d+\.xml", n)),
+            key=_natural_key,
+        )
+        for i, member in enumerate(slides, start=1):
+            lines = list(_iter_paragraphs(zf, member))
+            if lines:
+                yield f"[Slide {i}]\n" + "\n".join(lines) + "\n\n"
+
+
+def _xlsx_shared_strings(zf: zipfile.ZipFile) -> List[str]:
+    if "xl/sharedStrings.xml" not in zf.namelist():
+        return []
+    # 空字符串也要占位，保证下标与 <c t="s"> 的索引一致
+    return list(_iter_paragraphs(zf, "xl/sharedStrings.xml", paragraph_tag="si", keep_empty=True))
+
+
+def _xlsx_column(ref: Optional[str]) -> Optional[int]:
+    """单元格引用（如 "C1"）→ 从 0 开始的列号；缺失或无法解析时返回 None。"""
+    letters = re.match(r"[A-Za-z]+", ref or "")
+    if not letters:
+        return None
+    col = 0
+    for ch in letters.group(0).upper():
+        col = col * 26 + ord(ch) - ord("A") + 1
+    return col - 1
+
+
+def _xlsx_sheets(zf: zipfile.ZipFile) -> List[tuple]:
+    """[(sheet_name, member)]，按工作簿中的顺序。"""
+    rels: Dict[str, str] = {}
+    if "xl/_rels/workbook.xml.rels" in zf.namelist():
+        root = ElementTree.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+        for rel in root:
+            target = rel.get("Target", "")
+            target = target.lstrip("/") if target.startswith("/") else "xl/" + target
+            rels[rel.get("Id", "")] = target
+    sheets = []
+    root = ElementTree.fromstring(zf.read("xl/workbook.xml"))
+    for el in root.iter():
+        if _local(el.tag) == "sheet":
+            rid = next((v for k, v in el.attrib.items() if _local(k) == "id"), None)
+            member = rels.get(rid or "")
+            if member and member in zf.namelist():
+                sheets.append((el.get("name") or member, member))
+    return sheets
+
+
+@register_extractor(
+    mimes=("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",),
+    extensions=(".xlsx", ".xlsm"),
+)
+def extract_xlsx(file_path: str) -> Iterator[str]:
+    with zipfile.ZipFile(file_path) as zf:
+        shared = _xlsx_shared_strings(zf)
+        for name, member in _xlsx_sheets(zf):
+            yield f"[Sheet {name}]\n"
+            with zf.open(member) as fh:
+                row: List[str] = []
+                cell_type = None
+                cell_col = None
+                value = None
+                for event, el in ElementTree.iterparse(fh, events=("start", "end")):
+                    tag = _local(el.tag)
+                    if event == "start":
+                        if tag == "c":
+                            cell_type, cell_col, value = el.get("t"), _xlsx_column(el.get("r")), None
+                        continue
+                    if tag == "v":
+                        value = el.text
+                    elif tag == "t" and cell_type == "inlineStr":
+                        value = el.text
+                    elif tag == "c":
+                        if cell_type == "s" and value is not None:
+                            try:
+                                value = shared[int(value)]
+                            except (ValueError, IndexError):
+                                pass
+                        # 稀疏行只写出有值的单元格：按引用中的列号补齐空单元格，保持列对齐
+                        if cell_col is not None and cell_col > len(row):
+                            row.extend([""] * (cell_col - len(row)))
+                        row.append(value or "")
+                        el.clear()
+                    elif tag == "row":
+                        if any(row):
+                            yield "\t".join(row).rstrip("\t") + "\n"
+                        row = []
+                        el.clear()
+            yield "\n"
+
+
+@register_extractor(
+    mimes=("application/msword", "application/vnd.ms-excel", "application/vnd.ms-powerpoint"),
+    extensions=(".doc", ".xls", ".ppt"),
+)
+def _extract_legacy_office(file_path: str) -> Iterator[str]:
+    raise UnsupportedFileType("legacy Office binary formats are not supported; please upload .docx/.xlsx/.pptx")
+    yield ""  # pragma: no cover - makes this a generator
@@ -0,0 +1,135 @@
+"""
+问题/选项 ID 的短别名编解码
+
+question_list 中的 question_id / option_id 是 36 字符的 UUID，而 prompt 要求 LLM 输出 "q1"/"A" 形式的 ID。
+直接把 UUID 发给 LLM 既浪费 token，又会在校验阶段被丢弃并重新生成 UUID，导致同一问题在每轮落库时都是新行。
+
+QuestionIdCodec 在组装 prompt 前把 UUID 映射为短别名，在解析输出后再映射回原 UUID：
+
+- encode：问题按顺序编号 q1..qN，选项在题内编号 A..C；
+  已回答的问题只发送被选中的选项（selected_options），未回答的问题连同全部选项一并发送（suggestion_options）；
+- decode：输出中引用了“未回答问题”别名的问题沿用原 question_id；其选项按别名（或相同内容）沿用原 option_id；
+  已回答问题的别名、未知别名以及重复引用一律生成新的 UUID，避免覆盖已有记录；
+- next_alias：新问题应使用的起始编号（q{N+1}），写入 prompt 以减少与已有别名的冲突。
+"""
+from __future__ import annotations
+
+import string
+from threading import Lock
+from typing import Any, Callable, Dict, List, Tuple
+from uuid import uuid4
+
+_OPTION_ALIASES = string.ascii_uppercase
+
+
+def _uuid() -> str:
+    return str(uuid4())
+
+
+def _norm(alias: Any) -> str:
+    return str(alias or "").strip().lower()
+
+
+class _Stats:
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.encoded_questions = 0
+        self.questions_reused = 0
+        self.questions_minted = 0
+        self.options_reused = 0
+        self.options_minted = 0
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for k, v in counts.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            q = self.questions_reused + self.questions_minted
+            return {
+                "encoded_questions": self.encoded_questions,
+                "questions_reused": self.questions_reused,
+                "questions_minted": self.questions_minted,
+                "options_reused": self.options_reused,
+                "options_minted": self.options_minted,
+                "question_reuse_ratio": round(self.questions_reused / q, 4) if q else 0.0,
+            }
+
+
+_stats = _Stats()
+
+
+def id_alias_stats() -> Dict[str, Any]:
+    return _stats.snapshot()
+
+
+class QuestionIdCodec:
+    def __init__(self, questions: List[Dict[str, Any]], new_id: Callable[[], str] = _uuid) -> None:
+        self._new_id = new_id
+        # alias -> (question_id, {option_alias: option_id}, {option_content: option_id})
+        self._open: Dict[str, Tuple[str, Dict[str, str], Dict[str, str]]] = {}
+        self._encoded: List[Dict[str, Any]] = []
+        self._used: set = set()
+        for q in questions or []:
+            if not isinstance(q, dict):
+                continue
+            alias = f"q{len(self._encoded) + 1}"
+            options = [o for o in (q.get("suggestion_options") or []) if isinstance(o, dict)]
+            by_alias = {}
+            items = []
+            for j, o in enumerate(options[: len(_OPTION_ALIASES)]):
+                oa = _OPTION_ALIASES[j]
+                by_alias[oa.lower()] = o.get("option_id")
+                items.append((oa, o))
+            selected = [{"option_id": oa, "content": o.get("content")} for oa, o in items if o.get("selected")]
+            if selected:
+                self._encoded.append({"question_id": alias, "content": q.get("content"), "selected_options": selected})
+            else:
+                self._encoded.append(
+                    {
+                        "question_id": alias,
+                        "content": q.get("content"),
+                        "suggestion_options": [{"option_id": oa, "content": o.get("content")} for oa, o in items],
+                    }
+                )
+                if q.get("question_id"):
+                    by_content = {o.get("content"): o.get("option_id") for _, o in items if o.get("content")}
+                    self._open[alias] = (q.get("question_id"), by_alias, by_content)
+        _stats.add(encoded_questions=len(self._encoded))
+
+    def encode(self) -> List[Dict[str, Any]]:
+        """prompt 中使用的精简问题列表（短别名，已回答的问题仅含选中项）。"""
+        return self._encoded
+
+    @property
+    def next_alias(self) -> str:
+        return f"q{len(self._encoded) + 1}"
+
+    def decode(self, question: Dict[str, Any]) -> Tuple[str, Callable[[Any, Any], str]]:
+        """返回 (question_id, option_id_for)；option_id_for(alias, content) 给出该题选项的稳定 ID。"""
+        alias = _norm(question.get("question_id"))
+        entry = self._open.get(alias)
+        if entry is None or alias in self._used:
+            _stats.add(questions_minted=1)
+            return self._new_id(), self._mint_option
+        self._used.add(alias)
+        qid, by_alias, by_content = entry
+        _stats.add(questions_reused=1)
+        taken: set = set()
+
+        def option_id_for(option_alias: Any, content: Any) -> str:
+            oid = by_alias.get(_norm(option_alias))
+            if oid is None or oid in taken:
+                oid = by_content.get(content)
+            if oid is None or oid in taken:
+                return self._mint_option(option_alias, content)
+            taken.add(oid)
+            _stats.add(options_reused=1)
+            return oid
+
+        return qid, option_id_for
+
+    def _mint_option(self, _alias: Any = None, _content: Any = None) -> str:
+        _stats.add(options_minted=1)
+        return self._new_id()
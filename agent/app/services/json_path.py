@@ -0,0 +1,104 @@
+"""
+JSON 结构扫描与路径跟踪
+
+json_repair（截断 JSON 的修复）与 json_stream（流式字段增量）都需要逐字符扫描 JSON 文本，
+并知道当前字符位于哪条路径上（如 ("questions", 2, "content")）。JSONPathTracker 是两者共用的扫描器：
+
+- step(ch) 每次消费一个字符，返回该字符的结构事件（见下方常量），O(1)；
+- 维护对象/数组栈：对象帧记录当前键，数组帧记录当前下标；path() 给出当前路径；
+- 字符串内部只跟踪转义以识别结束引号，不解码值（由调用方按需解码）；键在闭合时解码并写入栈顶。
+"""
+from __future__ import annotations
+
+import json
+from typing import List, Optional, Tuple
+
+Path = Tuple[object, ...]
+
+# step() 返回的事件
+OPEN = "open"  # { / [ 已入栈
+CLOSE = "close"  # } / ] 已出栈
+MISMATCH = "mismatch"  # } / ] 与栈顶不匹配（或栈为空），栈不变
+COMMA = "comma"  # 栈顶已切换到下一个键 / 下标
+KEY_END = "key_end"  # 键字符串闭合，栈顶 key 已更新
+VALUE_START = "value_start"  # 值字符串的起始引号，path() 即该字符串的路径
+VALUE_END = "value_end"  # 值字符串的结束引号
+STRING = "string"  # 字符串内部的原始字符（含转义序列本身）
+OTHER = "other"  # 空白、冒号、数字/字面量等
+
+
+class Frame:
+    __slots__ = ("is_obj", "key", "expect_key")
+
+    def __init__(self, is_obj: bool) -> None:
+        self.is_obj = is_obj
+        # 对象：当前键；数组：当前下标
+        self.key: object = None if is_obj else 0
+        self.expect_key = is_obj
+
+
+class JSONPathTracker:
+    def __init__(self) -> None:
+        self.stack: List[Frame] = []
+        self.in_string = False
+        self.is_key = False
+        self.escape = False
+        self._key_buf: List[str] = []
+
+    def path(self) -> Path:
+        return tuple(f.key for f in self.stack)
+
+    def closers(self) -> str:
+        """按当前栈补齐所有未闭合的对象/数组所需的括号。"""
+        return "".join("}" if f.is_obj else "]" for f in reversed(self.stack))
+
+    def step(self, ch: str) -> str:
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif ch == "\\":
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+                if self.is_key:
+                    self._close_key()
+                    return KEY_END
+                return VALUE_END
+            if self.is_key:
+                self._key_buf.append(ch)
+            return STRING
+
+        top = self.stack[-1] if self.stack else None
+        if ch == '"':
+            self.in_string = True
+            self.escape = False
+            self.is_key = bool(top and top.is_obj and top.expect_key)
+            return STRING if self.is_key else VALUE_START
+        if ch in "{[":
+            self.stack.append(Frame(ch == "{"))
+            return OPEN
+        if ch in "}]":
+            if top is None or top.is_obj != (ch == "}"):
+                return MISMATCH
+            self.stack.pop()
+            return CLOSE
+        if ch == "," and top is not None:
+            if top.is_obj:
+                top.expect_key = True
+                top.key = None
+            else:
+                top.key = int(top.key) + 1  # type: ignore[arg-type]
+            return COMMA
+        return OTHER
+
+    def _close_key(self) -> None:
+        raw = "".join(self._key_buf)
+        self._key_buf = []
+        key: Optional[object]
+        try:
+            key = json.loads('"' + raw + '"', strict=False)
+        except ValueError:
+            key = raw
+        top = self.stack[-1]
+        top.key = key
+        top.expect_key = False
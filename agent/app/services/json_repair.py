@@ -0,0 +1,167 @@
+"""
+LLM JSON 输出的容错解析与修复
+
+节点要求模型“仅输出 JSON 对象”，但实际输出仍会出现：```json 代码块包裹、前后缀说明文字、
+结尾多余的逗号，以及超出 max_tokens 被截断的半截 JSON。严格 json.loads 失败时整轮结果被丢弃、
+换成兜底占位，文档与问题一起作废。
+
+parse_llm_json 依次尝试：
+1) 严格解析（status="strict"）；
+2) 从第一个 "{" 起解析并忽略其后的多余文本（代码块标记、说明文字）（status="repaired"）；
+3) 单遍扫描修复：去掉 } / ] 前多余的逗号；输入被截断时补齐未闭合的字符串与对象/数组，
+   补齐失败则回退到最后一个完整值之后再补齐（status="truncated"，truncated_at 为截断处的 JSON 路径，
+   调用方据此丢弃不完整的字段，保留其余完整字段；路径跟踪复用 json_path.JSONPathTracker，与 json_stream 共用）。
+都失败时 status="failed"、value=None。
+
+各节点的解析结果通过 record_parse 计数，structured_output_stats() 汇总成功率（/v1/stats）。
+"""
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services import metrics
+from app.services.json_path import CLOSE, COMMA, MISMATCH, OPEN, VALUE_END, JSONPathTracker, Path
+from app.utils.log import get_logger
+
+log = get_logger("json_repair")
+
+_decoder = json.JSONDecoder(strict=False)
+
+
+@dataclass
+class ParseResult:
+    value: Any
+    status: str  # strict / repaired / truncated / failed
+    truncated_at: Optional[Path] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status != "failed"
+
+    def cut_inside(self, *prefix: object) -> bool:
+        """截断点是否位于 prefix 路径之内（该处的字段可能不完整）。"""
+        at = self.truncated_at
+        return at is not None and tuple(at[: len(prefix)]) == prefix
+
+
+def _loads(text: str) -> Tuple[bool, Any]:
+    try:
+        return True, json.loads(text, strict=False)
+    except ValueError:
+        return False, None
+
+
+def _repair(text: str) -> Tuple[bool, Any, Optional[Path]]:
+    """text 以 "{" 或 "[" 开头。返回 (成功, 值, 截断路径)；未截断时截断路径为 None。"""
+    tracker = JSONPathTracker()
+    out: List[str] = []
+    # 最后一个“截在此处再补齐括号即为合法 JSON”的位置及当时的括号栈
+    safe: Optional[Tuple[int, str]] = None
+
+    for ch in text:
+        event = tracker.step(ch)
+        if event == MISMATCH:
+            break
+        if event == CLOSE:
+            # 去掉结尾多余的逗号：[1, 2,] / {"a": 1,}
+            while out and (out[-1].isspace() or out[-1] == ","):
+                out.pop()
+            out.append(ch)
+            if not tracker.stack:
+                ok, value = _loads("".join(out))
+                return ok, value, None
+            safe = (len(out), tracker.closers())
+            continue
+        if event == COMMA:
+            safe = (len(out), tracker.closers())
+        out.append(ch)
+        if event in (OPEN, VALUE_END):
+            safe = (len(out), tracker.closers())
+
+    stack = tracker.stack
+    in_str, is_key, escape = tracker.in_string, tracker.is_key, tracker.escape
+    if not stack:
+        return False, None, None
+    path = tracker.path()
+    candidates = []
+    if in_str and not is_key:
+        body = "".join(out)
+        if escape:
+            body = body[:-1]
+        candidates.append(body + '"' + tracker.closers())
+    elif not in_str:
+        body = "".join(out).rstrip()
+        candidates.append(body.rstrip(",") + tracker.closers())
+    if safe is not None:
+        candidates.append("".join(out[: safe[0]]).rstrip().rstrip(",") + safe[1])
+    for candidate in candidates:
+        ok, value = _loads(candidate)
+        if ok:
+            return True, value, path
+    return False, None, path
+
+
+def parse_llm_json(text: Optional[str]) -> ParseResult:
+    raw = (text or "").strip()
+    ok, value = _loads(raw)
+    if ok:
+        return ParseResult(value, "strict")
+    start = raw.find("{")
+    if start < 0:
+        return ParseResult(None, "failed")
+    body = raw[start:]
+    try:
+        value, _ = _decoder.raw_decode(body)
+        return ParseResult(value, "repaired")
+    except ValueError:
+        pass
+    ok, value, truncated_at = _repair(body)
+    if not ok:
+        return ParseResult(None, "failed")
+    return ParseResult(value, "repaired" if truncated_at is None else "truncated", truncated_at)
+
+
+# ===== 计数 =====
+
+_lock = Lock()
+_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def _node_stats(node: str) -> Dict[str, Any]:
+    return _stats.setdefault(node, {"strict": 0, "repaired": 0, "truncated": 0, "failed": 0, "salvaged": {}})
+
+
+def record_parse(node: str, result: ParseResult) -> ParseResult:
+    with _lock:
+        _node_stats(node)[result.status] += 1
+    metrics.json_parse.inc(node=node, status=result.status)
+    if result.status != "strict":
+        log.info("llm_output_json", node=node, status=result.status, truncated_at=list(result.truncated_at) if result.truncated_at else None)
+    return result
+
+
+def record_salvage(node: str, kind: str) -> None:
+    """记录字段级的补救：如问题列表损坏但保留了文档（document_only）、文档损坏沿用上一版（previous_document）。"""
+    with _lock:
+        salvaged = _node_stats(node)["salvaged"]
+        salvaged[kind] = salvaged.get(kind, 0) + 1
+    metrics.json_salvage.inc(node=node, kind=kind)
+
+
+def structured_output_stats() -> Dict[str, Any]:
+    """按节点统计 LLM 输出的解析结果：strict / repaired / truncated / failed、成功率与字段级补救次数。"""
+    with _lock:
+        out = {}
+        for node, s in _stats.items():
+            total = s["strict"] + s["repaired"] + s["truncated"] + s["failed"]
+            out[node] = {
+                **s,
+                "salvaged": dict(s["salvaged"]),
+                "total": total,
+                "success_rate": round((total - s["failed"]) / total, 4) if total else 0.0,
+                "strict_rate": round(s["strict"] / total, 4) if total else 0.0,
+            }
+        return out
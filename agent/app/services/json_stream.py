@@ -0,0 +1,95 @@
+"""
+增量 JSON 字段解析
+
+LLM 以 token 流的形式输出 JSON（如 requirements_analysis_agent 的完整结果）。
+JSONStringFieldStream 逐字符扫描流入的文本，路径跟踪复用 json_path.JSONPathTracker（与 json_repair 共用），
+对指定路径上的字符串值（如 ("requirements_document", "content")）实时产出已解码的增量文本，
+使文档正文可以在生成过程中渲染，而无需等待整段 JSON 闭合。
+
+- 每个字符只处理一次（O(n)），不会在每个 token 上重新解析整段缓冲；
+- JSON 开始之前的前缀（如 ```json 代码块标记）会被忽略；
+- 支持标准转义与 \\uXXXX（含代理对）。
+"""
+from __future__ import annotations
+
+from typing import Iterable, List, Optional, Tuple
+
+from app.services.json_path import CLOSE, STRING, VALUE_END, VALUE_START, JSONPathTracker, Path
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class JSONStringFieldStream:
+    def __init__(self, paths: Iterable[Path]) -> None:
+        self._paths = {tuple(p) for p in paths}
+        self._tracker = JSONPathTracker()
+        self._started = False
+        self._done = False
+        self._target: Optional[Path] = None
+        self._escape = False
+        self._hex: Optional[str] = None
+        self._high_surrogate: Optional[int] = None
+
+    def _emit(self, ch: str, out: List[Tuple[Path, str]]) -> None:
+        if out and out[-1][0] == self._target:
+            out[-1] = (self._target, out[-1][1] + ch)
+        else:
+            out.append((self._target, ch))  # type: ignore[arg-type]
+
+    def _unicode(self, code: int, out: List[Tuple[Path, str]]) -> None:
+        if 0xD800 <= code <= 0xDBFF:
+            self._high_surrogate = code
+            return
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        self._emit(chr(code), out)
+
+    def _decode(self, ch: str, out: List[Tuple[Path, str]]) -> None:
+        """解码被跟踪字符串内的一个原始字符（转义与 \\uXXXX）。"""
+        if self._hex is not None:
+            self._hex += ch
+            if len(self._hex) == 4:
+                try:
+                    self._unicode(int(self._hex, 16), out)
+                except ValueError:
+                    pass
+                self._hex = None
+        elif self._escape:
+            self._escape = False
+            if ch == "u":
+                self._hex = ""
+            else:
+                self._emit(_ESCAPES.get(ch, ch), out)
+        elif ch == "\\":
+            self._escape = True
+        else:
+            self._emit(ch, out)
+
+    def feed(self, chunk: str) -> List[Tuple[Path, str]]:
+        """Consume the next chunk and return [(path, decoded_delta)] for the watched string fields."""
+        out: List[Tuple[Path, str]] = []
+        tracker = self._tracker
+        for ch in chunk:
+            if self._done:
+                break
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    tracker.step(ch)
+                continue
+            event = tracker.step(ch)
+            if event == STRING:
+                if self._target is not None:
+                    self._decode(ch, out)
+            elif event == VALUE_START:
+                path = tracker.path()
+                self._target = path if path in self._paths else None
+                self._escape = False
+                self._hex = None
+                self._high_surrogate = None
+            elif event == VALUE_END:
+                self._target = None
+            elif event == CLOSE and not tracker.stack:
+                self._done = True
+        return out
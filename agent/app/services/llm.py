@@ -4,7 +4,14 @@ LLM 客户端工厂
 职责：
 - 基于 state.model_params 或环境变量，实例化可用的 Chat 模型；
 - 根据不同供应商使用对应的基础 ChatModel；
-- 支持 OpenAI 兼容网关（base_url + api_key）。
+- 支持 OpenAI 兼容网关（base_url + api_key）；
+- 模型实例池化复用：按 provider/base_url/model/参数/api_key 哈希 做键，有界 LRU 淘汰；
+  同一 base_url 的 OpenAI 兼容实例共享 keep-alive 连接池，避免每次调用重新建连与 TLS 握手；
+  api_key 通过实例参数传入，不写入 os.environ（并发用户使用不同 key 时互不干扰）；
+- json_mode=True 时对支持的供应商请求 JSON 模式（response_format={"type": "json_object"}），
+  由 AGENT_LLM_JSON_MODE 控制（auto/true/false）；
+- 默认包装为 ResilientChatModel：按供应商熔断，配置了备用模型（AGENT_LLM_HEDGE_MODEL）时对慢调用发出对冲请求并在出错时切换；
+  调用前按供应商别名的并发上限与 rpm/tpm 排队（AGENT_LLM_LIMITS，见 rate_limit.py）。AGENT_LLM_RESILIENCE=false 时以上全部关闭。
 
 使用：
     from app.services.llm import get_chat_model
@@ -13,8 +20,25 @@ LLM 客户端工厂
 """
 from __future__ import annotations
 
+import hashlib
 import os
-from typing import Any, Dict, Optional
+from collections import OrderedDict
+from threading import RLock
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from app.services.resilience import ResilientChatModel
+from app.utils.env import (
+    get_llm_hedge_model,
+    get_llm_json_mode,
+    get_llm_max_connections,
+    get_llm_pool_size,
+    is_llm_resilience_enabled,
+)
+from app.utils.log import get_logger
+
+log = get_logger("llm")
 
 
 def _get_env(name: str, default: Optional[str] = None) -> Optional[str]:
@@ -22,7 +46,96 @@ def _get_env(name: str, default: Optional[str] = None) -> Optional[str]:
     return v if v is not None and v != "" else default
 
 
-def _build_openai_compatible(mp: Dict[str, Any]):
+def _key_hash(api_key: Optional[str]) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else ""
+
+
+class _ModelPool:
+    """有界 LRU 的模型实例池（线程安全）。实例本身无会话状态，可被并发请求共享。"""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._items: "OrderedDict[Tuple, Any]" = OrderedDict()
+        # id(实例) → 池键，供 model_fingerprint 反查实例的配置（随淘汰一并移除）
+        self._keys: Dict[int, Tuple] = {}
+        self._lock = RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_create(self, key: Tuple, factory):
+        with self._lock:
+            llm = self._items.get(key)
+            if llm is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return llm
+            self.misses += 1
+        llm = factory()
+        with self._lock:
+            # 并发创建同一个键时保留先到者，保证实例唯一
+            llm = self._items.setdefault(key, llm)
+            self._keys[id(llm)] = key
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                _, evicted = self._items.popitem(last=False)
+                self._keys.pop(id(evicted), None)
+                self.evictions += 1
+        return llm
+
+    def key_of(self, llm: Any) -> Optional[Tuple]:
+        with self._lock:
+            key = self._keys.get(id(llm))
+            # id 可能被已淘汰实例之后的新对象复用，确认池中仍是同一实例
+            return key if key is not None and self._items.get(key) is llm else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_pool = _ModelPool(get_llm_pool_size())
+# base_url → (httpx.Client, httpx.AsyncClient)：同一网关的所有模型实例共享连接池
+_http_clients: Dict[str, Tuple[httpx.Client, httpx.AsyncClient]] = {}
+_http_lock = RLock()
+
+
+def _shared_http_clients(base_url: Optional[str]) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    key = base_url or ""
+    with _http_lock:
+        clients = _http_clients.get(key)
+        if clients is None:
+            max_conn = get_llm_max_connections()
+            limits = httpx.Limits(max_connections=max_conn, max_keepalive_connections=max_conn)
+            clients = _http_clients[key] = (httpx.Client(limits=limits), httpx.AsyncClient(limits=limits))
+        return clients
+
+
+def llm_pool_stats() -> Dict[str, int]:
+    out = _pool.stats()
+    out["http_pools"] = len(_http_clients)
+    return out
+
+
+# AGENT_LLM_JSON_MODE=auto 时开启 JSON 模式的供应商（已确认支持 response_format=json_object）
+_JSON_MODE_PROVIDERS = {"openai", "deepseek", "moonshot", "月之暗面", "qwen", "tongyi", "aliyun", "dashscope", "通义千问"}
+_JSON_OBJECT = {"type": "json_object"}
+
+
+def _use_json_mode(provider_raw: str) -> bool:
+    mode = get_llm_json_mode()
+    if mode == "true":
+        return True
+    return mode == "auto" and provider_raw in _JSON_MODE_PROVIDERS
+
+
+def _build_openai_compatible(mp: Dict[str, Any], json_mode: bool = False):
     """使用 OpenAI 兼容的 ChatOpenAI 实例化（包含 deepseek/moonshot/doubao/hunyuan 等）。"""
     try:
         from langchain_openai import ChatOpenAI
@@ -35,25 +148,33 @@ def _build_openai_compatible(mp: Dict[str, Any]):
     if not api_key:
         raise RuntimeError("未检测到 OPENAI_API_KEY 或 model_params.api_key，无法创建 OpenAI 兼容模型实例")
 
-    base_url = mp.get("base_url") or _get_env("OPENAI_BASE_URL")
-    model = mp.get("model") or _get_env("OPENAI_MODEL", "gpt-4o-mini")
+    base_url, model = _resolve_endpoint(mp)
     temperature = float(mp.get("temperature") or 0.2)
     max_tokens = mp.get("max_tokens")
 
-    kwargs: Dict[str, Any] = {
-        "model": model,
-        "temperature": temperature,
-        "api_key": api_key,
-    }
-    if base_url:
-        kwargs["base_url"] = base_url
-    if max_tokens is not None:
-        kwargs["max_tokens"] = int(max_tokens)
+    key = ("openai", base_url, model, temperature, max_tokens, json_mode, _key_hash(api_key))
+
+    def _create():
+        http_client, http_async_client = _shared_http_clients(base_url)
+        kwargs: Dict[str, Any] = {
+            "model": model,
+            "temperature": temperature,
+            "api_key": api_key,
+            "http_client": http_client,
+            "http_async_client": http_async_client,
+        }
+        if base_url:
+            kwargs["base_url"] = base_url
+        if max_tokens is not None:
+            kwargs["max_tokens"] = int(max_tokens)
+        if json_mode:
+            kwargs["model_kwargs"] = {"response_format": _JSON_OBJECT}
+        return ChatOpenAI(**kwargs)
 
-    return ChatOpenAI(**kwargs)
+    return _pool.get_or_create(key, _create)
 
 
-def _build_tongyi(mp: Dict[str, Any]):
+def _build_tongyi(mp: Dict[str, Any], json_mode: bool = False):
     """阿里通义（Qwen/Tongyi）。优先使用官方 SDK，经由 langchain-community ChatTongyi。
     兼容用户传入的 api_key（DASHSCOPE_API_KEY）。
     """
@@ -75,11 +196,9 @@ def _build_tongyi(mp: Dict[str, Any]):
             "缺少依赖：langchain-community 或未包含 ChatTongyi，请安装：pip install langchain-community dashscope"
         ) from exc
 
+    # api_key 按实例传入（dashscope_api_key），不写入进程环境变量
     api_key = mp.get("api_key") or _get_env("DASHSCOPE_API_KEY")
-    if api_key:
-        # ChatTongyi 默认从环境变量读取
-        os.environ["DASHSCOPE_API_KEY"] = api_key
-    model = mp.get("model") or _get_env("TONGYI_MODEL", "qwen-plus-latest")
+    _, model = _resolve_endpoint(mp)
     temperature = float(mp.get("temperature") or 0.2)
 
     # ChatTongyi 目前不显式接收 max_tokens 参数；如需可通过 model_kwargs 传递
@@ -90,40 +209,106 @@ def _build_tongyi(mp: Dict[str, Any]):
     # 修复 DashScope 非流式调用需要关闭思考模式（enable_thinking）
     # 参考错误：parameter.enable_thinking must be set to false for non-streaming calls
     model_kwargs["enable_thinking"] = False
+    if json_mode:
+        model_kwargs["response_format"] = _JSON_OBJECT
 
-    return ChatTongyi(model=model, temperature=temperature, model_kwargs=model_kwargs or None)
+    key = ("tongyi", None, model, temperature, mp.get("max_tokens"), json_mode, _key_hash(api_key))
 
+    def _create():
+        kwargs: Dict[str, Any] = {"model": model, "temperature": temperature, "model_kwargs": model_kwargs or None}
+        if api_key:
+            kwargs["dashscope_api_key"] = api_key
+        return ChatTongyi(**kwargs)
 
-def get_chat_model(model_params: Optional[Dict[str, Any]] = None):
-    """返回一个 Chat 模型实例。
+    return _pool.get_or_create(key, _create)
+
+
+def get_chat_model(model_params: Optional[Dict[str, Any]] = None, json_mode: bool = False):
+    """返回一个 Chat 模型（相同配置复用池中的同一实例）；启用 AGENT_LLM_RESILIENCE 时包装为 ResilientChatModel。
+    json_mode=True：调用方的 prompt 要求仅输出 JSON 对象，供应商支持时开启 JSON 模式。
+    """
+    mp = (model_params or {}).copy()
+    llm = _get_base_model(mp, json_mode)
+    if not is_llm_resilience_enabled():
+        return llm
+    secondary, secondary_key = None, None
+    hedge_mp = get_llm_hedge_model()
+    if hedge_mp and _provider_key(hedge_mp) != _provider_key(mp):
+        try:
+            secondary, secondary_key = _get_base_model(dict(hedge_mp), json_mode), _provider_key(hedge_mp)
+        except Exception as e:
+            log.warning("hedge_model_unavailable", error=str(e))
+    return ResilientChatModel(llm, _provider_key(mp), secondary, secondary_key, json_mode=json_mode)
+
+
+def model_fingerprint(llm: Any) -> Optional[Dict[str, Any]]:
+    """模型配置指纹（LLM 响应缓存键的一部分）：取自实例池的键，不含 api_key。
+
+    不依赖 _identifying_params：ChatTongyi 的 _identifying_params 为空，模型名与温度都不会体现在其中。
+    ResilientChatModel 以主模型为准（备用模型只是同一请求的替补）；非池中实例返回 None。
+    """
+    key = _pool.key_of(getattr(llm, "primary", llm))
+    if key is None:
+        return None
+    provider, base_url, model, temperature, max_tokens, json_mode, _ = key
+    return {
+        "provider": provider,
+        "base_url": base_url,
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "json_mode": json_mode,
+    }
+
+
+# 供应商归一化别名
+_ALIASES = {
+    "openai": "openai",
+    "deepseek": "openai",
+    "moonshot": "openai",  # 月之暗面（Moonshot AI）
+    "月之暗面": "openai",
+    "doubao": "openai",     # 火山引擎豆包（OpenAI 兼容模式）
+    "豆包": "openai",
+    "hunyuan": "openai",    # 腾讯混元（OpenAI 兼容模式）
+    "腾讯混元": "openai",
+    "qwen": "tongyi",
+    "tongyi": "tongyi",
+    "aliyun": "tongyi",
+    "dashscope": "tongyi",
+    "通义千问": "tongyi",
+}
+
+
+def _provider_raw(mp: Dict[str, Any]) -> str:
+    return (mp.get("provider") or _get_env("LLM_PROVIDER", "openai")).strip().lower()
+
+
+def _resolve_endpoint(mp: Dict[str, Any]) -> Tuple[Optional[str], str]:
+    """实际使用的 (base_url, model)：与 _build_openai_compatible / _build_tongyi 一样回退到环境变量默认值。"""
+    if _ALIASES.get(_provider_raw(mp), "openai") == "tongyi":
+        return None, mp.get("model") or _get_env("TONGYI_MODEL", "qwen-plus-latest")
+    return mp.get("base_url") or _get_env("OPENAI_BASE_URL"), mp.get("model") or _get_env("OPENAI_MODEL", "gpt-4o-mini")
+
+
+def _provider_key(mp: Dict[str, Any]) -> str:
+    """熔断、限流与延迟统计的粒度：供应商别名 + 网关 + 实际模型名（未显式指定时取环境变量默认值）。"""
+    base_url, model = _resolve_endpoint(mp)
+    return f"{_provider_raw(mp)}|{base_url or ''}|{model}"
+
+
+def _get_base_model(mp: Dict[str, Any], json_mode: bool = False):
+    """按供应商实例化底层 Chat 模型。
 
     分支规则：
     - openai/deepseek/moonshot/doubao/hunyuan → OpenAI 兼容（ChatOpenAI）
     - qwen/tongyi/aliyun/dashscope → ChatTongyi（需要 dashscope）
     - 其他/未知 → 回退为 OpenAI 兼容（需提供 api_key 与可用 base_url）
     """
-    mp = (model_params or {}).copy()
-
-    # 供应商归一化别名
-    provider_raw = (mp.get("provider") or _get_env("LLM_PROVIDER", "openai")).strip().lower()
-    aliases = {
-        "openai": "openai",
-        "deepseek": "openai",
-        "moonshot": "openai",  # 月之暗面（Moonshot AI）
-        "月之暗面": "openai",
-        "doubao": "openai",     # 火山引擎豆包（OpenAI 兼容模式）
-        "豆包": "openai",
-        "hunyuan": "openai",    # 腾讯混元（OpenAI 兼容模式）
-        "腾讯混元": "openai",
-        "qwen": "tongyi",
-        "tongyi": "tongyi",
-        "aliyun": "tongyi",
-        "dashscope": "tongyi",
-        "通义千问": "tongyi",
-    }
-    provider = aliases.get(provider_raw, "openai")
+    provider_raw = _provider_raw(mp)
+    provider = _ALIASES.get(provider_raw, "openai")
+    json_mode = json_mode and _use_json_mode(provider_raw)
 
     if provider == "tongyi":
-        return _build_tongyi(mp)
+        return _build_tongyi(mp, json_mode)
     else:
-        return _build_openai_compatible(mp)
\ No newline at end of file
+        return _build_openai_compatible(mp, json_mode)
\ No newline at end of file
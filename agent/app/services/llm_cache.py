@@ -0,0 +1,279 @@
+"""
+LLM 响应缓存（可选启用）
+
+同一份渲染后的 prompt + 模型参数经常被重复发送：重试、重复点击、回放脚本、后端超时后的重新生成。
+本模块以 sha256(节点名 + 渲染后的消息 + 模型指纹) 为键，将 `prompt | llm | StrOutputParser()` 的输出
+持久化到本地 SQLite，命中时直接返回文本，省去一次完整的 LLM 调用。
+
+- 启用：AGENT_LLM_CACHE_NODES=requirements_analysis_agent,file_toolscall_agent（按节点开关，默认关闭）
+- 存储：AGENT_LLM_CACHE_PATH（默认 .cache/llm_responses.sqlite3，WAL 模式）
+- 淘汰：AGENT_LLM_CACHE_TTL_SECONDS（过期即失效）+ AGENT_LLM_CACHE_MAX_ENTRIES / AGENT_LLM_CACHE_MAX_MB（按最近访问淘汰）
+- 统计：hits / misses / hit_ratio / saved_tokens（优先使用供应商返回的 usage，缺失时按字符数估算）
+- 模型指纹不含 api_key：同一网关/模型/参数下，不同账号的相同请求可共享结果
+
+使用：
+    chain = cached_chain("requirements_analysis_agent", prompt, llm, cacheable=is_json_object)
+    raw_output = await chain.ainvoke(llm_input, config=config)
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from threading import RLock
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import orjson
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from app.services.llm import model_fingerprint
+from app.utils.tokens import approx_tokens
+from app.utils.env import (
+    get_llm_cache_nodes,
+    get_llm_cache_path,
+    get_llm_cache_ttl_seconds,
+    get_llm_cache_max_entries,
+    get_llm_cache_max_bytes,
+)
+from app.utils.log import get_logger
+
+log = get_logger("llm_cache")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_responses (
+    key TEXT PRIMARY KEY,
+    node TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_responses_last_access ON llm_responses(last_access);
+"""
+
+# 每写入 N 次检查一次容量上限（避免每次写入都做全表聚合）
+_PRUNE_EVERY = 32
+
+
+class LLMResponseCache:
+    """SQLite 持久化的 LLM 响应缓存（线程安全，单连接 + 锁）。"""
+
+    def __init__(
+        self,
+        path: str,
+        nodes: Sequence[str],
+        ttl_seconds: float = 7 * 24 * 3600,
+        max_entries: int = 10000,
+        max_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.path = path
+        self.nodes = frozenset(nodes)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = RLock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+        self._prune()
+
+    def enabled_for(self, node: str) -> bool:
+        return node in self.nodes
+
+    @staticmethod
+    def make_key(node: str, messages: Sequence[BaseMessage], fingerprint: Dict[str, Any]) -> str:
+        payload = {
+            "node": node,
+            "messages": [[m.type, m.content] for m in messages],
+            "model": fingerprint,
+        }
+        return hashlib.sha256(orjson.dumps(payload, default=str, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, prompt_tokens, completion_tokens, created_at FROM llm_responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, prompt_tokens, completion_tokens, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            self.saved_prompt_tokens += prompt_tokens
+            self.saved_completion_tokens += completion_tokens
+            return response
+
+    def put(self, key: str, node: str, response: str, prompt_tokens: int, completion_tokens: int) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, node, response, len(response.encode("utf-8")), prompt_tokens, completion_tokens, now, now),
+            )
+            self._puts += 1
+            if self._puts % _PRUNE_EVERY == 0:
+                self._prune()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_responses").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "nodes": sorted(self.nodes),
+                "entries": entries,
+                "bytes": size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "saved_tokens": self.saved_prompt_tokens + self.saved_completion_tokens,
+                "saved_prompt_tokens": self.saved_prompt_tokens,
+                "saved_completion_tokens": self.saved_completion_tokens,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _prune(self) -> None:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM llm_responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            self.evictions += max(cur.rowcount, 0)
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_responses").fetchone()
+            if entries <= self.max_entries and size <= self.max_bytes:
+                return
+            # 超限：按最近访问时间从旧到新删除，直到回到上限的 90%
+            target_entries = int(self.max_entries * 0.9)
+            target_bytes = int(self.max_bytes * 0.9)
+            rows = self._conn.execute("SELECT key, size FROM llm_responses ORDER BY last_access").fetchall()
+            doomed = []
+            for key, row_size in rows:
+                if entries <= target_entries and size <= target_bytes:
+                    break
+                doomed.append((key,))
+                entries -= 1
+                size -= row_size
+            self._conn.executemany("DELETE FROM llm_responses WHERE key = ?", doomed)
+            self.evictions += len(doomed)
+
+
+_cache: Optional[LLMResponseCache] = None
+_cache_lock = RLock()
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """进程级缓存实例；未配置 AGENT_LLM_CACHE_NODES 时返回 None。"""
+    global _cache
+    nodes = get_llm_cache_nodes()
+    if not nodes:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = LLMResponseCache(
+                    get_llm_cache_path(),
+                    nodes,
+                    ttl_seconds=get_llm_cache_ttl_seconds(),
+                    max_entries=get_llm_cache_max_entries(),
+                    max_bytes=get_llm_cache_max_bytes(),
+                )
+            except Exception as e:
+                log.warning("disabled", path=get_llm_cache_path(), error=str(e))
+                return None
+        return _cache
+
+
+def llm_cache_stats() -> Optional[Dict[str, Any]]:
+    cache = get_llm_cache()
+    return cache.stats() if cache is not None else None
+
+
+def is_json_object(text: str) -> bool:
+    """只缓存可解析为 JSON 对象的输出，避免把一次失败的生成固化下来。"""
+    try:
+        return isinstance(json.loads(text.strip()), dict)
+    except Exception:
+        return False
+
+
+def _usage(messages: Sequence[BaseMessage], reply: Any, text: str) -> Tuple[int, int]:
+    usage = getattr(reply, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens")
+    completion_tokens = usage.get("output_tokens")
+    if prompt_tokens is None:
+        prompt_tokens = sum(approx_tokens(str(m.content)) for m in messages)
+    if completion_tokens is None:
+        completion_tokens = approx_tokens(text)
+    return int(prompt_tokens), int(completion_tokens)
+
+
+def cached_chain(
+    node: str,
+    prompt: Runnable,
+    llm: Any,
+    cacheable: Optional[Callable[[str], bool]] = None,
+) -> Runnable:
+    """返回与 `prompt | llm | StrOutputParser()` 等价的 Runnable；节点启用缓存时先查缓存。
+
+    未命中时 LLM 仍以传入的 config 调用，因此 SSE 的 token 流不受影响；命中时不产生 token 事件，
+    结果直接随节点输出返回。cacheable 为 None 时所有输出都会写入缓存。
+    """
+    parser = StrOutputParser()
+    cache = get_llm_cache()
+    fingerprint = model_fingerprint(llm) if cache is not None and cache.enabled_for(node) else None
+    if fingerprint is None:
+        # 未启用缓存，或模型不是 get_chat_model 创建的池中实例（无法确定其配置，不缓存）
+        return prompt | llm | parser
+
+    def _store(key: str, messages: Sequence[BaseMessage], reply: Any, text: str) -> None:
+        if cacheable is None or cacheable(text):
+            cache.put(key, node, text, *_usage(messages, reply, text))
+
+    def _invoke(inputs: Dict[str, Any], config: RunnableConfig) -> str:
+        messages = prompt.invoke(inputs).to_messages()
+        key = cache.make_key(node, messages, fingerprint)
+        hit = cache.get(key)
+        if hit is not None:
+            return hit
+        reply = llm.invoke(messages, config=config)
+        text = parser.invoke(reply)
+        _store(key, messages, reply, text)
+        return text
+
+    async def _ainvoke(inputs: Dict[str, Any], config: RunnableConfig) -> str:
+        messages = prompt.invoke(inputs).to_messages()
+        key = cache.make_key(node, messages, fingerprint)
+        hit = await asyncio.to_thread(cache.get, key)
+        if hit is not None:
+            return hit
+        reply = await llm.ainvoke(messages, config=config)
+        text = parser.invoke(reply)
+        await asyncio.to_thread(_store, key, messages, reply, text)
+        return text
+
+    return RunnableLambda(_invoke, afunc=_ainvoke, name=f"{node}_cached_llm")
@@ -0,0 +1,191 @@
+"""
+Prometheus 文本格式的指标（/metrics）
+
+不引入 prometheus_client，按 text exposition format 0.0.4 自行输出；指标在本模块集中定义，
+各处直接 import 使用（与 prompt_stats 等统计单例一致）：
+
+- agent_node_duration_seconds{node}：图节点耗时；
+- agent_llm_call_duration_seconds{provider,model,outcome} / agent_llm_tokens_total{provider,model,type}：LLM 调用耗时与 token；
+- agent_checkpoint_duration_seconds{backend,op}：checkpointer 读写耗时；
+- agent_fallbacks_total{node,reason}：节点退回占位结果的次数；
+- agent_llm_json_parse_total{node,status} / agent_llm_json_salvage_total{node,kind}：LLM 输出的 JSON 解析与字段级补救；
+- agent_turns_inflight / agent_turn_duration_seconds{mode}：进行中的轮次与整轮耗时。
+"""
+from __future__ import annotations
+
+import time
+from threading import Lock
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(self._samples(items))
+        return lines
+
+    def _samples(self, items: List[Tuple[Tuple[str, ...], Any]]) -> List[str]:
+        return [f"{self.name}{self._labels(k)} {_fmt(v)}" for k, v in items]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        # 无标签的 gauge 在第一次变化前也输出 0
+        if not self.labelnames:
+            with self._lock:
+                self._values.setdefault((), 0.0)
+        return super().render()
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(name, help, labelnames)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels: Any) -> "_Timer":
+        return _Timer(self, labels)
+
+    def totals(self) -> Dict[Tuple[str, ...], Tuple[float, int]]:
+        """各标签组合的 (sum, count)，供进程内对比前后两次快照（如压测中的节点耗时）。"""
+        with self._lock:
+            return {k: (v[1], v[2]) for k, v in self._values.items()}
+
+    def _samples(self, items: List[Tuple[Tuple[str, ...], Any]]) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in items:
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{self._labels(key, [('le', _fmt(bound))])} {n}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, Any]) -> None:
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._histogram.observe(time.perf_counter() - self._t0, **self._labels)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+node_duration = Histogram("agent_node_duration_seconds", "Graph node execution time.", ["node"])
+llm_call_duration = Histogram(
+    "agent_llm_call_duration_seconds", "LLM call latency (excluding limiter queueing).", ["provider", "model", "outcome"]
+)
+llm_tokens = Counter("agent_llm_tokens_total", "LLM tokens by provider/model (usage metadata, else estimated).", ["provider", "model", "type"])
+checkpoint_duration = Histogram("agent_checkpoint_duration_seconds", "Checkpointer read/write latency.", ["backend", "op"])
+fallbacks = Counter("agent_fallbacks_total", "Node outputs replaced by placeholder responses.", ["node", "reason"])
+json_parse = Counter("agent_llm_json_parse_total", "LLM JSON outputs by parse status (strict/repaired/truncated/failed).", ["node", "status"])
+json_salvage = Counter("agent_llm_json_salvage_total", "Field-level salvages of partially broken LLM outputs.", ["node", "kind"])
+turns_inflight = Gauge("agent_turns_inflight", "Turns currently executing.")
+turn_duration = Histogram("agent_turn_duration_seconds", "End-to-end turn execution time.", ["mode"])
+
+
+# checkpointer 上需要计时的异步方法 → op 标签。只包装异步入口：HTTP 服务走 astream/aget_state；
+# MemorySaver 等的异步方法内部会调用同步方法，同时包装会重复计时
+_CHECKPOINT_OPS = {"aget_tuple": "get", "aput": "put", "aput_writes": "put_writes"}
+
+
+def instrument_checkpointer(checkpointer: Any) -> Any:
+    """在 checkpointer 实例上包一层读写计时。"""
+    backend = type(checkpointer).__name__
+    for method, op in _CHECKPOINT_OPS.items():
+        fn = getattr(checkpointer, method, None)
+        if fn is not None:
+            setattr(checkpointer, method, _timed(fn, backend, op))
+    return checkpointer
+
+
+def _timed(fn: Callable, backend: str, op: str) -> Callable:
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with checkpoint_duration.time(backend=backend, op=op):
+            return await fn(*args, **kwargs)
+
+    return wrapper
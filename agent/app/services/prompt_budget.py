@@ -0,0 +1,129 @@
+"""
+按 token 预算组装 prompt
+
+需求分析 prompt 由若干段组成（用户输入、当前文档、现有问题、文件内容），长会话中很容易超出上下文。
+PromptBudget 对每段计数，总量超出预算时按优先级从低到高裁剪可裁剪的段，并记录每次调用的分段 token 明细。
+
+- Section.priority：越小越先被裁剪；trim 为 None 的段不可裁剪；
+- Section.occurrences：该段在模板中出现的次数（system 与 human 模板都引用时为 2）；
+- fixed_tokens：模板本身等不可变部分，从预算中预先扣除；
+- 计数使用 app.utils.tokens.approx_tokens（估算值，足以用于预算控制）；
+- 不可裁剪的段合计已超出预算时照常返回，breakdown["overrun"] 记录超出的 token 数（PromptStats 累计 overrun_calls）。
+"""
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.utils.tokens import approx_tokens
+
+TrimFn = Callable[[str, int], str]
+
+
+@dataclass
+class Section:
+    name: str
+    text: str
+    priority: int
+    trim: Optional[TrimFn] = None
+    occurrences: int = 1
+
+
+def compact_json(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def trim_text(text: str, max_tokens: int, marker: str = "\n...[已省略]...\n") -> str:
+    """保留开头约 2/3 与结尾约 1/3，中间以标记替代，使结果不超过 max_tokens。"""
+    tokens = approx_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    if max_tokens <= approx_tokens(marker):
+        return ""
+    keep = int(len(text) * (max_tokens - approx_tokens(marker)) / tokens)
+    while keep > 0:
+        head = keep * 2 // 3
+        out = text[:head] + marker + text[len(text) - (keep - head):]
+        if approx_tokens(out) <= max_tokens:
+            return out
+        keep = int(keep * 0.9)
+    return ""
+
+
+def fit_sections(sections: Sequence[Section], budget: int, fixed_tokens: int = 0) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """返回 ({name: text}, breakdown)。breakdown 含各段 token（含重复出现）、总量、预算与被裁剪的段。"""
+    texts = {s.name: s.text for s in sections}
+    tokens = {s.name: approx_tokens(s.text) * s.occurrences for s in sections}
+    before = dict(tokens)
+    total = fixed_tokens + sum(tokens.values())
+    trimmed: List[str] = []
+    for s in sorted(sections, key=lambda s: s.priority):
+        if total <= budget:
+            break
+        if s.trim is None or not tokens[s.name]:
+            continue
+        over = total - budget
+        target = max(0, tokens[s.name] - over) // s.occurrences
+        texts[s.name] = s.trim(texts[s.name], target)
+        new = approx_tokens(texts[s.name]) * s.occurrences
+        total -= tokens[s.name] - new
+        tokens[s.name] = new
+        trimmed.append(s.name)
+    breakdown = {
+        "sections": tokens,
+        "fixed": fixed_tokens,
+        "total": total,
+        "budget": budget,
+        "trimmed": trimmed,
+        "trimmed_tokens": sum(before.values()) - sum(tokens.values()),
+        "overrun": max(0, total - budget),
+    }
+    return texts, breakdown
+
+
+class PromptStats:
+    """按节点累计的分段 token 统计（/v1/stats 的 prompt 字段）。"""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._nodes: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, node: str, breakdown: Dict[str, Any]) -> None:
+        with self._lock:
+            st = self._nodes.setdefault(
+                node,
+                {"calls": 0, "trimmed_calls": 0, "trimmed_tokens": 0, "overrun_calls": 0, "overrun_tokens": 0, "total_tokens": 0, "sections": {}},
+            )
+            st["calls"] += 1
+            st["total_tokens"] += breakdown["total"]
+            st["trimmed_tokens"] += breakdown["trimmed_tokens"]
+            if breakdown["trimmed"]:
+                st["trimmed_calls"] += 1
+            if breakdown.get("overrun"):
+                st["overrun_calls"] += 1
+                st["overrun_tokens"] += breakdown["overrun"]
+            for name, n in breakdown["sections"].items():
+                st["sections"][name] = st["sections"].get(name, 0) + n
+            st["last"] = breakdown
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for node, st in self._nodes.items():
+                calls = st["calls"] or 1
+                out[node] = {
+                    "calls": st["calls"],
+                    "trimmed_calls": st["trimmed_calls"],
+                    "trimmed_tokens": st["trimmed_tokens"],
+                    "overrun_calls": st["overrun_calls"],
+                    "overrun_tokens": st["overrun_tokens"],
+                    "avg_total_tokens": round(st["total_tokens"] / calls, 1),
+                    "avg_section_tokens": {k: round(v / calls, 1) for k, v in st["sections"].items()},
+                    "last": st.get("last"),
+                }
+            return out
+
+
+prompt_stats = PromptStats()
@@ -0,0 +1,297 @@
+"""
+按供应商/模型的并发隔离（bulkhead）与令牌桶限流
+
+所有用户经 get_chat_model 共用同一批供应商账号，突发流量会触发供应商 429 → 兜底结果 → 用户重试，形成风暴。
+ProviderLimiter 在调用前排队：
+
+- max_inflight：同时进行中的调用数上限；
+- rpm / tpm：每分钟请求数与 token 数的令牌桶（容量为一分钟的额度，连续补充）；tpm 在调用前按
+  prompt 估算 + 预计输出（_OUTPUT_TOKENS）预扣，完成后按实际用量（usage_metadata）多退少补；
+- 排队按先来后到（FIFO），最多等待 AGENT_LLM_QUEUE_TIMEOUT_SECONDS，超时抛出 LimitTimeout；
+- 同步与异步调用共用同一份额度（状态由线程锁保护）。等待方不轮询：同步调用方阻塞在各自的 threading.Event 上，
+  异步调用方 await 各自的 future；队首离开（占用/超时/取消）与 release() 归还名额时唤醒新的队首。只有队首在等待
+  rpm/tpm 令牌桶补足时才按需要的时长定时醒来。
+
+配置：AGENT_LLM_LIMITS（JSON），键为 llm.py aliases 表中的供应商别名，可用 "别名/模型" 细化，"default" 为兜底：
+    {"default": {"max_inflight": 32}, "deepseek": {"max_inflight": 8, "rpm": 300, "tpm": 200000},
+     "qwen/qwen-max": {"max_inflight": 4, "rpm": 60}}
+值为 0 或缺省表示不限制。每个 供应商|base_url|模型 一个限流器，各自按上述规则取配置。
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from threading import Event, Lock
+from typing import Any, Deque, Dict, Optional, Sequence
+
+from app.utils.env import get_llm_limits, get_llm_queue_timeout_seconds
+from app.utils.tokens import approx_tokens
+
+# 调用前预扣的输出 token 数（完成后按实际用量修正）
+_OUTPUT_TOKENS = 1000
+
+
+class LimitTimeout(RuntimeError):
+    pass
+
+
+class _Bucket:
+    """每分钟 rate 个令牌的令牌桶；余额可以为负（实际用量超过预扣时），此后的调用等待补足。"""
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self._rate = self.capacity / 60.0
+        self._at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._at) * self._rate)
+        self._at = now
+
+    def wait_for(self, n: float) -> float:
+        """还需等待多少秒才能取出 n 个令牌（n 超过容量时按容量计）。"""
+        need = min(n, self.capacity) - self.tokens
+        return need / self._rate if need > 0 else 0.0
+
+
+def _resolve(future: "asyncio.Future[None]") -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class _Waiter:
+    """排队中的一次调用。同步调用方阻塞在 Event 上；异步调用方（loop 非空）await 每轮新建的 future。"""
+
+    __slots__ = ("tokens", "_loop", "_event", "_future")
+
+    def __init__(self, tokens: int, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        self.tokens = tokens
+        self._loop = loop
+        self._event = Event() if loop is None else None
+        self._future: "Optional[asyncio.Future[None]]" = None
+
+    def reset(self) -> None:
+        """检查额度之前（持锁）调用：此后的 wake() 都会让下一次 wait() 立即返回。"""
+        if self._event is not None:
+            self._event.clear()
+        else:
+            self._future = self._loop.create_future()
+
+    def wake(self) -> None:
+        """可在任意线程调用（持锁）。"""
+        if self._event is not None:
+            self._event.set()
+        elif self._future is not None:
+            try:
+                self._loop.call_soon_threadsafe(_resolve, self._future)
+            except RuntimeError:  # 事件循环已关闭
+                pass
+
+    def wait(self, timeout: float) -> None:
+        self._event.wait(timeout)
+
+    async def await_(self, timeout: float) -> None:
+        await asyncio.wait((self._future,), timeout=timeout)
+
+
+class ProviderLimiter:
+    def __init__(self, name: str, max_inflight: int = 0, rpm: float = 0, tpm: float = 0) -> None:
+        self.name = name
+        self.max_inflight = int(max_inflight or 0)
+        self._rpm = _Bucket(rpm) if rpm else None
+        self._tpm = _Bucket(tpm) if tpm else None
+        self._lock = Lock()
+        self._queue: Deque[_Waiter] = deque()
+        self.inflight = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    # ---- 排队 ----
+
+    def _admit(self, tokens: int) -> Optional[float]:
+        """（持锁）额度足够时占用并返回 0；等待令牌桶补足时返回需等待的秒数；并发已满返回 None（等待 release 唤醒）。"""
+        if self.max_inflight and self.inflight >= self.max_inflight:
+            return None
+        now = time.monotonic()
+        wait = 0.0
+        for bucket, n in ((self._rpm, 1), (self._tpm, tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_for(n))
+        if wait > 0:
+            return wait
+        if self._rpm is not None:
+            self._rpm.tokens -= 1
+        if self._tpm is not None:
+            self._tpm.tokens -= tokens
+        self.inflight += 1
+        return 0.0
+
+    def _wake_head(self) -> None:
+        """（持锁）队首变化或名额归还后唤醒队首；其余等待者在成为队首前无需醒来。"""
+        if self._queue:
+            self._queue[0].wake()
+
+    def _try_acquire(self, waiter: _Waiter) -> Optional[float]:
+        """轮到该 waiter 且额度足够时占用并返回 0；否则同 _admit（不是队首时返回 None）。"""
+        with self._lock:
+            waiter.reset()
+            if self._queue[0] is not waiter:
+                return None
+            wait = self._admit(waiter.tokens)
+            if wait == 0:
+                self._queue.popleft()
+                # 仍有空闲名额时下一位可以紧接着占用
+                self._wake_head()
+            return wait
+
+    def _enter(self, waiter: _Waiter) -> _Waiter:
+        with self._lock:
+            self._queue.append(waiter)
+            return waiter
+
+    def _leave(self, waiter: _Waiter) -> None:
+        with self._lock:
+            head = bool(self._queue) and self._queue[0] is waiter
+            try:
+                self._queue.remove(waiter)
+            except ValueError:
+                return
+            if head:
+                self._wake_head()
+
+    def _acquired(self, waited: float) -> None:
+        with self._lock:
+            self.acquired += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def _timed_out(self, waiter: _Waiter) -> LimitTimeout:
+        self._leave(waiter)
+        with self._lock:
+            self.timeouts += 1
+        return LimitTimeout(f"LLM queue timeout for {self.name}")
+
+    def acquire(self, tokens: int, timeout: Optional[float] = None) -> None:
+        timeout = get_llm_queue_timeout_seconds() if timeout is None else timeout
+        t0 = time.monotonic()
+        waiter = self._enter(_Waiter(tokens))
+        while True:
+            wait = self._try_acquire(waiter)
+            if wait == 0:
+                self._acquired(time.monotonic() - t0)
+                return
+            remaining = t0 + timeout - time.monotonic()
+            # 令牌桶补足所需时间已超过剩余等待时间：直接超时，不必干等
+            if remaining <= 0 or (wait is not None and wait > remaining):
+                raise self._timed_out(waiter)
+            waiter.wait(remaining if wait is None else wait)
+
+    async def aacquire(self, tokens: int, timeout: Optional[float] = None) -> None:
+        timeout = get_llm_queue_timeout_seconds() if timeout is None else timeout
+        t0 = time.monotonic()
+        waiter = self._enter(_Waiter(tokens, asyncio.get_running_loop()))
+        try:
+            while True:
+                wait = self._try_acquire(waiter)
+                if wait == 0:
+                    self._acquired(time.monotonic() - t0)
+                    return
+                remaining = t0 + timeout - time.monotonic()
+                if remaining <= 0 or (wait is not None and wait > remaining):
+                    raise self._timed_out(waiter)
+                await waiter.await_(remaining if wait is None else wait)
+        except asyncio.CancelledError:
+            self._leave(waiter)
+            raise
+
+    def try_acquire(self, tokens: int) -> bool:
+        """不排队：当前没有等待者且额度足够时立即占用（用于可有可无的对冲请求）。"""
+        with self._lock:
+            ok = not self._queue and self._admit(tokens) == 0
+        if ok:
+            self._acquired(0.0)
+        return ok
+
+    def release(self, reserved: int, used: Optional[int] = None) -> None:
+        """调用结束：归还并发名额；提供实际用量时修正 tpm 的预扣。"""
+        with self._lock:
+            self.inflight = max(0, self.inflight - 1)
+            if self._tpm is not None and used is not None:
+                self._tpm.tokens += reserved - used
+            self._wake_head()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            for bucket in (self._rpm, self._tpm):
+                if bucket is not None:
+                    bucket.refill(now)
+            return {
+                "inflight": self.inflight,
+                "max_inflight": self.max_inflight,
+                "waiting": len(self._queue),
+                "acquired": self.acquired,
+                "timeouts": self.timeouts,
+                "avg_wait_seconds": round(self.wait_seconds / self.acquired, 4) if self.acquired else 0.0,
+                "max_wait_seconds": round(self.max_wait_seconds, 4),
+                "rpm_available": round(self._rpm.tokens, 1) if self._rpm is not None else None,
+                "tpm_available": round(self._tpm.tokens, 1) if self._tpm is not None else None,
+            }
+
+
+def prompt_tokens(messages: Any) -> int:
+    if isinstance(messages, Sequence) and not isinstance(messages, str):
+        text = "".join(str(getattr(m, "content", m)) for m in messages)
+    else:
+        text = str(getattr(messages, "to_string", lambda: messages)())
+    return approx_tokens(text)
+
+
+def estimate_tokens(messages: Any) -> int:
+    """调用前预扣的 token：prompt 估算 + 预计输出。"""
+    return prompt_tokens(messages) + _OUTPUT_TOKENS
+
+
+def used_tokens(message: Any) -> Optional[int]:
+    usage = getattr(message, "usage_metadata", None) or {}
+    total = usage.get("total_tokens")
+    return int(total) if total else None
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+_limiters_lock = Lock()
+
+
+def _config_for(provider: str, model: str) -> Dict[str, Any]:
+    limits = get_llm_limits()
+    for name in (f"{provider}/{model}", provider, "default"):
+        if name in limits:
+            return limits[name]
+    return {"max_inflight": 32}
+
+
+def get_limiter(key: str) -> ProviderLimiter:
+    """key 为 llm._provider_key 的 "供应商|base_url|模型"。"""
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            provider, _, rest = key.partition("|")
+            model = rest.rpartition("|")[2]
+            cfg = _config_for(provider, model)
+            limiter = _limiters[key] = ProviderLimiter(
+                key,
+                max_inflight=cfg.get("max_inflight", 0),
+                rpm=cfg.get("rpm", 0),
+                tpm=cfg.get("tpm", 0),
+            )
+        return limiter
+
+
+def rate_limit_stats() -> Dict[str, Any]:
+    with _limiters_lock:
+        items = list(_limiters.items())
+    return {k: v.stats() for k, v in items}
@@ -0,0 +1,416 @@
+"""
+LLM 调用的对冲请求（hedging）与按供应商的熔断器
+
+单个供应商变慢或出错时，节点要么一直等到超时，要么最终退回占位结果，整轮的尾延迟（p99）由最慢的一次调用决定。
+ResilientChatModel 包装 get_chat_model 返回的模型（接口与 Chat 模型的 invoke/ainvoke 一致，可直接接入 prompt | llm）：
+
+- 对冲：主模型在该节点历史 p95 延迟内未返回时，向备用模型（AGENT_LLM_HEDGE_MODEL，JSON 格式的 model_params）
+  发出一份相同的请求，采用先返回的有效结果并取消另一个；主模型出错时立即切换到备用模型（failover）。
+  样本不足（< 20 次）时使用 AGENT_LLM_HEDGE_DELAY_SECONDS 作为对冲等待时间；
+- 熔断：每个供应商（provider/base_url/model）一个 CircuitBreaker，60 秒窗口内失败（含超过 AGENT_LLM_TIMEOUT_SECONDS 的超时）
+  达到 AGENT_LLM_BREAKER_FAILURES 次且失败率 ≥ 50% 时断开，AGENT_LLM_BREAKER_COOLDOWN_SECONDS 后放行一次探测请求，
+  成功则恢复；断开期间直接使用备用模型，两者都不可用时立即抛出 CircuitOpenError（节点随即退回兜底结果，而不是等待超时）；
+- 有效结果：非空文本；json_mode 时还需能被 parse_llm_json 解析；先返回的结果无效时继续等待另一个；
+- 备用模型的调用不挂接回调：SSE 的 token/document 事件只来自主模型，备用模型胜出时以最终的 state 事件为准；
+- 同步 invoke 只做熔断与 failover（不对冲）；
+- 每次调用先经该供应商的 ProviderLimiter 排队（并发上限与 rpm/tpm 令牌桶，见 rate_limit.py），排队时间不计入延迟统计；
+  对冲请求不排队，备用供应商没有空闲额度时放弃对冲；排队超时（LimitTimeout）不计为供应商失败；
+- 每次调用的耗时（outcome=ok/error/cancelled）与 token 用量计入 /metrics（metrics.llm_call_duration / llm_tokens）。
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from collections import deque
+from threading import Lock
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from app.services import metrics
+from app.services.json_repair import parse_llm_json
+from app.services.rate_limit import estimate_tokens, get_limiter, prompt_tokens, used_tokens
+from app.utils.env import (
+    get_llm_breaker_cooldown_seconds,
+    get_llm_breaker_failures,
+    get_llm_hedge_delay_seconds,
+    get_llm_timeout_seconds,
+)
+from app.utils.log import get_logger
+from app.utils.tokens import approx_tokens
+
+log = get_logger("resilience")
+
+_MIN_SAMPLES = 20
+_WINDOW_SIZE = 200
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """closed →（窗口内失败过多）→ open →（冷却结束）→ half_open（放行一次探测）→ closed / open。"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        failure_rate: float = 0.5,
+        window_seconds: float = 60.0,
+        cooldown_seconds: float = 30.0,
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_rate = failure_rate
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._probing = False
+        self._window: Deque[Tuple[float, bool]] = deque()
+        self._lock = Lock()
+        self.calls = 0
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """是否放行一次调用；half_open 状态下只放行一个探测请求。"""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown_seconds:
+                self.state, self._probing = "half_open", False
+            if self.state == "closed" or (self.state == "half_open" and not self._probing):
+                self._probing = self.state == "half_open"
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success: bool) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.calls += 1
+            self.failures += 0 if success else 1
+            if self.state == "half_open":
+                self._probing = False
+                if success:
+                    self.state = "closed"
+                    self._window.clear()
+                else:
+                    self._open(now)
+                return
+            self._window.append((now, success))
+            while self._window and now - self._window[0][0] > self.window_seconds:
+                self._window.popleft()
+            failed = sum(1 for _, ok in self._window if not ok)
+            if self.state == "closed" and failed >= self.failure_threshold and failed / len(self._window) >= self.failure_rate:
+                self._open(now)
+
+    def release(self) -> None:
+        """放行的调用被取消（未产生结果）时归还探测名额。"""
+        with self._lock:
+            self._probing = False
+
+    def _open(self, now: float) -> None:
+        self.state = "open"
+        self._opened_at = now
+        self.opened += 1
+        log.warning("circuit_opened", provider=self.name)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "calls": self.calls,
+                "failures": self.failures,
+                "window_failures": sum(1 for _, ok in self._window if not ok),
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+class _Latency:
+    """按 (供应商, 节点) 记录成功调用的耗时，提供 p95 作为对冲等待时间。"""
+
+    def __init__(self) -> None:
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self._lock = Lock()
+
+    def record(self, key: str, node: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault((key, node), deque(maxlen=_WINDOW_SIZE)).append(seconds)
+
+    def p95(self, key: str, node: str) -> Optional[float]:
+        with self._lock:
+            samples = self._samples.get((key, node))
+            if not samples or len(samples) < _MIN_SAMPLES:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            items = list(self._samples.items())
+        out: Dict[str, Dict[str, Any]] = {}
+        for (key, node), _ in items:
+            p95 = self.p95(key, node)
+            out.setdefault(key, {})[node] = round(p95, 3) if p95 is not None else None
+        return out
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = Lock()
+_latency = _Latency()
+_counts_lock = Lock()
+_counts: Dict[str, int] = {
+    "calls": 0,
+    "hedges": 0,
+    "hedge_wins": 0,
+    "failovers": 0,
+    "short_circuits": 0,
+    "invalid_responses": 0,
+    "timeouts": 0,
+    "hedges_skipped_limit": 0,
+}
+
+
+def get_breaker(key: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(
+                key,
+                failure_threshold=get_llm_breaker_failures(),
+                cooldown_seconds=get_llm_breaker_cooldown_seconds(),
+            )
+        return breaker
+
+
+def _count(key: str) -> None:
+    with _counts_lock:
+        _counts[key] += 1
+
+
+def resilience_stats() -> Dict[str, Any]:
+    """对冲/failover/熔断计数、各供应商熔断器状态与各节点的 p95 延迟（对冲等待时间）。"""
+    with _counts_lock:
+        counts = dict(_counts)
+    with _breakers_lock:
+        breakers = list(_breakers.items())
+    return {**counts, "breakers": {k: b.stats() for k, b in breakers}, "p95_seconds": _latency.snapshot()}
+
+
+def _node_of(config: Optional[RunnableConfig]) -> str:
+    return str(((config or {}).get("metadata") or {}).get("langgraph_node") or "default")
+
+
+def _without_callbacks(config: Optional[RunnableConfig]) -> RunnableConfig:
+    # 空列表而不是 None：None 会被 ensure_config 用上下文中的父级回调补齐
+    return {**(config or {}), "callbacks": []}
+
+
+class _Target:
+    __slots__ = ("name", "model", "key", "breaker", "limiter", "provider", "model_name")
+
+    def __init__(self, name: str, model: Any, key: str) -> None:
+        self.name = name
+        self.model = model
+        self.key = key
+        self.breaker = get_breaker(key)
+        self.limiter = get_limiter(key)
+        # key 为 "供应商|base_url|模型"，作为指标标签时去掉 base_url
+        self.provider, _, rest = key.partition("|")
+        self.model_name = rest.rpartition("|")[2] or "default"
+
+    def observe(self, input: Any, message: Any, seconds: float, outcome: str) -> None:
+        metrics.llm_call_duration.observe(seconds, provider=self.provider, model=self.model_name, outcome=outcome)
+        if message is None:
+            return
+        usage = getattr(message, "usage_metadata", None) or {}
+        prompt = usage.get("input_tokens") or prompt_tokens(input)
+        completion = usage.get("output_tokens") or approx_tokens(str(getattr(message, "content", "") or ""))
+        metrics.llm_tokens.inc(prompt, provider=self.provider, model=self.model_name, type="prompt")
+        metrics.llm_tokens.inc(completion, provider=self.provider, model=self.model_name, type="completion")
+
+
+class ResilientChatModel(Runnable):
+    def __init__(
+        self,
+        primary: Any,
+        primary_key: str,
+        secondary: Any = None,
+        secondary_key: Optional[str] = None,
+        json_mode: bool = False,
+    ) -> None:
+        self.primary = primary
+        self.json_mode = json_mode
+        self._primary = _Target("primary", primary, primary_key)
+        self._secondary = _Target("secondary", secondary, secondary_key or "secondary") if secondary is not None else None
+
+    def _valid(self, message: Any) -> bool:
+        content = getattr(message, "content", message)
+        if not isinstance(content, str) or not content.strip():
+            return False
+        return parse_llm_json(content).ok if self.json_mode else True
+
+    # ---- sync：熔断 + failover ----
+
+    def _call(self, target: _Target, input: Any, config: Optional[RunnableConfig], node: str, **kwargs: Any) -> Any:
+        reserved = estimate_tokens(input)
+        try:
+            target.limiter.acquire(reserved)
+        except Exception:
+            target.breaker.release()
+            raise
+        t0 = time.monotonic()
+        message = None
+        try:
+            message = target.model.invoke(input, config, **kwargs)
+        except Exception:
+            target.breaker.record(False)
+            target.observe(input, None, time.monotonic() - t0, "error")
+            raise
+        finally:
+            target.limiter.release(reserved, used_tokens(message))
+        target.breaker.record(True)
+        elapsed = time.monotonic() - t0
+        _latency.record(target.key, node, elapsed)
+        target.observe(input, message, elapsed, "ok")
+        return message
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        _count("calls")
+        node = _node_of(config)
+        secondary = self._secondary
+        if self._primary.breaker.allow():
+            try:
+                return self._call(self._primary, input, config, node, **kwargs)
+            except Exception:
+                if secondary is None or not secondary.breaker.allow():
+                    raise
+            _count("failovers")
+        elif secondary is not None and secondary.breaker.allow():
+            _count("short_circuits")
+        else:
+            _count("short_circuits")
+            raise CircuitOpenError(f"circuit open for {self._primary.key}")
+        return self._call(secondary, input, _without_callbacks(config), node, **kwargs)
+
+    # ---- async：熔断 + 对冲 + failover ----
+
+    async def _acall(
+        self,
+        target: _Target,
+        input: Any,
+        config: Optional[RunnableConfig],
+        node: str,
+        reserved: int,
+        acquired: bool = False,
+        **kwargs: Any,
+    ) -> Any:
+        if not acquired:
+            try:
+                await target.limiter.aacquire(reserved)
+            except BaseException:
+                target.breaker.release()
+                raise
+        t0 = time.monotonic()
+        message = None
+        try:
+            message = await asyncio.wait_for(target.model.ainvoke(input, config, **kwargs), get_llm_timeout_seconds())
+        except asyncio.CancelledError:
+            # 对冲中落败被取消：不计入成功/失败
+            target.breaker.release()
+            target.observe(input, None, time.monotonic() - t0, "cancelled")
+            raise
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                _count("timeouts")
+            target.breaker.record(False)
+            target.observe(input, None, time.monotonic() - t0, "error")
+            raise
+        finally:
+            target.limiter.release(reserved, used_tokens(message))
+        target.breaker.record(True)
+        elapsed = time.monotonic() - t0
+        _latency.record(target.key, node, elapsed)
+        target.observe(input, message, elapsed, "ok")
+        return message
+
+    def _hedge_delay(self, node: str) -> float:
+        p95 = _latency.p95(self._primary.key, node)
+        return p95 if p95 is not None else get_llm_hedge_delay_seconds()
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        _count("calls")
+        node = _node_of(config)
+        secondary = self._secondary
+        tasks: Dict["asyncio.Task[Any]", _Target] = {}
+        reserved = estimate_tokens(input)
+
+        def launch(target: _Target, acquired: bool = False) -> None:
+            cfg = config if target is self._primary else _without_callbacks(config)
+            tasks[asyncio.ensure_future(self._acall(target, input, cfg, node, reserved, acquired, **kwargs))] = target
+
+        if self._primary.breaker.allow():
+            launch(self._primary)
+        elif secondary is not None and secondary.breaker.allow():
+            _count("short_circuits")
+            launch(secondary)
+            secondary = None
+        else:
+            _count("short_circuits")
+            raise CircuitOpenError(f"circuit open for {self._primary.key}")
+
+        # 对冲计时已到（不论是否真正发出了对冲请求）与备用模型是否已真正发出分开记录：
+        # 计时到期但熔断/限流未放行对冲时，主模型随后出错或结果无效仍需 failover
+        hedge_expired = False
+        secondary_launched = False
+        fallback: Any = None
+        error: Optional[BaseException] = None
+        try:
+            while tasks:
+                can_hedge = secondary is not None and not hedge_expired and not secondary_launched
+                done, _ = await asyncio.wait(
+                    list(tasks),
+                    timeout=self._hedge_delay(node) if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    hedge_expired = True
+                    if not secondary.breaker.allow():
+                        continue
+                    if secondary.limiter.try_acquire(reserved):
+                        _count("hedges")
+                        secondary_launched = True
+                        launch(secondary, acquired=True)
+                    else:
+                        secondary.breaker.release()
+                        _count("hedges_skipped_limit")
+                    continue
+                for task in done:
+                    target = tasks.pop(task)
+                    try:
+                        message = task.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if self._valid(message):
+                        if target is not self._primary and tasks:
+                            _count("hedge_wins")
+                        return message
+                    _count("invalid_responses")
+                    fallback = fallback if fallback is not None else message
+                if not tasks and secondary is not None and not secondary_launched:
+                    # 主模型出错或结果无效且备用模型尚未发出：直接请求备用模型（排队等待限流名额）
+                    secondary_launched = True
+                    if secondary.breaker.allow():
+                        _count("failovers")
+                        launch(secondary)
+        finally:
+            for task in tasks:
+                task.cancel()
+        if fallback is not None:
+            return fallback
+        raise error if error is not None else CircuitOpenError(f"circuit open for {self._primary.key}")
@@ -0,0 +1,166 @@
+"""
+文件内容的相关性选段（BM25）
+
+提取出的全文可能远大于 prompt 可承受的长度；与其保留“前 N 个字符”，不如把全文切块，
+用本地词法索引（BM25，仅 CPU）按当前 human_message 与待澄清问题打分，在 token 预算内挑选最相关的块，
+并按原文顺序拼接。这样每轮进入 prompt 的文件上下文大小固定，与文件大小无关。
+
+- 中文分词：安装了 jieba 时使用 jieba.lcut_for_search；否则对连续汉字取二元组（bigram），无需额外依赖；
+- 英文/数字：按单词切分并小写；
+- 全文不超过预算时原样返回；查询无有效词或全部零分时退化为保留开头部分；
+- 每轮重新选段：file_toolscall_agent 只在首次提取时写入 file_content（当轮的选段结果）与提取缓存键 content_key，
+  构造分析 prompt 时（requirements_analysis_agent）凭 content_key 从提取缓存取回全文，按本轮的 human_message
+  与待澄清问题重新选段；提取缓存关闭或条目已被淘汰时退回 file_content。
+  同一全文的切块与 BM25 索引按 LRU 复用（_index），重复轮次只需对查询打分。
+"""
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from app.services.extraction_cache import get_extraction_cache
+from app.utils.env import get_file_context_tokens
+from app.utils.log import get_logger
+from app.utils.tokens import approx_tokens
+
+try:
+    import jieba  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    jieba = None  # type: ignore
+
+log = get_logger("retrieval")
+
+_WORD_RE = re.compile(r"[a-z0-9_]+|[一-鿿]+")
+_CJK_RE = re.compile(r"[一-鿿]")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for run in _WORD_RE.findall(text.lower()):
+        if not _CJK_RE.match(run):
+            tokens.append(run)
+        elif jieba is not None:
+            tokens.extend(t for t in jieba.lcut_for_search(run) if t.strip())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def chunk_text(text: str, chunk_chars: int = 800) -> List[str]:
+    """按段落打包成不超过 chunk_chars 的块；超长段落按长度硬切。"""
+    chunks: List[str] = []
+    buf: List[str] = []
+    size = 0
+    for para in re.split(r"\n\s*\n|\n", text):
+        para = para.strip()
+        if not para:
+            continue
+        while len(para) > chunk_chars:
+            if buf:
+                chunks.append("\n".join(buf))
+                buf, size = [], 0
+            chunks.append(para[:chunk_chars])
+            para = para[chunk_chars:]
+        if size + len(para) > chunk_chars and buf:
+            chunks.append("\n".join(buf))
+            buf, size = [], 0
+        buf.append(para)
+        size += len(para) + 1
+    if buf:
+        chunks.append("\n".join(buf))
+    return chunks
+
+
+class BM25:
+    def __init__(self, docs: Sequence[List[str]], k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.tfs = [Counter(d) for d in docs]
+        self.lengths = [len(d) for d in docs]
+        self.avgdl = (sum(self.lengths) / len(docs)) if docs else 0.0
+        df: Dict[str, int] = {}
+        for tf in self.tfs:
+            for term in tf:
+                df[term] = df.get(term, 0) + 1
+        n = len(docs)
+        self.idf = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in df.items()}
+
+    def scores(self, query: Iterable[str]) -> List[float]:
+        terms = [t for t in set(query) if t in self.idf]
+        out = []
+        for tf, dl in zip(self.tfs, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * dl / self.avgdl) if self.avgdl else self.k1
+            s = 0.0
+            for t in terms:
+                f = tf.get(t)
+                if f:
+                    s += self.idf[t] * f * (self.k1 + 1) / (f + norm)
+            out.append(s)
+        return out
+
+
+@lru_cache(maxsize=32)
+def _index(text: str, chunk_chars: int) -> Tuple[List[str], BM25]:
+    chunks = chunk_text(text, chunk_chars)
+    return chunks, BM25([tokenize(c) for c in chunks])
+
+
+def select_relevant(text: str, query: str, max_tokens: int, chunk_chars: int = 800) -> str:
+    """在 max_tokens 预算内选出与 query 最相关的块，按原文顺序拼接。"""
+    if approx_tokens(text) <= max_tokens:
+        return text
+    chunks, index = _index(text, chunk_chars)
+    scores = index.scores(tokenize(query))
+    ranked = any(scores)
+    if ranked:
+        # 分数相同时靠前的块优先（标题/概述通常在前）
+        order = sorted(range(len(chunks)), key=lambda i: (-scores[i], i))
+    else:
+        order = list(range(len(chunks)))
+    picked: List[int] = []
+    used = 0
+    for i in order:
+        cost = approx_tokens(chunks[i])
+        if used + cost > max_tokens:
+            if not ranked:
+                break  # 无相关性信号：保留连续的开头部分
+            continue
+        picked.append(i)
+        used += cost
+    picked.sort()
+    parts: List[str] = []
+    prev = -1
+    for i in picked:
+        if prev >= 0 and i != prev + 1:
+            parts.append("...")
+        parts.append(chunks[i])
+        prev = i
+    return "\n".join(parts) + f"\n... [已按相关性选取 {len(picked)}/{len(chunks)} 段]"
+
+
+def relevance_query(state: Mapping[str, Any]) -> str:
+    """选段查询：最近一条 human_message + 当前待澄清问题。"""
+    latest = (state.get("messages") or [{}])[-1]
+    parts = [latest.get("message_content") or ""]
+    parts.extend(q.get("content") or "" for q in state.get("question_list") or [])
+    return "\n".join(p for p in parts if p)
+
+
+def relevant_file_content(f: Mapping[str, Any], query: str) -> Optional[str]:
+    """按本轮查询对文件全文重新选段；取不到全文（无 content_key / 缓存关闭或已淘汰）时返回已有的 file_content。"""
+    key = f.get("content_key")
+    cache = get_extraction_cache() if key else None
+    if cache is not None:
+        try:
+            text = cache.get(key)
+        except Exception as e:
+            log.warning("full_text_lookup_failed", file_id=f.get("file_id"), error=str(e))
+            text = None
+        if text:
+            return select_relevant(text, query, get_file_context_tokens())
+    return f.get("file_content")
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+
+# execute(thread_id, items) runs ONE turn for all queued items of a thread (in submit order)
+ExecuteFn = Callable[[str, List[Any]], Awaitable[dict]]
+
+
+@dataclass
+class Run:
+    run_id: str
+    thread_id: str
+    target_state_version: int
+    status: str = "queued"  # queued | running | done | failed
+    state_version: Optional[int] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+
+class RunManager:
+    """Background run registry + bounded asyncio worker pool.
+
+    - submit() registers a queued run and returns immediately (HTTP 202 path);
+    - runs are queued per thread: the worker queue holds thread ids, a thread is in it at most
+      once and only while it is not running, so one busy thread occupies at most one worker;
+    - a worker takes ALL queued runs of its thread and executes them as one turn, so every
+      queued run of a thread shares the same target_state_version (known at submit time);
+    - a fixed number of worker tasks execute queued turns, so at most `workers` turns
+      run concurrently and the rest wait in the queue instead of holding sockets;
+    - finished runs are kept for `retention` seconds (and at most `max_runs`) for /v1/runs/{id};
+    - on_finish(run) is called after every run (used to wake /v1/poll long-poll waiters).
+    """
+
+    def __init__(
+        self,
+        execute: ExecuteFn,
+        workers: int = 32,
+        retention: float = 3600.0,
+        max_runs: int = 10000,
+        on_finish: Optional[Callable[[Run], None]] = None,
+    ) -> None:
+        self._execute = execute
+        self._workers = max(1, workers)
+        self._on_finish = on_finish
+        self._retention = retention
+        self._max_runs = max_runs
+        self._runs: "OrderedDict[str, Run]" = OrderedDict()
+        self._latest_by_thread: Dict[str, str] = {}
+        self._queue: "Optional[asyncio.Queue[str]]" = None
+        # thread_id -> runs not yet picked by a worker (with their items), and threads being executed
+        self._pending: Dict[str, List[tuple[Run, Any]]] = {}
+        self._active: Set[str] = set()
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Spawn the worker tasks; must be called from the running event loop (app startup)."""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, thread_id: str, state_version: int, item: Any, busy: bool = False) -> Run:
+        """Queue `item` for thread_id. state_version is the thread's current version; busy=True means a
+        turn of this thread is already in progress outside the manager (e.g. a foreground /v1/submit)."""
+        if self._queue is None:
+            raise RuntimeError("RunManager is not started")
+        pending = self._pending.get(thread_id)
+        if pending:
+            # 并入该 thread 已排队的轮次，目标版本与之相同
+            target = pending[0][0].target_state_version
+        else:
+            target = state_version + (2 if busy or thread_id in self._active else 1)
+        run = Run(run_id=uuid.uuid4().hex, thread_id=thread_id, target_state_version=target)
+        self._runs[run.run_id] = run
+        self._latest_by_thread[thread_id] = run.run_id
+        self._evict()
+        if pending:
+            pending.append((run, item))
+        else:
+            self._pending[thread_id] = [(run, item)]
+            if thread_id not in self._active:
+                self._queue.put_nowait(thread_id)
+        return run
+
+    def get(self, run_id: str) -> Optional[Run]:
+        return self._runs.get(run_id)
+
+    def latest_for_thread(self, thread_id: str) -> Optional[Run]:
+        run_id = self._latest_by_thread.get(thread_id)
+        return self._runs.get(run_id) if run_id else None
+
+    def queued(self) -> int:
+        """Runs not yet picked up by a worker."""
+        return sum(len(p) for p in self._pending.values())
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        while True:
+            thread_id = await self._queue.get()
+            batch = self._pending.pop(thread_id, [])
+            if not batch:
+                self._queue.task_done()
+                continue
+            self._active.add(thread_id)
+            now = time.time()
+            for run, _ in batch:
+                run.status = "running"
+                run.started_at = now
+            try:
+                result_state = await self._execute(thread_id, [item for _, item in batch])
+                version = int(result_state.get("state_version", 0))
+                for run, _ in batch:
+                    run.state_version = version
+                    run.status = "done"
+            except asyncio.CancelledError:
+                for run, _ in batch:
+                    run.status = "failed"
+                    run.error = "cancelled"
+                raise
+            except Exception as ex:
+                for run, _ in batch:
+                    run.status = "failed"
+                    run.error = str(ex)
+            finally:
+                self._active.discard(thread_id)
+                # 执行期间到达的 run 已在 _pending 中等待，此时才重新入队，保证每个 thread 最多占用一个 worker
+                if self._pending.get(thread_id):
+                    self._queue.put_nowait(thread_id)
+                now = time.time()
+                for run, _ in batch:
+                    run.finished_at = now
+                self._queue.task_done()
+                if self._on_finish is not None:
+                    try:
+                        self._on_finish(batch[-1][0])
+                    except Exception:
+                        pass
+
+    def _evict(self) -> None:
+        now = time.time()
+        while self._runs:
+            run_id, run = next(iter(self._runs.items()))
+            # Never drop an unfinished run; older finished ones go once expired or over capacity
+            if run.finished_at is None:
+                break
+            if len(self._runs) <= self._max_runs and now - run.finished_at <= self._retention:
+                break
+            self._runs.pop(run_id)
+            if self._latest_by_thread.get(run.thread_id) == run_id:
+                self._latest_by_thread.pop(run.thread_id, None)
@@ -0,0 +1,242 @@
+"""
+下一轮的推测执行（可选启用，AGENT_SPECULATION=true）
+
+每轮产出 3 个问题 × 3 个建议选项，很多用户只是勾选选项后直接提交，然后再等待一整轮 LLM。
+一轮结束后，SpeculationManager 在空闲容量上后台预先执行“最可能的下一轮”（每题选第一个选项），
+若用户提交的内容与推测一致，直接返回预先算好的结果。
+
+- 预测：predict_message 按前端 Workspace.buildHumanMessage 的格式拼出“当前文档 + 每题第一个选项”的 human_message；
+- 匹配：signature 对规范化后的消息（去掉文档版本标签、折叠空白）、本轮文件、模型参数与基线 state_version 取哈希，
+  只有完全一致才算命中；推测仍在执行时，命中的请求等待其完成（hits_inflight）；
+- 取消：同一 thread 的任何真实轮次开始时，其余推测立即取消；应用关闭时全部取消；
+- 预算：同时执行的推测数上限（AGENT_SPECULATION_MAX_INFLIGHT），每小时估算 token 上限
+  （AGENT_SPECULATION_TOKENS_PER_HOUR，按 prompt 与预计输出估算，在调度时预扣），结果在 AGENT_SPECULATION_TTL_SECONDS 后过期；
+  has_capacity 返回 False（如后台 run 正在排队）时不调度；
+- 推测轮次在不带 checkpointer 的图上执行，不写入任何 thread；命中后由调用方提交到真实 thread。
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import orjson
+
+from app.utils.log import get_logger
+from app.utils.tokens import approx_tokens
+
+log = get_logger("speculation")
+
+_DOC_HEADER_RE = re.compile(r"^需求文档\(v[^)]*\):")
+_SPACE_RE = re.compile(r"\s+")
+# 推测轮次输出中除文档外的部分（问题列表等）的估算 token 数
+_OUTPUT_OVERHEAD_TOKENS = 600
+
+
+def predict_message(state: Dict[str, Any]) -> Optional[str]:
+    """“每题选第一个选项、无补充说明”时前端会发送的 human_message；没有可选问题时返回 None。"""
+    questions = [q for q in state.get("question_list") or [] if q.get("suggestion_options")]
+    if not questions:
+        return None
+    doc = (state.get("requirements_document") or {}).get("content") or ""
+    lines = [f"需求文档(v{(state.get('requirements_document') or {}).get('version', '-')}):\n{doc}"]
+    for q in questions:
+        lines.append(f"问题: {q.get('content')}\n选项: {q['suggestion_options'][0].get('content')}")
+    return "\n\n".join(lines)
+
+
+def canonical_message(text: str) -> str:
+    # 前端的版本标签取自文档列表，与 agent 的 version 不一定一致，比较时忽略
+    return _SPACE_RE.sub(" ", _DOC_HEADER_RE.sub("需求文档:", (text or "").strip())).strip()
+
+
+def signature(init_state: Dict[str, Any]) -> str:
+    messages = init_state.get("messages") or [{}]
+    payload = {
+        "message": canonical_message(messages[-1].get("message_content", "")),
+        "files": sorted(f.get("file_id") or "" for f in init_state.get("multi_files") or []),
+        "model": init_state.get("model_params") or {},
+        "status": init_state.get("current_status"),
+        "version": int(init_state.get("state_version", 0) or 0),
+    }
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def estimate_tokens(init_state: Dict[str, Any]) -> int:
+    """粗略估算一次推测轮次的 token 消耗：输入（消息 + 文档 + 问题）+ 输出（文档 + 问题）。"""
+    messages = init_state.get("messages") or [{}]
+    doc = (init_state.get("requirements_document") or {}).get("content") or ""
+    questions = orjson.dumps(init_state.get("question_list") or []).decode()
+    return (
+        approx_tokens(messages[-1].get("message_content", ""))
+        + 2 * approx_tokens(doc)
+        + approx_tokens(questions)
+        + _OUTPUT_OVERHEAD_TOKENS
+    )
+
+
+@dataclass
+class _Speculation:
+    thread_id: str
+    key: str
+    task: "asyncio.Task[dict]"
+    tokens: int
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class SpeculationManager:
+    def __init__(
+        self,
+        execute: Callable[[Dict[str, Any]], Awaitable[dict]],
+        max_inflight: int = 2,
+        tokens_per_hour: int = 200000,
+        ttl_seconds: float = 900.0,
+        has_capacity: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self._execute = execute
+        self.max_inflight = max_inflight
+        self.tokens_per_hour = tokens_per_hour
+        self.ttl_seconds = ttl_seconds
+        self._has_capacity = has_capacity
+        self._by_thread: Dict[str, List[_Speculation]] = {}
+        self._spent: Deque[Tuple[float, int]] = deque()
+        self._counts: Dict[str, int] = {
+            "scheduled": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "expired": 0,
+            "hits": 0,
+            "hits_inflight": 0,
+            "misses": 0,
+            "skipped_budget": 0,
+            "skipped_capacity": 0,
+        }
+        self.tokens_spent = 0
+
+    # ---- scheduling ----
+
+    def schedule(self, thread_id: str, init_state: Dict[str, Any]) -> bool:
+        """为 thread 调度一次推测轮次；超出并发/预算或没有空闲容量时跳过，返回是否已调度。
+        thread 的旧推测基于过时的状态，一律先取消。"""
+        self.cancel(thread_id)
+        self._expire()
+        if self._has_capacity is not None and not self._has_capacity():
+            self._counts["skipped_capacity"] += 1
+            return False
+        if self._inflight() >= self.max_inflight:
+            self._counts["skipped_capacity"] += 1
+            return False
+        tokens = estimate_tokens(init_state)
+        if self._spent_last_hour() + tokens > self.tokens_per_hour:
+            self._counts["skipped_budget"] += 1
+            return False
+        self._spent.append((time.monotonic(), tokens))
+        self.tokens_spent += tokens
+        task = asyncio.create_task(self._execute(init_state))
+        spec = _Speculation(thread_id, signature(init_state), task, tokens)
+        task.add_done_callback(self._on_done)
+        self._by_thread.setdefault(thread_id, []).append(spec)
+        self._counts["scheduled"] += 1
+        return True
+
+    def _on_done(self, task: "asyncio.Task[dict]") -> None:
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self._counts["failed"] += 1
+            log.warning("turn_failed", error=str(task.exception()))
+        else:
+            self._counts["completed"] += 1
+
+    # ---- lookup ----
+
+    async def take(self, thread_id: str, init_state: Dict[str, Any]) -> Optional[dict]:
+        """真实轮次开始前调用：命中则返回推测结果（仍在执行时等待其完成），并取消该 thread 的其余推测。"""
+        specs = self._by_thread.pop(thread_id, [])
+        if not specs:
+            return None
+        key = signature(init_state)
+        hit = None
+        now = time.monotonic()
+        for spec in specs:
+            if hit is None and spec.key == key:
+                if now - spec.created_at > self.ttl_seconds:
+                    self._counts["expired"] += 1
+                    spec.task.cancel()
+                    continue
+                hit = spec
+            elif not spec.task.done():
+                self._counts["cancelled"] += 1
+                spec.task.cancel()
+        if hit is None:
+            self._counts["misses"] += 1
+            return None
+        inflight = not hit.task.done()
+        try:
+            result = await hit.task
+        except Exception:
+            self._counts["misses"] += 1
+            return None
+        self._counts["hits"] += 1
+        if inflight:
+            self._counts["hits_inflight"] += 1
+        return result
+
+    def cancel(self, thread_id: str) -> None:
+        for spec in self._by_thread.pop(thread_id, []):
+            if not spec.task.done():
+                self._counts["cancelled"] += 1
+                spec.task.cancel()
+
+    async def aclose(self) -> None:
+        tasks = []
+        for thread_id in list(self._by_thread):
+            tasks.extend(s.task for s in self._by_thread.get(thread_id, []))
+            self.cancel(thread_id)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ---- accounting ----
+
+    def _inflight(self) -> int:
+        return sum(1 for specs in self._by_thread.values() for s in specs if not s.task.done())
+
+    def _spent_last_hour(self) -> int:
+        horizon = time.monotonic() - 3600
+        while self._spent and self._spent[0][0] < horizon:
+            self._spent.popleft()
+        return sum(t for _, t in self._spent)
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for thread_id in list(self._by_thread):
+            keep = []
+            for spec in self._by_thread[thread_id]:
+                if now - spec.created_at > self.ttl_seconds:
+                    self._counts["expired"] += 1
+                    spec.task.cancel()
+                else:
+                    keep.append(spec)
+            if keep:
+                self._by_thread[thread_id] = keep
+            else:
+                del self._by_thread[thread_id]
+
+    def stats(self) -> Dict[str, Any]:
+        self._expire()
+        lookups = self._counts["hits"] + self._counts["misses"]
+        return {
+            **self._counts,
+            "hit_ratio": round(self._counts["hits"] / lookups, 4) if lookups else 0.0,
+            "inflight": self._inflight(),
+            "ready": sum(1 for specs in self._by_thread.values() for s in specs if s.task.done()),
+            "max_inflight": self.max_inflight,
+            "tokens_spent_estimated": self.tokens_spent,
+            "tokens_last_hour_estimated": self._spent_last_hour(),
+            "tokens_per_hour": self.tokens_per_hour,
+        }
@@ -1,27 +1,450 @@
 from __future__ import annotations
 
-from typing import Dict, Optional
+import asyncio
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
 from threading import RLock
 
+import orjson
 
-class StateRepository:
-    """A minimal in-memory state snapshot repository.
+from app.utils.env import get_redis_url
+from app.utils.log import get_logger
+
+try:
+    import redis.asyncio as aioredis  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    aioredis = None  # type: ignore
+
+log = get_logger("state_repo")
+
+
+class VersionNotifier:
+    """Per-thread wake-up for long-poll waiters (/v1/poll?wait=...).
 
-    - Stores the latest state per thread_id for quick /v1/poll and /v1/state access.
-    - In a production setup, this can be replaced or supplemented by DB persistence.
+    - acquire() hands out the thread's current asyncio.Event; notify() sets it and drops it,
+      so the next acquire() gets a fresh one;
+    - events are reference-counted and removed when the last waiter leaves, so idle threads
+      cost nothing;
+    - notify() may be called from any thread; the wake-up is marshalled onto the event loop.
     """
 
     def __init__(self) -> None:
-        self._store: Dict[str, dict] = {}
+        self._events: Dict[str, asyncio.Event] = {}
+        self._waiters: Dict[str, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def acquire(self, thread_id: str) -> asyncio.Event:
+        self._loop = asyncio.get_running_loop()
+        ev = self._events.get(thread_id)
+        if ev is None:
+            ev = self._events[thread_id] = asyncio.Event()
+        self._waiters[thread_id] = self._waiters.get(thread_id, 0) + 1
+        return ev
+
+    def release(self, thread_id: str) -> None:
+        n = self._waiters.get(thread_id, 0) - 1
+        if n > 0:
+            self._waiters[thread_id] = n
+        else:
+            self._waiters.pop(thread_id, None)
+            self._events.pop(thread_id, None)
+
+    def notify(self, thread_id: str) -> None:
+        loop = self._loop
+        if loop is None or thread_id not in self._events:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._wake(thread_id)
+        else:
+            loop.call_soon_threadsafe(self._wake, thread_id)
+
+    def _wake(self, thread_id: str) -> None:
+        ev = self._events.pop(thread_id, None)
+        if ev is not None:
+            ev.set()
+
+
+@dataclass
+class _Entry:
+    state: dict
+    size: int
+    last_access: float
+
+
+def _estimate_bytes(state: dict) -> int:
+    try:
+        return len(_dumps(state))
+    except Exception:
+        return len(repr(state))
+
+
+class StateRepository:
+    """Bounded in-memory state snapshot repository (write-through cache in front of the checkpointer).
+
+    - Stores the latest state per thread_id for quick /v1/poll, /v1/state and pre-turn access;
+      every turn writes its final state here (write-through), so hot threads never hit the checkpointer.
+    - Bounded: LRU order + idle TTL + byte-size accounting against a memory ceiling
+      (states carry extracted file contents, so entry count alone is not a useful bound).
+    - aget() reads through to `loader` (the checkpointer) on a miss; concurrent misses of one
+      thread share a single load.
+    - wait_for_version() parks a long-poll until the thread's state_version advances.
+    - Counters (hits/misses/loads/evictions/bytes) are exposed via stats().
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_entries: int = 10000,
+        ttl_seconds: float = 3600.0,
+        loader: Optional[Callable[[str], Awaitable[Optional[dict]]]] = None,
+    ) -> None:
+        self._store: "OrderedDict[str, _Entry]" = OrderedDict()
         self._lock = RLock()
+        self._notifier = VersionNotifier()
+        self._loader = loader
+        self._inflight: Dict[str, "asyncio.Future[Optional[dict]]"] = {}
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = {"lru": 0, "ttl": 0, "bytes": 0, "stale": 0}
+
+    def set_loader(self, loader: Optional[Callable[[str], Awaitable[Optional[dict]]]]) -> None:
+        self._loader = loader
+
+    async def start(self) -> None:
+        """Hook for backends with background work (see RedisStateRepository)."""
+
+    async def aclose(self) -> None:
+        """Hook for backends holding connections (see RedisStateRepository)."""
 
     def upsert(self, state: dict) -> None:
         thread_id = state.get("thread_id")
         if not thread_id:
             return
+        size = _estimate_bytes(state)
         with self._lock:
-            self._store[thread_id] = state
+            self._put(thread_id, state, size)
+        self._notifier.notify(thread_id)
+
+    async def aupsert(self, state: dict) -> None:
+        """Async write path used after each turn; shared backends override it."""
+        self.upsert(state)
 
     def get(self, thread_id: str) -> Optional[dict]:
+        """Memory-only lookup (no read-through)."""
+        with self._lock:
+            entry = self._store.get(thread_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            now = time.monotonic()
+            if now - entry.last_access > self.ttl_seconds:
+                self._drop(thread_id, "ttl")
+                self.misses += 1
+                return None
+            entry.last_access = now
+            self._store.move_to_end(thread_id)
+            self.hits += 1
+            return entry.state
+
+    async def aget(self, thread_id: str) -> Optional[dict]:
+        """Lookup with read-through to the checkpointer on a miss."""
+        state = self.get(thread_id)
+        if state is not None:
+            return state
+        return await self._single_flight(thread_id)
+
+    async def _single_flight(self, thread_id: str) -> Optional[dict]:
+        fut = self._inflight.get(thread_id)
+        if fut is not None:
+            return await asyncio.shield(fut)
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[thread_id] = fut
+        try:
+            state = await self._load(thread_id)
+            if state:
+                with self._lock:
+                    # A turn may have written a newer snapshot while we were loading
+                    if thread_id not in self._store:
+                        self._put(thread_id, state, _estimate_bytes(state))
+                    state = self._store[thread_id].state
+            fut.set_result(state)
+            return state
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as ex:
+            fut.set_exception(ex)
+            raise
+        finally:
+            self._inflight.pop(thread_id, None)
+            if fut.done() and not fut.cancelled():
+                fut.exception()  # mark retrieved when nobody else awaited it
+
+    async def _load(self, thread_id: str) -> Optional[dict]:
+        if self._loader is None:
+            return None
+        self.loads += 1
+        return await self._loader(thread_id)
+
+    def notify(self, thread_id: str) -> None:
+        """Wake long-poll waiters without a version change (e.g. a background run failed)."""
+        self._notifier.notify(thread_id)
+
+    async def wait_for_version(self, thread_id: str, after_version: int, timeout: float) -> Optional[dict]:
+        """Return the snapshot once state_version > after_version, or the current one after timeout
+        (or after notify()). The waiter is registered before the check, so no update is missed."""
+        ev = self._notifier.acquire(thread_id)
+        try:
+            snapshot = await self.aget(thread_id)
+            if snapshot and int(snapshot.get("state_version", 0)) > after_version:
+                return snapshot
+            try:
+                await asyncio.wait_for(ev.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return await self.aget(thread_id)
+        finally:
+            self._notifier.release(thread_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._store),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "evictions": dict(self.evictions),
+            }
+
+    # ---- internals (caller holds self._lock) ----
+
+    def _put(self, thread_id: str, state: dict, size: int) -> None:
+        old = self._store.pop(thread_id, None)
+        if old is not None:
+            self._bytes -= old.size
+        self._store[thread_id] = _Entry(state=state, size=size, last_access=time.monotonic())
+        self._bytes += size
+        self._evict(keep=thread_id)
+
+    def _drop(self, thread_id: str, reason: str) -> None:
+        entry = self._store.pop(thread_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+            self.evictions[reason] += 1
+
+    def _evict(self, keep: str) -> None:
+        now = time.monotonic()
+        # LRU front = longest idle: expire by TTL first, then enforce entry/byte ceilings
+        while self._store:
+            thread_id, entry = next(iter(self._store.items()))
+            if thread_id == keep:
+                break
+            if now - entry.last_access > self.ttl_seconds:
+                self._drop(thread_id, "ttl")
+            elif len(self._store) > self.max_entries:
+                self._drop(thread_id, "lru")
+            elif self._bytes > self.max_bytes:
+                self._drop(thread_id, "bytes")
+            else:
+                break
+
+
+
+class RedisStateRepository(StateRepository):
+    """StateRepository shared across uvicorn workers/replicas through Redis.
+
+    - Each snapshot is stored as a hash {v: state_version, s: zlib(orjson(state))} under
+      `{prefix}:{thread_id}` with an idle TTL, so a poll can land on any worker;
+    - the in-process LRU (base class) stays as an L1 cache: aget() compares its version with
+      the single `v` field and only transfers/decodes the snapshot when the L1 copy is stale;
+    - every write publishes {thread_id, state_version} on `{prefix}:versions`; each worker
+      subscribes, drops stale L1 copies and wakes its local long-poll waiters;
+    - on a Redis miss the checkpointer loader is used and the result seeded back into Redis;
+    - Redis errors degrade to the local behaviour instead of failing the turn.
+    Note: background run status (/v1/runs) stays local to the worker that accepted the run.
+    """
+
+    def __init__(self, redis_url: str, prefix: str = "bp:state", **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._redis = aioredis.from_url(redis_url)
+        self._prefix = prefix
+        self._channel = f"{prefix}:versions"
+        self._origin = uuid.uuid4().hex
+        self._listener: Optional[asyncio.Task] = None
+        self._bg: set = set()
+        self.remote_notifications = 0
+        self.redis_errors = 0
+
+    def _key(self, thread_id: str) -> str:
+        return f"{self._prefix}:{thread_id}"
+
+    async def start(self) -> None:
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def aclose(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        await self._redis.aclose()
+
+    def upsert(self, state: dict) -> None:
+        # sync callers: update the local copy now and push to Redis in the background
+        super().upsert(state)
+        if state.get("thread_id"):
+            self._spawn(self._write(state, publish=True))
+
+    async def aupsert(self, state: dict) -> None:
+        thread_id = state.get("thread_id")
+        if not thread_id:
+            return
+        raw = _dumps(state)
         with self._lock:
-            return self._store.get(thread_id)
\ No newline at end of file
+            self._put(thread_id, state, len(raw))
+        self._notifier.notify(thread_id)
+        await self._write(state, publish=True, raw=raw)
+
+    def notify(self, thread_id: str) -> None:
+        super().notify(thread_id)
+        self._spawn(self._publish(thread_id, None))
+
+    async def aget(self, thread_id: str) -> Optional[dict]:
+        try:
+            remote = await self._redis.hget(self._key(thread_id), "v")
+        except Exception as ex:
+            self._error("hget", ex)
+            return await super().aget(thread_id)
+        if remote is not None:
+            with self._lock:
+                entry = self._store.get(thread_id)
+                if entry is not None and int(entry.state.get("state_version", 0)) < int(remote):
+                    self._drop(thread_id, "stale")
+        return await super().aget(thread_id)
+
+    async def _load(self, thread_id: str) -> Optional[dict]:
+        try:
+            blob = await self._redis.hget(self._key(thread_id), "s")
+        except Exception as ex:
+            self._error("hget", ex)
+            blob = None
+        if blob is not None:
+            self.loads += 1
+            return orjson.loads(zlib.decompress(blob))
+        state = await super()._load(thread_id)
+        if state:
+            await self._write(state, publish=False)
+        return state
+
+    def stats(self) -> dict:
+        out = super().stats()
+        out.update(backend="redis", remote_notifications=self.remote_notifications, redis_errors=self.redis_errors)
+        return out
+
+    # ---- internals ----
+
+    async def _write(self, state: dict, publish: bool, raw: Optional[bytes] = None) -> None:
+        thread_id = state["thread_id"]
+        version = int(state.get("state_version", 0))
+        blob = zlib.compress(raw if raw is not None else _dumps(state), 1)
+        try:
+            pipe = self._redis.pipeline(transaction=True)
+            pipe.hset(self._key(thread_id), mapping={"v": version, "s": blob})
+            if self.ttl_seconds > 0:
+                pipe.expire(self._key(thread_id), int(self.ttl_seconds))
+            await pipe.execute()
+        except Exception as ex:
+            self._error("write", ex)
+            return
+        if publish:
+            await self._publish(thread_id, version)
+
+    async def _publish(self, thread_id: str, version: Optional[int]) -> None:
+        msg = orjson.dumps({"thread_id": thread_id, "state_version": version, "origin": self._origin})
+        try:
+            await self._redis.publish(self._channel, msg)
+        except Exception as ex:
+            self._error("publish", ex)
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self._channel)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._on_message(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                self._error("subscribe", ex)
+                await asyncio.sleep(1.0)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+    def _on_message(self, data: bytes) -> None:
+        try:
+            msg = orjson.loads(data)
+        except Exception:
+            return
+        if msg.get("origin") == self._origin:
+            return
+        thread_id = msg.get("thread_id")
+        if not thread_id:
+            return
+        self.remote_notifications += 1
+        version = msg.get("state_version")
+        if version is not None:
+            with self._lock:
+                entry = self._store.get(thread_id)
+                if entry is not None and int(entry.state.get("state_version", 0)) < int(version):
+                    self._drop(thread_id, "stale")
+        self._notifier.notify(thread_id)
+
+    def _spawn(self, coro: Awaitable[None]) -> None:
+        try:
+            task = asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()  # type: ignore[attr-defined]
+            return
+        self._bg.add(task)
+        task.add_done_callback(self._bg.discard)
+
+    def _error(self, op: str, ex: Exception) -> None:
+        self.redis_errors += 1
+        log.warning("redis_error", op=op, error=str(ex))
+
+
+def _dumps(state: dict) -> bytes:
+    return orjson.dumps(state, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+def create_state_repository(**kwargs) -> StateRepository:
+    """RedisStateRepository when REDIS_URL is configured (multi-worker safe), else the in-process one."""
+    redis_url = get_redis_url()
+    if redis_url and aioredis is not None:
+        log.info("backend", backend="redis")
+        return RedisStateRepository(redis_url, **kwargs)
+    return StateRepository(**kwargs)
@@ -1,35 +1,75 @@
 from __future__ import annotations
 
+import os
+import sqlite3
 import time
-from typing import Optional
+from typing import Optional, Tuple
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
+from app.services.extraction_cache import get_extraction_cache
+from app.services.extractors import UnsupportedFileType, extract_text, resolve_extractor
+from app.utils.env import get_extract_max_chars
+from app.utils.log import get_logger
+
+log = get_logger("tools")
+
 
 class FileExtractionError(Exception):
     pass
 
 
 class FileTools:
-    """Placeholder for MCP/External tools to extract text from a file path.
+    """Extract text from an uploaded file for the analysis prompt.
 
-    For now, we simply read small text-like files; for non-text, we return a stub message.
+    The extractor is chosen by MIME type / extension from app.services.extractors (PDF, DOCX,
+    XLSX, PPTX, plain text); extraction stops once the character budget is reached.
+    Only transient I/O errors are retried; unsupported or corrupt files fail immediately.
+    Results are cached by content hash (app.services.extraction_cache), so re-attached files skip parsing.
     This class is designed to be replaced with real tools (MCP, parsers, etc.).
     """
 
-    @retry(reraise=True, stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, min=0.5, max=4), retry=retry_if_exception_type(FileExtractionError))
-    def extract_file(self, file_path: str) -> str:
+    def extract_file(self, file_path: str, file_type: Optional[str] = None, max_chars: Optional[int] = None) -> str:
+        return self.extract_file_with_key(file_path, file_type, max_chars)[0]
+
+    @retry(reraise=True, stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, min=0.5, max=4), retry=retry_if_exception_type(OSError))
+    def extract_file_with_key(
+        self, file_path: str, file_type: Optional[str] = None, max_chars: Optional[int] = None
+    ) -> Tuple[str, Optional[str]]:
+        """Return (text, extraction cache key). The key is None when the cache is disabled or unavailable;
+        later turns use it to reload the full text from the cache (see retrieval.relevant_file_content)."""
+        max_chars = max_chars or get_extract_max_chars()
+        cache = get_extraction_cache()
+        key = None
+        if cache is not None:
+            try:
+                key = cache.make_key(cache.content_hash(file_path), max_chars)
+                cached = cache.get(key)
+            except sqlite3.Error as e:
+                # 缓存不可用时直接提取，不影响本轮
+                log.warning("extraction_cache_lookup_failed", error=str(e))
+                key, cached = None, None
+            if cached is not None:
+                return cached, key
+        t0 = time.monotonic()
         try:
-            # Very naive extractor: only for small text files
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                content = f.read()
-            if not content:
-                raise FileExtractionError("empty file content")
-            # limit content size to prevent context explosion
-            if len(content) > 8000:
-                return content[:8000] + "\n... [truncated]"
-            return content
-        except Exception as e:
+            content = extract_text(file_path, file_type, max_chars)
+        except (OSError, FileExtractionError):
+            raise
+        except UnsupportedFileType as e:
             raise FileExtractionError(str(e))
+        except Exception as e:
+            # 解析失败（损坏/加密的文件等）不重试
+            raise FileExtractionError(f"failed to parse file: {e}")
+        if not content:
+            raise FileExtractionError("empty file content")
+        if key is not None:
+            extractor = getattr(resolve_extractor(file_path, file_type), "__name__", None)
+            try:
+                cache.put(key, content, os.path.getsize(file_path), extractor, (time.monotonic() - t0) * 1000)
+            except sqlite3.Error as e:
+                log.warning("extraction_cache_write_failed", error=str(e))
+                key = None
+        return content, key
 
 
-file_tools = FileTools()
\ No newline at end of file
+file_tools = FileTools()
@@ -1,8 +1,16 @@
 from __future__ import annotations
 
+import json
 import os
 from functools import lru_cache
-from typing import Optional
+from typing import Any, Dict, Optional, Tuple
+
+
+def _warn(event: str, **fields: Any) -> None:
+    # app.utils.log 依赖本模块的配置项，延迟导入
+    from app.utils.log import get_logger
+
+    get_logger("env").warning(event, **fields)
 
 
 @lru_cache(maxsize=1)
@@ -30,4 +38,257 @@ def get_postgres_url() -> Optional[str]:
 
 @lru_cache(maxsize=1)
 def is_tracing_enabled() -> bool:
-    return os.getenv("LANGCHAIN_TRACING_V2", "false").lower() == "true"
\ No newline at end of file
+    return os.getenv("LANGCHAIN_TRACING_V2", "false").lower() == "true"
+
+@lru_cache(maxsize=1)
+def get_run_workers() -> int:
+    # 后台 run 的并发 worker 数（同时执行的轮次上限），其余排队
+    return int(os.getenv("AGENT_RUN_WORKERS", "32"))
+
+
+@lru_cache(maxsize=1)
+def get_run_retention_seconds() -> float:
+    # 已结束 run 在 /v1/runs/{id} 中保留的时长
+    return float(os.getenv("AGENT_RUN_RETENTION_SECONDS", "3600"))
+
+
+@lru_cache(maxsize=1)
+def get_state_cache_max_bytes() -> int:
+    # StateRepository 内存上限（MB），按快照序列化字节数计
+    return int(float(os.getenv("AGENT_STATE_CACHE_MAX_MB", "256")) * 1024 * 1024)
+
+
+@lru_cache(maxsize=1)
+def get_state_cache_max_entries() -> int:
+    return int(os.getenv("AGENT_STATE_CACHE_MAX_ENTRIES", "10000"))
+
+
+@lru_cache(maxsize=1)
+def get_state_cache_ttl_seconds() -> float:
+    # 空闲超过该时长的 thread 快照被淘汰（下次访问从 checkpointer 回读）
+    return float(os.getenv("AGENT_STATE_CACHE_TTL_SECONDS", "3600"))
+
+
+@lru_cache(maxsize=1)
+def get_llm_pool_size() -> int:
+    # 模型实例池上限（不同 provider/base_url/model/参数/key 组合数）
+    return int(os.getenv("AGENT_LLM_POOL_SIZE", "64"))
+
+
+@lru_cache(maxsize=1)
+def get_llm_max_connections() -> int:
+    # 每个 LLM 网关（base_url）共享连接池的最大连接数
+    return int(os.getenv("AGENT_LLM_MAX_CONNECTIONS", "100"))
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache_nodes() -> Tuple[str, ...]:
+    # 启用 LLM 响应缓存的节点（逗号分隔），为空则关闭
+    raw = os.getenv("AGENT_LLM_CACHE_NODES", "")
+    return tuple(n.strip() for n in raw.split(",") if n.strip())
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache_path() -> str:
+    return os.getenv("AGENT_LLM_CACHE_PATH", os.path.join(".cache", "llm_responses.sqlite3"))
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache_ttl_seconds() -> float:
+    return float(os.getenv("AGENT_LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache_max_entries() -> int:
+    return int(os.getenv("AGENT_LLM_CACHE_MAX_ENTRIES", "10000"))
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache_max_bytes() -> int:
+    return int(float(os.getenv("AGENT_LLM_CACHE_MAX_MB", "256")) * 1024 * 1024)
+
+
+@lru_cache(maxsize=1)
+def get_file_fastpath_max_bytes() -> int:
+    # 文件规划快速路径：不超过该字节数的文本类文件无需 LLM 规划，直接提取
+    return int(os.getenv("AGENT_FILE_FASTPATH_MAX_BYTES", str(256 * 1024)))
+
+
+@lru_cache(maxsize=1)
+def get_extract_workers() -> int:
+    # 文件提取线程池大小（进程内所有轮次共享）
+    return int(os.getenv("AGENT_EXTRACT_WORKERS", "8"))
+
+
+@lru_cache(maxsize=1)
+def get_extract_file_timeout_seconds() -> float:
+    return float(os.getenv("AGENT_EXTRACT_FILE_TIMEOUT_SECONDS", "20"))
+
+
+@lru_cache(maxsize=1)
+def get_extract_turn_timeout_seconds() -> float:
+    return float(os.getenv("AGENT_EXTRACT_TURN_TIMEOUT_SECONDS", "45"))
+
+
+@lru_cache(maxsize=1)
+def get_extract_max_chars() -> int:
+    # 单个文件提取（建索引）的字符预算：达到后停止解析剩余页/表；进入 prompt 的部分由相关性选段决定
+    return int(os.getenv("AGENT_EXTRACT_MAX_CHARS", "200000"))
+
+
+@lru_cache(maxsize=1)
+def get_extract_cache_path() -> str:
+    return os.getenv("AGENT_EXTRACT_CACHE_PATH", os.path.join(".cache", "extractions.sqlite3"))
+
+
+@lru_cache(maxsize=1)
+def get_extract_cache_max_bytes() -> int:
+    # 提取缓存的容量上限（MB），0 表示关闭
+    return int(float(os.getenv("AGENT_EXTRACT_CACHE_MAX_MB", "512")) * 1024 * 1024)
+
+
+@lru_cache(maxsize=1)
+def get_file_context_tokens() -> int:
+    # 每个文件进入 prompt 的 token 预算（BM25 相关性选段）
+    return int(os.getenv("AGENT_FILE_CONTEXT_TOKENS", "2000"))
+
+
+@lru_cache(maxsize=1)
+def get_prompt_max_tokens() -> int:
+    # 需求分析 prompt 的输入 token 预算（含模板），超出时按优先级裁剪文件内容与当前文档
+    return int(os.getenv("AGENT_PROMPT_MAX_TOKENS", "24000"))
+
+
+@lru_cache(maxsize=1)
+def get_doc_patch_min_chars() -> int:
+    # 当前文档达到该长度（字符）且含 markdown 标题时，需求分析改用章节级增量更新（patch）；0 表示关闭
+    return int(os.getenv("AGENT_DOC_PATCH_MIN_CHARS", "2000"))
+
+
+@lru_cache(maxsize=1)
+def get_analysis_fanout() -> bool:
+    # true：文档更新与问题生成拆为两个并行分支（document_update_agent / question_generation_agent → analysis_join）
+    return os.getenv("AGENT_ANALYSIS_FANOUT", "false").lower() == "true"
+
+
+@lru_cache(maxsize=1)
+def is_speculation_enabled() -> bool:
+    # 推测执行：一轮结束后在空闲容量上预先执行“每题选第一个选项”的下一轮（默认关闭）
+    return os.getenv("AGENT_SPECULATION", "false").lower() == "true"
+
+
+@lru_cache(maxsize=1)
+def get_speculation_max_inflight() -> int:
+    return int(os.getenv("AGENT_SPECULATION_MAX_INFLIGHT", "2"))
+
+
+@lru_cache(maxsize=1)
+def get_speculation_tokens_per_hour() -> int:
+    # 推测轮次每小时的估算 token 上限（调度时预扣）
+    return int(os.getenv("AGENT_SPECULATION_TOKENS_PER_HOUR", "200000"))
+
+
+@lru_cache(maxsize=1)
+def get_speculation_ttl_seconds() -> float:
+    return float(os.getenv("AGENT_SPECULATION_TTL_SECONDS", "900"))
+
+
+@lru_cache(maxsize=1)
+def get_llm_json_mode() -> str:
+    # 需求分析/文件规划节点请求供应商的 JSON 模式（response_format=json_object）：
+    # auto 仅对已知支持的供应商开启；true 对所有供应商开启；false 关闭
+    return os.getenv("AGENT_LLM_JSON_MODE", "auto").lower()
+
+
+@lru_cache(maxsize=1)
+def is_llm_resilience_enabled() -> bool:
+    # LLM 调用的熔断/failover/对冲包装（app/services/resilience.py）
+    return os.getenv("AGENT_LLM_RESILIENCE", "true").lower() == "true"
+
+
+@lru_cache(maxsize=1)
+def get_llm_hedge_model() -> Optional[Dict[str, Any]]:
+    # 对冲/failover 使用的备用模型，JSON 格式的 model_params，如 {"provider": "deepseek", "model": "deepseek-chat", "api_key": "..."}
+    raw = os.getenv("AGENT_LLM_HEDGE_MODEL")
+    if not raw:
+        return None
+    try:
+        mp = json.loads(raw)
+    except ValueError:
+        _warn("invalid_json", var="AGENT_LLM_HEDGE_MODEL", effect="hedging disabled")
+        return None
+    return mp if isinstance(mp, dict) else None
+
+
+@lru_cache(maxsize=1)
+def get_llm_hedge_delay_seconds() -> float:
+    # 节点延迟样本不足以估计 p95 时，主模型等待多久后发出对冲请求
+    return float(os.getenv("AGENT_LLM_HEDGE_DELAY_SECONDS", "10"))
+
+
+@lru_cache(maxsize=1)
+def get_llm_timeout_seconds() -> float:
+    # 单次 LLM 调用的超时（异步路径），超时计为熔断器失败
+    return float(os.getenv("AGENT_LLM_TIMEOUT_SECONDS", "120"))
+
+
+@lru_cache(maxsize=1)
+def get_llm_breaker_failures() -> int:
+    # 60 秒窗口内失败达到该次数（且失败率 ≥ 50%）时熔断该供应商
+    return int(os.getenv("AGENT_LLM_BREAKER_FAILURES", "5"))
+
+
+@lru_cache(maxsize=1)
+def get_llm_breaker_cooldown_seconds() -> float:
+    return float(os.getenv("AGENT_LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+
+@lru_cache(maxsize=1)
+def get_llm_limits() -> Dict[str, Dict[str, Any]]:
+    # 按供应商别名（或 "别名/模型"、"default"）配置的并发上限与 rpm/tpm，见 app/services/rate_limit.py
+    raw = os.getenv("AGENT_LLM_LIMITS")
+    if not raw:
+        return {}
+    try:
+        limits = json.loads(raw)
+    except ValueError:
+        _warn("invalid_json", var="AGENT_LLM_LIMITS", effect="using defaults")
+        return {}
+    return {str(k).strip().lower(): v for k, v in limits.items() if isinstance(v, dict)} if isinstance(limits, dict) else {}
+
+
+@lru_cache(maxsize=1)
+def get_llm_queue_timeout_seconds() -> float:
+    # LLM 调用在供应商限流队列中的最长等待时间
+    return float(os.getenv("AGENT_LLM_QUEUE_TIMEOUT_SECONDS", "30"))
+
+
+@lru_cache(maxsize=1)
+def get_log_level() -> str:
+    # "agent" 日志树的级别；节点切换/路由等逐步调试信息为 DEBUG
+    level = os.getenv("AGENT_LOG_LEVEL", "INFO").strip().upper()
+    return level if level in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL") else "INFO"
+
+
+@lru_cache(maxsize=1)
+def get_log_format() -> str:
+    # text | json
+    return "json" if os.getenv("AGENT_LOG_FORMAT", "text").strip().lower() == "json" else "text"
+
+
+@lru_cache(maxsize=1)
+def get_log_debug_sample_rate() -> float:
+    # DEBUG 日志的保留比例（0–1）
+    return min(1.0, max(0.0, float(os.getenv("AGENT_LOG_DEBUG_SAMPLE_RATE", "1"))))
+
+
+@lru_cache(maxsize=1)
+def get_log_async() -> bool:
+    # false 时日志在调用方线程同步写出（不经队列）
+    return os.getenv("AGENT_LOG_ASYNC", "true").lower() == "true"
+
+
+@lru_cache(maxsize=1)
+def get_log_queue_size() -> int:
+    # 日志队列上限，写出跟不上时丢弃新记录而不是阻塞请求
+    return int(os.getenv("AGENT_LOG_QUEUE_SIZE", "10000"))
@@ -0,0 +1,268 @@
+"""
+结构化、非阻塞的日志
+
+节点切换、路由判断等热路径原先直接 sys.stdout.write + flush / print：每次都是请求路径上的同步系统调用，
+并发轮次（以及线程池中的同步节点）在 stdout 上互相争用。这里改为：
+
+- 调用方只把一条记录（元组）放入队列（SimpleQueue.put，不阻塞；积压超过 AGENT_LOG_QUEUE_SIZE 时丢弃并计数），
+  后台写线程负责格式化，并把队列中已有的记录合并为一次 write + flush；
+- 级别：AGENT_LOG_LEVEL（默认 INFO）；节点切换/路由等调试信息为 DEBUG，未启用时在构造参数后立即返回；
+- 采样：AGENT_LOG_DEBUG_SAMPLE_RATE（0–1，默认 1）只作用于 DEBUG，高负载下开启调试日志时按比例保留；
+- 上下文：log_context(thread_id=..., run_id=...) 绑定到 contextvars，在调用方线程/任务中取出写入记录
+  （图节点运行在 astream 派生的任务或线程池中，均继承该上下文）；
+- 格式：AGENT_LOG_FORMAT=text（默认，"[组件] 事件 k=v ..."）或 json（每行一个 JSON 对象）；
+- AGENT_LOG_ASYNC=false 时退回在调用方线程同步写出（排查问题或对比开销用，见 benchmarks/logging_overhead.py）。
+
+不经过标准库 logging：LogRecord 的构造与 Handler 锁在调用方线程上每条约 20µs，正是这里要省掉的开销。
+
+用法：
+    log = get_logger("graph")
+    log.debug("after_node", node=tag, status=status)
+    log.warning("llm_error", node=node, error=str(e))
+"""
+from __future__ import annotations
+
+import atexit
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+
+import orjson
+
+from app.utils.env import (
+    get_log_async,
+    get_log_debug_sample_rate,
+    get_log_format,
+    get_log_level,
+    get_log_queue_size,
+)
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+_LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR, "CRITICAL": 50}
+_NAMES = {v: k for k, v in _LEVELS.items()}
+
+_thread_id: ContextVar[Optional[str]] = ContextVar("log_thread_id", default=None)
+_run_id: ContextVar[Optional[str]] = ContextVar("log_run_id", default=None)
+
+# (时间戳, 级别, 组件, 事件, 字段, thread_id, run_id, 异常堆栈)
+_Entry = Tuple[float, int, str, str, Dict[str, Any], Optional[str], Optional[str], Optional[str]]
+
+_counts = {"emitted": 0, "sampled_out": 0, "dropped": 0}
+_counts_lock = threading.Lock()
+
+
+def _count(name: str) -> None:
+    with _counts_lock:
+        _counts[name] += 1
+
+
+@contextmanager
+def log_context(thread_id: Optional[str] = None, run_id: Optional[str] = None) -> Iterator[None]:
+    """在当前任务/线程内为日志绑定 thread_id / run_id。"""
+    tokens = (_thread_id.set(thread_id), _run_id.set(run_id))
+    try:
+        yield
+    finally:
+        _run_id.reset(tokens[1])
+        _thread_id.reset(tokens[0])
+
+
+def _format_text(entry: _Entry) -> str:
+    ts, level, name, event, fields, thread_id, run_id, exc = entry
+    parts = [f"[{name}]"]
+    if level >= WARNING:
+        parts.append(_NAMES.get(level, str(level)))
+    parts.append(event)
+    if thread_id:
+        parts.append(f"thread_id={thread_id}")
+    if run_id:
+        parts.append(f"run_id={run_id}")
+    parts.extend(f"{k}={v}" for k, v in fields.items())
+    line = " ".join(parts)
+    return f"{line}\n{exc}" if exc else line
+
+
+def _format_json(entry: _Entry) -> str:
+    ts, level, name, event, fields, thread_id, run_id, exc = entry
+    out: Dict[str, Any] = {"ts": round(ts, 6), "level": _NAMES.get(level, str(level)).lower(), "logger": name, "event": event}
+    if thread_id:
+        out["thread_id"] = thread_id
+    if run_id:
+        out["run_id"] = run_id
+    out.update(fields)
+    if exc:
+        out["exc"] = exc
+    return orjson.dumps(out, default=str).decode()
+
+
+class _Sink:
+    """同步写出：在调用方线程格式化并 write + flush（AGENT_LOG_ASYNC=false）。"""
+
+    def __init__(self, stream: TextIO, fmt: Callable[[_Entry], str]) -> None:
+        self._stream = stream
+        self._fmt = fmt
+        self._lock = threading.Lock()
+
+    def emit(self, entry: _Entry) -> None:
+        line = self._fmt(entry) + "\n"
+        with self._lock:
+            self._stream.write(line)
+            self._stream.flush()
+
+    def queued(self) -> int:
+        return 0
+
+    def close(self) -> None:
+        pass
+
+
+class _QueueSink:
+    """队列写出：调用方只 put，后台线程格式化并按批 write + flush。"""
+
+    _STOP = object()
+    _BATCH = 512
+
+    def __init__(self, stream: TextIO, fmt: Callable[[_Entry], str], max_queued: int) -> None:
+        self._stream = stream
+        self._fmt = fmt
+        self._max = max_queued
+        self._queue: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="agent-log-writer", daemon=True)
+        self._thread.start()
+
+    def emit(self, entry: _Entry) -> None:
+        # qsize 是近似值，够用来限制积压
+        if self._max and self._queue.qsize() >= self._max:
+            _count("dropped")
+            return
+        self._queue.put(entry)
+
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            batch: List[str] = []
+            stop = False
+            while True:
+                if item is self._STOP:
+                    stop = True
+                    break
+                try:
+                    batch.append(self._fmt(item))
+                except Exception as e:  # 个别字段无法格式化时不影响后续记录
+                    batch.append(f"[log] format error: {e}")
+                if len(batch) >= self._BATCH:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._stream.write("\n".join(batch) + "\n")
+                    self._stream.flush()
+                except Exception:
+                    pass
+            if stop:
+                return
+
+    def close(self) -> None:
+        # 先写出停止前已入队的记录
+        self._queue.put(self._STOP)
+        self._thread.join(timeout=5)
+
+
+_setup_lock = threading.Lock()
+_sink: Any = None
+_level = INFO
+_configured = False
+
+
+def configure_logging(stream: Optional[TextIO] = None, async_: Optional[bool] = None) -> None:
+    """按环境变量（重新）配置日志；首次 get_logger 时自动调用。stream/async_ 供压测覆盖。"""
+    global _sink, _level, _configured
+    with _setup_lock:
+        old, _sink = _sink, None
+        if old is not None:
+            old.close()
+        fmt = _format_json if get_log_format() == "json" else _format_text
+        stream = stream or sys.stdout
+        if get_log_async() if async_ is None else async_:
+            _sink = _QueueSink(stream, fmt, get_log_queue_size())
+        else:
+            _sink = _Sink(stream, fmt)
+        _level = _LEVELS[get_log_level()]
+        _configured = True
+
+
+def shutdown_logging() -> None:
+    global _sink
+    with _setup_lock:
+        old, _sink = _sink, None
+        if old is not None:
+            old.close()
+
+
+atexit.register(shutdown_logging)
+
+
+class StructuredLogger:
+    __slots__ = ("name",)
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def _log(self, level: int, event: str, fields: Dict[str, Any], exc_info: bool = False) -> None:
+        if level < _level:
+            return
+        sink = _sink
+        if sink is None:
+            return
+        if level <= DEBUG:
+            rate = get_log_debug_sample_rate()
+            if rate < 1.0 and random.random() >= rate:
+                _count("sampled_out")
+                return
+        _count("emitted")
+        exc = traceback.format_exc().rstrip() if exc_info else None
+        sink.emit((time.time(), level, self.name, event, fields, _thread_id.get(), _run_id.get(), exc))
+
+    def debug(self, event: str, **fields: Any) -> None:
+        self._log(DEBUG, event, fields)
+
+    def info(self, event: str, **fields: Any) -> None:
+        self._log(INFO, event, fields)
+
+    def warning(self, event: str, **fields: Any) -> None:
+        self._log(WARNING, event, fields)
+
+    def error(self, event: str, **fields: Any) -> None:
+        self._log(ERROR, event, fields)
+
+    def exception(self, event: str, **fields: Any) -> None:
+        """ERROR 级别并附带当前异常的堆栈（在 except 块内调用）。"""
+        self._log(ERROR, event, fields, exc_info=True)
+
+
+def get_logger(name: str) -> StructuredLogger:
+    if not _configured:
+        configure_logging()
+    return StructuredLogger(name)
+
+
+def log_stats() -> Dict[str, Any]:
+    with _counts_lock:
+        out: Dict[str, Any] = dict(_counts)
+    sink = _sink
+    out["queued"] = sink.queued() if sink is not None else 0
+    out["level"] = _NAMES.get(_level, str(_level))
+    out["async"] = isinstance(sink, _QueueSink)
+    return out
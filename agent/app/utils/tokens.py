@@ -0,0 +1,16 @@
+from __future__ import annotations
+
+import re
+
+_CJK_RE = re.compile(r"[　-〿一-鿿＀-￯]")
+
+
+def approx_tokens(text: str) -> int:
+    """不依赖分词器的 token 估算：CJK 字符（含全角标点）约 1 token/字，其余约 4 字符/token。
+
+    用于预算与统计（prompt 裁剪、相关性选段、缓存节省量），不要求与供应商计费完全一致。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
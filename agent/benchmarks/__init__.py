@@ -0,0 +1 @@
+# Offline benchmarks for the agent graph (run with: python -m benchmarks.<name> from agent/).
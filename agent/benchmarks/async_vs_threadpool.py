@@ -0,0 +1,79 @@
+"""
+对比 /v1/submit 的两种执行路径在 LLM 等待型负载下的吞吐：
+
+- threadpool：同步 def 路由的行为——每轮通过 anyio.to_thread 在 Starlette 默认线程池（40）中执行 graph.stream；
+- async：当前实现——在事件循环内执行 graph.astream，节点使用 ainvoke。
+
+用法（在 agent/ 目录下）：
+    python -m benchmarks.async_vs_threadpool --turns 400 --latency 0.5
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+import uuid
+
+import anyio.to_thread
+from langgraph.checkpoint.memory import MemorySaver
+
+from benchmarks.fake_llm import install_fake_llm
+
+
+def _turn_input() -> tuple[dict, dict]:
+    thread_id = uuid.uuid4().hex
+    state = {
+        "thread_id": thread_id,
+        "state_version": 0,
+        "current_status": "clarifying",
+        "messages": [{"message_id": "auto", "message_role": "user", "message_content": "我想开发一个在线教育平台", "timestamp": "2024-09-01T10:00:00"}],
+        "multi_files": [],
+        "model_params": {"api_key": "bench"},
+    }
+    return state, {"configurable": {"thread_id": thread_id}, "recursion_limit": 8}
+
+
+def _run_sync(graph) -> None:
+    state, config = _turn_input()
+    for _ in graph.stream(state, config=config, stream_mode="values"):
+        pass
+    graph.get_state(config)
+
+
+async def _run_async(graph) -> None:
+    state, config = _turn_input()
+    async for _ in graph.astream(state, config=config, stream_mode="values"):
+        pass
+    await graph.aget_state(config)
+
+
+async def _bench(mode: str, graph, turns: int) -> float:
+    t0 = time.perf_counter()
+    if mode == "threadpool":
+        await asyncio.gather(*(anyio.to_thread.run_sync(_run_sync, graph) for _ in range(turns)))
+    else:
+        await asyncio.gather(*(_run_async(graph) for _ in range(turns)))
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=400, help="concurrent turns offered at once")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake LLM latency per call (seconds)")
+    args = parser.parse_args()
+
+    install_fake_llm(args.latency)
+    from app.graph.graph import build_graph
+
+    for mode in ("threadpool", "async"):
+        graph = build_graph().compile(checkpointer=MemorySaver())
+        # 节点内的调试输出会淹没结果，这里静默掉
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed = asyncio.run(_bench(mode, graph, args.turns))
+        print(f"{mode:>10}: {args.turns} turns in {elapsed:.2f}s → {args.turns / elapsed:.1f} turns/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+按供应商限流（bulkhead + 令牌桶）的离线压测（本地假供应商，不访问网络）
+
+假供应商只允许 --provider-inflight 个并发调用，超出的立即以 429 失败；以 --concurrency 的并发发出 --calls 次调用：
+
+- direct：直接调用供应商，突发流量中超出配额的调用失败（对应线上的 429 → 兜底结果 → 用户重试）；
+- limited：经 ResilientChatModel 调用，ProviderLimiter 按 AGENT_LLM_LIMITS（max_inflight = 供应商配额）排队，
+  调用不再失败，代价是排队等待。
+
+用法（在 agent/ 目录下）：
+    python -m benchmarks.bulkhead --calls 200 --concurrency 50 --provider-inflight 10 --latency 0.05
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import time
+
+from langchain_core.messages import HumanMessage
+
+from benchmarks.fake_llm import FakeChatModel
+
+
+async def _bench(model, calls: int, concurrency: int) -> tuple:
+    sem = asyncio.Semaphore(concurrency)
+    messages = [HumanMessage(content="bench")]
+    errors = 0
+
+    async def one() -> float:
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                await model.ainvoke(messages)
+            except Exception:
+                errors += 1
+            return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    lat = list(await asyncio.gather(*(one() for _ in range(calls))))
+    return lat, errors, time.perf_counter() - t0
+
+
+def _pct(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50, help="offered load: calls in flight at once")
+    parser.add_argument("--provider-inflight", type=int, default=10, help="fake provider concurrency quota")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake provider latency (seconds)")
+    args = parser.parse_args()
+
+    os.environ["AGENT_LLM_LIMITS"] = json.dumps({"fake": {"max_inflight": args.provider_inflight}})
+    from app.services.rate_limit import rate_limit_stats
+    from app.services.resilience import ResilientChatModel
+
+    for mode in ("direct", "limited"):
+        provider = FakeChatModel(latency=args.latency, provider_max_inflight=args.provider_inflight)
+        model = provider if mode == "direct" else ResilientChatModel(provider, "fake||bench")
+        with contextlib.redirect_stdout(io.StringIO()):
+            lat, errors, wall = asyncio.run(_bench(model, args.calls, args.concurrency))
+        print(
+            f"{mode:>8}: {args.calls} calls in {wall:.2f}s  throttled (429) {provider.throttled}  failed {errors}  "
+            f"p50 {_pct(lat, 0.5):.3f}s  p95 {_pct(lat, 0.95):.3f}s"
+        )
+    stats = rate_limit_stats()["fake||bench"]
+    print(f"limiter: avg wait {stats['avg_wait_seconds']}s  max wait {stats['max_wait_seconds']}s  timeouts {stats['timeouts']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+本地假 LLM（离线压测用）
+
+- FakeChatModel：可配置延迟的 Chat 模型，同步路径 time.sleep、异步路径 asyncio.sleep，
+  模拟“几乎全部时间都在等网络”的 LLM 调用；
+- tokens_per_second > 0 时按该速率流式输出（约 4 字符一个 token），用于压测 SSE 与首字节时间；
+- 根据 prompt 内容返回 file_toolscall_agent 的 commands JSON 或 requirements_analysis_agent 的完整 JSON（增量模式下返回 patch，
+  并行模式的文档/问题分支只返回各自的部分；doc_chars 控制文档正文长度）；
+- slow_ratio / error_ratio 注入尾延迟（该比例的调用首 token 延迟放大 slow_factor 倍）与故障，用于压测对冲与熔断；
+- provider_max_inflight > 0 时模拟供应商的并发配额：超出的非流式调用立即以 429 失败（throttled 计数），用于压测限流；
+- install_fake_llm()：把两个节点模块里的 get_chat_model 替换为返回 FakeChatModel。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+def _requirements_output(patch: bool = False, doc_chars: int = 0, parts: str = "all") -> str:
+    def q(i: int) -> dict:
+        return {
+            "question_id": f"q{i}",
+            "content": f"问题{i}",
+            "suggestion_options": [
+                {"option_id": o, "content": f"建议选项{o}", "selected": False} for o in ("A", "B", "C")
+            ],
+        }
+
+    body = "压测内容" + "需求细节" * max(0, (doc_chars - 4) // 4)
+    doc = {"version": "1", "content": "# 需求文档\n\n" + body, "last_updated": "2024-09-01"}
+    if patch:
+        doc = {"version": "1", "last_updated": "2024-09-01", "patch": [{"op": "append", "path": [], "content": "压测内容"}]}
+    out: dict = {}
+    if parts in ("all", "document"):
+        out["requirements_document"] = doc
+    if parts in ("all", "questions"):
+        out["question_list"] = [q(1), q(2), q(3)]
+    if parts in ("all", "document"):
+        out["current_status"] = "clarifying"
+    return json.dumps(out, ensure_ascii=False)
+
+
+class FakeChatModel(BaseChatModel):
+    latency: float = 0.5
+    tokens_per_second: float = 0.0
+    # 整篇输出时文档正文的长度（字符），用于模拟成熟会话的长文档
+    doc_chars: int = 0
+    slow_ratio: float = 0.0
+    slow_factor: float = 10.0
+    error_ratio: float = 0.0
+    provider_max_inflight: int = 0
+    inflight: int = 0
+    throttled: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-bench"
+
+    def _content(self, messages: List[BaseMessage]) -> str:
+        text = "\n".join(str(m.content) for m in messages)
+        if "file tool planning agent" in text:
+            return json.dumps({"commands": []})
+        # 并行模式的两个分支只输出各自负责的部分
+        parts = "document" if "只负责更新需求文档" in text else "questions" if "只负责生成澄清问题" in text else "all"
+        return _requirements_output(patch="patch(数组)" in text, doc_chars=self.doc_chars, parts=parts)
+
+    def _first_token_delay(self) -> float:
+        if self.error_ratio > 0 and random.random() < self.error_ratio:
+            raise RuntimeError("fake provider error")
+        if self.slow_ratio > 0 and random.random() < self.slow_ratio:
+            return self.latency * self.slow_factor
+        return self.latency
+
+    def _enter(self) -> None:
+        if self.provider_max_inflight and self.inflight >= self.provider_max_inflight:
+            self.throttled += 1
+            raise RuntimeError("429 Too Many Requests (fake provider)")
+        self.inflight += 1
+
+    def _respond(self, messages: List[BaseMessage]) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._content(messages)))])
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        content = self._content(messages)
+        return [content[i:i + 4] for i in range(0, len(content), 4)]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        self._enter()
+        try:
+            time.sleep(self._first_token_delay())
+            if self.tokens_per_second > 0:
+                time.sleep(len(self._tokens(messages)) / self.tokens_per_second)
+            return self._respond(messages)
+        finally:
+            self.inflight -= 1
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        self._enter()
+        try:
+            await asyncio.sleep(self._first_token_delay())
+            if self.tokens_per_second > 0:
+                await asyncio.sleep(len(self._tokens(messages)) / self.tokens_per_second)
+            return self._respond(messages)
+        finally:
+            self.inflight -= 1
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._first_token_delay())
+        for tok in self._tokens(messages):
+            if self.tokens_per_second > 0:
+                time.sleep(1.0 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=tok))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._first_token_delay())
+        for tok in self._tokens(messages):
+            if self.tokens_per_second > 0:
+                await asyncio.sleep(1.0 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=tok))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(tok, chunk=chunk)
+            yield chunk
+
+
+def install_fake_llm(latency: float, tokens_per_second: float = 0.0, doc_chars: int = 0) -> FakeChatModel:
+    from app.graph import file_toolscall_agent, requirements_analysis_agent
+
+    model = FakeChatModel(latency=latency, tokens_per_second=tokens_per_second, doc_chars=doc_chars)
+    file_toolscall_agent.get_chat_model = lambda mp=None, json_mode=False: model  # type: ignore[assignment]
+    requirements_analysis_agent.get_chat_model = lambda mp=None, json_mode=False: model  # type: ignore[assignment]
+    return model
@@ -0,0 +1,79 @@
+"""
+对比需求分析的两种图结构在单轮墙钟延迟上的差异：
+
+- single：requirements_analysis_agent 一次 LLM 调用同时输出文档与 3 个问题；
+- fanout：document_update_agent 与 question_generation_agent 并行执行，analysis_join 合并（AGENT_ANALYSIS_FANOUT=true）。
+
+假 LLM 的耗时 = 首 token 延迟（--latency）+ 输出 token 数 / --tps，因此输出越长越慢，与真实模型的解码开销一致；
+--doc-chars 模拟成熟会话中较长的文档。
+
+用法（在 agent/ 目录下）：
+    python -m benchmarks.fanout_vs_single --turns 10 --latency 0.3 --tps 400 --doc-chars 2000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import statistics
+import time
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from benchmarks.async_vs_threadpool import _turn_input
+from benchmarks.fake_llm import install_fake_llm
+
+
+async def _turn(graph) -> float:
+    state, config = _turn_input()
+    t0 = time.perf_counter()
+    async for _ in graph.astream(state, config=config, stream_mode="values"):
+        pass
+    return time.perf_counter() - t0
+
+
+async def _bench(graph, turns: int, concurrency: int) -> list:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one() -> float:
+        async with sem:
+            return await _turn(graph)
+
+    return list(await asyncio.gather(*(one() for _ in range(turns))))
+
+
+def _pct(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=10, help="turns per variant")
+    parser.add_argument("--concurrency", type=int, default=1, help="turns in flight at once")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake LLM time to first token (seconds)")
+    parser.add_argument("--tps", type=float, default=400.0, help="fake LLM output tokens per second")
+    parser.add_argument("--doc-chars", type=int, default=2000, help="length of the generated document body")
+    args = parser.parse_args()
+
+    install_fake_llm(args.latency, args.tps, args.doc_chars)
+    from app.graph.graph import build_graph
+
+    results = {}
+    for mode in ("single", "fanout"):
+        graph = build_graph(fanout=(mode == "fanout")).compile(checkpointer=MemorySaver())
+        # 节点内的调试输出会淹没结果，这里静默掉
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[mode] = asyncio.run(_bench(graph, args.turns, args.concurrency))
+        lat = results[mode]
+        print(
+            f"{mode:>7}: {args.turns} turns  mean {statistics.mean(lat):.3f}s  "
+            f"p50 {_pct(lat, 0.5):.3f}s  p95 {_pct(lat, 0.95):.3f}s"
+        )
+    speedup = statistics.mean(results["single"]) / statistics.mean(results["fanout"])
+    print(f"fanout speedup (mean turn latency): {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+对冲请求与熔断器的离线压测（本地假供应商，不访问网络）
+
+- primary：--latency 的首 token 延迟，其中 --slow-ratio 比例的调用放大 --slow-factor 倍（长尾）；
+- secondary：同样延迟、没有长尾的备用供应商；
+- direct：直接调用 primary；hedged：经 ResilientChatModel 调用（p95 后对冲到 secondary）；
+- failing：primary 全部出错，观察熔断器断开后请求直接转到 secondary、不再等待失败的调用。
+
+用法（在 agent/ 目录下）：
+    python -m benchmarks.hedging --calls 400 --concurrency 20 --latency 0.05 --slow-ratio 0.02
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import time
+
+from langchain_core.messages import HumanMessage
+
+from benchmarks.fake_llm import FakeChatModel
+
+
+async def _bench(model, calls: int, concurrency: int) -> list:
+    sem = asyncio.Semaphore(concurrency)
+    messages = [HumanMessage(content="bench")]
+
+    async def one() -> float:
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                await model.ainvoke(messages)
+            except Exception:
+                pass
+            return time.perf_counter() - t0
+
+    return list(await asyncio.gather(*(one() for _ in range(calls))))
+
+
+def _pct(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+
+def _report(name: str, lat: list) -> None:
+    print(
+        f"{name:>8}: {len(lat)} calls  mean {statistics.mean(lat):.3f}s  p50 {_pct(lat, 0.5):.3f}s  "
+        f"p95 {_pct(lat, 0.95):.3f}s  p99 {_pct(lat, 0.99):.3f}s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400, help="calls per variant")
+    parser.add_argument("--concurrency", type=int, default=20, help="calls in flight at once")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake provider time to first token (seconds)")
+    parser.add_argument("--slow-ratio", type=float, default=0.02, help="share of primary calls hit by the long tail")
+    parser.add_argument("--slow-factor", type=float, default=10.0, help="latency multiplier for tail calls")
+    args = parser.parse_args()
+
+    # 样本不足以估计 p95 之前的对冲等待时间
+    os.environ.setdefault("AGENT_LLM_HEDGE_DELAY_SECONDS", str(args.latency * 3))
+    from app.services.resilience import ResilientChatModel, resilience_stats
+
+    primary = FakeChatModel(latency=args.latency, slow_ratio=args.slow_ratio, slow_factor=args.slow_factor)
+    secondary = FakeChatModel(latency=args.latency)
+    hedged = ResilientChatModel(primary, "fake|primary", secondary, "fake|secondary", json_mode=True)
+    failing = ResilientChatModel(
+        FakeChatModel(latency=args.latency, error_ratio=1.0), "fake|failing", secondary, "fake|secondary", json_mode=True
+    )
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        direct_lat = asyncio.run(_bench(primary, args.calls, args.concurrency))
+        hedged_lat = asyncio.run(_bench(hedged, args.calls, args.concurrency))
+    _report("direct", direct_lat)
+    _report("hedged", hedged_lat)
+    stats = resilience_stats()
+    print(
+        f"hedges {stats['hedges']} ({stats['hedges'] / args.calls:.1%} extra requests), "
+        f"hedge wins {stats['hedge_wins']}, p95 used {stats['p95_seconds'].get('fake|primary')}"
+    )
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        failing_lat = asyncio.run(_bench(failing, args.calls, args.concurrency))
+    _report("failing", failing_lat)
+    stats = resilience_stats()
+    print(
+        f"failovers {stats['failovers']}, short circuits {stats['short_circuits']}, "
+        f"breaker {stats['breakers']['fake|failing']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
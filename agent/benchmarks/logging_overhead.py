@@ -0,0 +1,130 @@
+"""
+每轮日志开销的离线压测（假 LLM 零延迟，只剩图本身与日志的开销）
+
+在线程池中并发执行同步轮次（graph.stream，对应线程池中的同步节点争用 stdout 的情形），日志写入 --sink 文件；
+--flush-latency 模拟较慢的 stdout（终端、容器日志驱动等管道背压）：每次 flush 额外阻塞该时长。
+
+- sync-debug：改造前的行为——每条节点切换/路由日志在调用方线程同步 write + flush；
+- queued-debug：同样的 DEBUG 日志经有界队列由后台线程写出；
+- queued-sampled：DEBUG 日志按 --sample-rate 采样；
+- info：默认级别（INFO），热路径上的 DEBUG 日志在构造参数后直接返回，作为基线。
+
+每轮开销 = 该模式的平均轮次耗时 − info 的平均轮次耗时。
+
+用法（在 agent/ 目录下）：
+    python -m benchmarks.logging_overhead --turns 2000 --workers 16
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from benchmarks.fake_llm import install_fake_llm
+
+_MODES = (
+    # (名称, 级别, 是否经队列, DEBUG 采样率)
+    ("info", "INFO", True, 1.0),
+    ("sync-debug", "DEBUG", False, 1.0),
+    ("queued-debug", "DEBUG", True, 1.0),
+    ("queued-sampled", "DEBUG", True, None),
+)
+
+
+class _SlowFile:
+    def __init__(self, f, flush_latency: float) -> None:
+        self._f = f
+        self._latency = flush_latency
+
+    def write(self, s: str) -> int:
+        return self._f.write(s)
+
+    def flush(self) -> None:
+        self._f.flush()
+        if self._latency:
+            time.sleep(self._latency)
+
+
+def _turn(graph) -> float:
+    thread_id = uuid.uuid4().hex
+    state = {
+        "thread_id": thread_id,
+        "state_version": 0,
+        "current_status": "clarifying",
+        "messages": [{"message_id": "auto", "message_role": "user", "message_content": "我想开发一个在线教育平台", "timestamp": "2024-09-01T10:00:00"}],
+        "multi_files": [],
+        "model_params": {"api_key": "bench"},
+    }
+    config = {"configurable": {"thread_id": thread_id}, "recursion_limit": 8}
+    t0 = time.perf_counter()
+    for _ in graph.stream(state, config=config, stream_mode="values"):
+        pass
+    return time.perf_counter() - t0
+
+
+def _bench(graph, turns: int, workers: int) -> tuple:
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        lat = list(pool.map(lambda _: _turn(graph), range(turns)))
+    return lat, time.perf_counter() - t0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5, help="modes are interleaved over this many rounds")
+    parser.add_argument("--workers", type=int, default=16, help="threadpool workers running turns concurrently")
+    parser.add_argument("--sample-rate", type=float, default=0.1, help="DEBUG sample rate for queued-sampled")
+    parser.add_argument("--sink", default=None, help="log output file (default: a temporary file)")
+    parser.add_argument("--flush-latency", type=float, default=0.0, help="extra blocking time per flush (seconds)")
+    args = parser.parse_args()
+
+    install_fake_llm(0.0)
+    from app.graph.graph import build_graph
+    from app.utils import env, log
+
+    sink_path = args.sink or os.path.join(tempfile.mkdtemp(), "agent.log")
+    # 预热（导入、编译缓存等）
+    with open(os.devnull, "w") as devnull:
+        log.configure_logging(stream=devnull, async_=False)
+        _bench(build_graph(fanout=False).compile(checkpointer=MemorySaver()), 100, args.workers)
+
+    # 各模式交替执行多轮，每轮使用新的 checkpointer，避免状态累积与机器波动偏向某个模式
+    lat: dict = {name: [] for name, *_ in _MODES}
+    wall: dict = {name: 0.0 for name, *_ in _MODES}
+    emitted: dict = {name: 0 for name, *_ in _MODES}
+    per_round = max(1, args.turns // args.rounds)
+    for _ in range(args.rounds):
+        for name, level, queued, rate in _MODES:
+            os.environ["AGENT_LOG_LEVEL"] = level
+            os.environ["AGENT_LOG_DEBUG_SAMPLE_RATE"] = str(args.sample_rate if rate is None else rate)
+            env.get_log_level.cache_clear()
+            env.get_log_debug_sample_rate.cache_clear()
+            graph = build_graph(fanout=False).compile(checkpointer=MemorySaver())
+            with open(sink_path, "w") as sink:
+                log.configure_logging(stream=_SlowFile(sink, args.flush_latency), async_=queued)
+                before = log.log_stats()["emitted"]
+                round_lat, round_wall = _bench(graph, per_round, args.workers)
+                log.shutdown_logging()
+                emitted[name] += log.log_stats()["emitted"] - before
+            lat[name].extend(round_lat)
+            wall[name] += round_wall
+
+    base = statistics.mean(lat["info"])
+    for name, *_ in _MODES:
+        values = sorted(lat[name])
+        mean = statistics.mean(values)
+        print(
+            f"{name:>14}: {len(values) / wall[name]:7.1f} turns/s  mean {mean * 1000:.3f}ms  "
+            f"p95 {values[int(0.95 * (len(values) - 1))] * 1000:.3f}ms  "
+            f"records/turn {emitted[name] / len(values):.1f}  overhead/turn {(mean - base) * 1000:+.3f}ms"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+图与 /v1/submit 的离线吞吐/延迟压测套件（本地假 LLM，不需要 DashScope key）
+
+按 checkpointer 后端 × 执行路径 × 并发数 × 会话线程数 组合扫描：
+
+- 后端：memory（MemorySaver）/ redis（AsyncRedisSaver，--redis-url）/ postgres（AsyncPostgresSaver，--postgres-url），
+  由 app.graph.graph.aget_checkpointer 按同样的规则创建；依赖未安装或连接失败时该后端记为 skipped；
+- 路径：graph（编译后的图直接 astream）/ http（经 ASGI 调用 /v1/submit，含 TurnScheduler、快照仓库与响应构造）；
+- 并发数：同时在途的轮次数；会话线程数：轮次分布在多少个 thread_id 上（同一线程的轮次依次执行，如同一个用户
+  连续对话，历史随轮次增长；线程数小于并发数时实际并发受线程数限制）。
+
+每个组合报告吞吐（turns/s）、轮次延迟 p50/p95/p99、各节点平均耗时与 checkpointer 读写平均耗时
+（后两者取自 app.services.metrics 的直方图），结果写入 JSON（含 git commit），--compare 与之前的结果对比。
+
+用法（在 agent/ 目录下）：
+    python -m benchmarks.suite --turns 200 --concurrency 1,8,32 --threads 8,64 --latency 0.05 --tps 2000
+    python -m benchmarks.suite --backends memory,redis --redis-url redis://localhost:6379/0
+    python -m benchmarks.suite --compare benchmarks/results/<旧 commit>.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.async_vs_threadpool import _turn_input
+from benchmarks.fake_llm import install_fake_llm
+
+_BACKEND_ENV = ("AGENT_DATABASE_URL", "DATABASE_URL", "POSTGRES_HOST", "REDIS_URL", "AGENT_REDIS_URL")
+_EXPECTED_SAVER = {"memory": "MemorySaver", "redis": "AsyncRedisSaver", "postgres": "AsyncPostgresSaver"}
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _pct(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, timeout=10
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def _open_checkpointer(backend: str, args: argparse.Namespace) -> Tuple[Any, Optional[str]]:
+    """redis/postgres：设置环境变量后交给 aget_checkpointer 创建；回退成了 MemorySaver 时返回跳过原因。"""
+    from app.graph.graph import aget_checkpointer
+    from app.utils import env
+
+    url = args.redis_url if backend == "redis" else args.postgres_url
+    if not url:
+        return None, f"no --{backend}-url"
+    for name in _BACKEND_ENV:
+        os.environ.pop(name, None)
+    os.environ["REDIS_URL" if backend == "redis" else "AGENT_DATABASE_URL"] = url
+    env.get_redis_url.cache_clear()
+    env.get_postgres_url.cache_clear()
+    checkpointer = await aget_checkpointer()
+    if type(checkpointer).__name__ != _EXPECTED_SAVER[backend]:
+        return None, f"{_EXPECTED_SAVER[backend]} unavailable (got {type(checkpointer).__name__})"
+    return checkpointer, None
+
+
+class _GraphRunner:
+    def __init__(self, graph: Any) -> None:
+        self._graph = graph
+
+    async def turn(self, thread_id: str) -> None:
+        state, config = _turn_input()
+        state["thread_id"] = thread_id
+        config["configurable"]["thread_id"] = thread_id
+        async for _ in self._graph.astream(state, config=config, stream_mode="values"):
+            pass
+
+
+class _HttpRunner:
+    """经 ASGI 直接调用 FastAPI 应用（不经网络），图换成使用当前后端的那一份。"""
+
+    def __init__(self, client: Any) -> None:
+        self._client = client
+
+    async def turn(self, thread_id: str) -> None:
+        r = await self._client.post(
+            "/v1/submit",
+            json={
+                "user_id": "bench",
+                "human_message": "我想开发一个在线教育平台",
+                "timestamp": "2024-09-01T10:00:00Z",
+                "thread_id": thread_id,
+                "model_params": {"api_key": "bench"},
+            },
+        )
+        r.raise_for_status()
+
+
+async def _drive(runner: Any, turns: int, concurrency: int, threads: int) -> Tuple[List[float], float, int]:
+    """concurrency 个 worker 各自取一个空闲的会话线程执行一轮，再放回；返回 (延迟, 墙钟, 失败数)。"""
+    idle: asyncio.Queue = asyncio.Queue()
+    for _ in range(threads):
+        idle.put_nowait(uuid.uuid4().hex)
+    remaining = turns
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker() -> None:
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            thread_id = await idle.get()
+            t0 = time.perf_counter()
+            try:
+                await runner.turn(thread_id)
+                latencies.append(time.perf_counter() - t0)
+            except Exception:
+                errors += 1
+            finally:
+                idle.put_nowait(thread_id)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - t0, errors
+
+
+def _histogram_delta(histogram: Any, before: Dict[Tuple[str, ...], Tuple[float, int]], label: int) -> Dict[str, Dict[str, float]]:
+    out: Dict[str, Dict[str, float]] = {}
+    for key, (total, count) in histogram.totals().items():
+        prev_total, prev_count = before.get(key, (0.0, 0))
+        n = count - prev_count
+        if n > 0:
+            name = "/".join(key[label:])
+            out[name] = {"mean_ms": round((total - prev_total) / n * 1000, 3), "count": n}
+    return out
+
+
+async def _run_case(runner: Any, turns: int, concurrency: int, threads: int) -> Dict[str, Any]:
+    from app.services import metrics
+
+    nodes_before = metrics.node_duration.totals()
+    cp_before = metrics.checkpoint_duration.totals()
+    lat, wall, errors = await _drive(runner, turns, concurrency, threads)
+    result: Dict[str, Any] = {
+        "turns": len(lat),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_tps": round(len(lat) / wall, 2) if wall > 0 else 0.0,
+    }
+    if lat:
+        result.update(
+            {
+                "p50_ms": round(_pct(lat, 0.50) * 1000, 2),
+                "p95_ms": round(_pct(lat, 0.95) * 1000, 2),
+                "p99_ms": round(_pct(lat, 0.99) * 1000, 2),
+                "mean_ms": round(sum(lat) / len(lat) * 1000, 2),
+            }
+        )
+    result["nodes"] = _histogram_delta(metrics.node_duration, nodes_before, 0)
+    # 标签为 (backend, op)，只保留 op
+    result["checkpointer"] = _histogram_delta(metrics.checkpoint_duration, cp_before, 1)
+    return result
+
+
+async def _run_backend(backend: str, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    import httpx
+    from langgraph.checkpoint.memory import MemorySaver
+
+    from app.graph.graph import build_graph
+    from app.services.metrics import instrument_checkpointer
+    import app.main as server
+
+    cases: List[Dict[str, Any]] = []
+    # 应用的 lifespan 启动 run worker 与快照仓库；退出时关闭本后端打开的 checkpointer（aclose_checkpointer）
+    async with server.app.router.lifespan_context(server.app):
+        shared = None
+        if backend != "memory":
+            shared, skipped = await _open_checkpointer(backend, args)
+            if skipped:
+                print(f"[suite] {backend}: skipped ({skipped})")
+                return [{"backend": backend, "skipped": skipped}]
+            shared = instrument_checkpointer(shared)
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for path in args.paths:
+                for threads in args.threads:
+                    for concurrency in args.concurrency:
+                        # memory：每个组合一份新的 MemorySaver，避免前一组合累积的历史拖慢后一组合
+                        checkpointer = shared if shared is not None else instrument_checkpointer(MemorySaver())
+                        graph = build_graph(fanout=args.fanout).compile(checkpointer=checkpointer)
+                        server.compiled_graph = graph
+                        runner = _GraphRunner(graph) if path == "graph" else _HttpRunner(client)
+                        result = await _run_case(runner, args.turns, concurrency, threads)
+                        case = {"backend": backend, "path": path, "concurrency": concurrency, "threads": threads, **result}
+                        cases.append(case)
+                        print(
+                            f"[suite] {backend:>8} {path:>5} c={concurrency:<3} t={threads:<3} "
+                            f"{case['throughput_tps']:8.2f} turns/s  p50 {case.get('p50_ms', 0):8.1f}ms  "
+                            f"p95 {case.get('p95_ms', 0):8.1f}ms  p99 {case.get('p99_ms', 0):8.1f}ms  errors {case['errors']}"
+                        )
+    return cases
+
+
+def _case_key(case: Dict[str, Any]) -> Tuple[Any, ...]:
+    return case.get("backend"), case.get("path"), case.get("concurrency"), case.get("threads")
+
+
+def _compare(current: Dict[str, Any], baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = {_case_key(c): c for c in baseline.get("cases", []) if "skipped" not in c}
+    print(f"\ncompared with {baseline_path} (commit {baseline.get('commit')}):")
+    matched = 0
+    for case in current["cases"]:
+        prev = old.get(_case_key(case))
+        if "skipped" in case or prev is None:
+            continue
+        matched += 1
+        deltas = []
+        for field in ("throughput_tps", "p50_ms", "p95_ms", "p99_ms"):
+            if prev.get(field):
+                deltas.append(f"{field} {(case.get(field, 0) - prev[field]) / prev[field]:+.1%}")
+        print(f"  {case['backend']:>8} {case['path']:>5} c={case['concurrency']:<3} t={case['threads']:<3} " + "  ".join(deltas))
+    if not matched:
+        print("  no cases with the same backend/path/concurrency/threads")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200, help="turns per case")
+    parser.add_argument("--concurrency", type=_ints, default=[1, 8, 32], help="comma-separated turns in flight")
+    parser.add_argument("--threads", type=_ints, default=[8, 64], help="comma-separated conversation thread counts")
+    parser.add_argument("--backends", default="memory", help="comma-separated: memory,redis,postgres")
+    parser.add_argument("--paths", default="graph,http", help="comma-separated: graph,http")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake LLM time to first token (seconds)")
+    parser.add_argument("--tps", type=float, default=2000.0, help="fake LLM output tokens per second (0 = instant)")
+    parser.add_argument("--doc-chars", type=int, default=1000, help="length of the generated document body")
+    parser.add_argument("--fanout", action="store_true", help="use the parallel analysis branches")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL"))
+    parser.add_argument("--postgres-url", default=os.getenv("AGENT_DATABASE_URL") or os.getenv("DATABASE_URL"))
+    parser.add_argument("--out", default=None, help="result JSON path (default: benchmarks/results/<commit>-<time>.json)")
+    parser.add_argument("--compare", default=None, help="baseline result JSON to compare against")
+    args = parser.parse_args()
+    args.paths = [p for p in args.paths.split(",") if p]
+    backends = [b for b in args.backends.split(",") if b]
+    for b in backends:
+        if b not in _EXPECTED_SAVER:
+            parser.error(f"unknown backend {b!r}")
+
+    install_fake_llm(args.latency, args.tps, args.doc_chars)
+
+    async def run() -> List[Dict[str, Any]]:
+        cases: List[Dict[str, Any]] = []
+        for backend in backends:
+            cases.extend(await _run_backend(backend, args))
+        return cases
+
+    commit = _git_commit()
+    started = datetime.now(timezone.utc)
+    report = {
+        "commit": commit,
+        "started_at": started.isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": {
+            "turns": args.turns,
+            "latency": args.latency,
+            "tps": args.tps,
+            "doc_chars": args.doc_chars,
+            "fanout": args.fanout,
+        },
+        "cases": asyncio.run(run()),
+    }
+
+    out = args.out or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results", f"{commit or 'nogit'}-{started:%Y%m%dT%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[suite] results written to {out}")
+    if args.compare:
+        _compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
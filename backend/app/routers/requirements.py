@@ -1,13 +1,16 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from ..schemas.requirements import SubmitRequest, SubmitResponse, PollResponse, StateResponse
+from ..schemas.requirements import SubmitRequest, SubmitResponse, PollResponse, StateResponse, RunAccepted, RunResponse
 from ..services.agent_client import agent_client
+import asyncio
+import httpx
 import time
 import os
 import uuid
 import json
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 # 新增：从模型配置表读取当前激活配置
 from sqlalchemy import select, text
@@ -21,6 +24,13 @@ router = APIRouter(tags=["requirements"])
 # 业务表一次性初始化标记
 _BIZ_TABLES_READY = False
 
+# 后台 run 跟踪：thread_id → [(target_state_version, 等待 run 结束并落库的任务)]，同一 thread 可有多个 run 在途
+_PENDING_RUNS: Dict[str, List[Tuple[int, asyncio.Task]]] = {}
+# 长轮询单次等待时长（Agent /v1/poll 上限 60s）；请求失败后按 _RUN_POLL_INTERVAL 退避重试
+_RUN_POLL_WAIT = min(60.0, float(os.getenv("AGENT_RUN_POLL_WAIT", "25")))
+_RUN_POLL_INTERVAL = float(os.getenv("AGENT_RUN_POLL_INTERVAL", "1.0"))
+_RUN_FOLLOW_TIMEOUT = float(os.getenv("AGENT_RUN_FOLLOW_TIMEOUT", "900"))
+
 
 def _norm_uuid(u: Optional[str]) -> Optional[str]:
     if not u:
@@ -319,8 +329,7 @@ async def _build_preload_state(thread_id: str) -> Optional[dict]:
 
     return preload or None
 
-@router.post("/submit", response_model=SubmitResponse)
-async def submit(req: SubmitRequest):
+async def _build_submit_payload(req: SubmitRequest) -> dict:
     # 若未显式传入 model_params，则尝试注入“当前激活模型”的参数（含服务间临时传递 api_key）
     payload = req.model_dump()
     mp = payload.get("model_params") or {}
@@ -364,6 +373,73 @@ async def submit(req: SubmitRequest):
     except Exception:
         # 预载失败不影响主流程
         pass
+    return payload
+
+
+async def _follow_run(run_id: str, thread_id: str, target_state_version: int) -> None:
+    """等待 Agent 后台 run 结束，随后拉取快照并落库（与同步提交的持久化逻辑一致）。
+
+    run 状态只保存在受理它的 Agent worker 进程内，/v1/runs/{id} 落到其他 worker 会返回 404；
+    因此以 /v1/poll 长轮询 thread 版本（可由任一 worker 经共享状态仓库应答），直到版本达到
+    target_state_version；仅当 poll 明确报告本 run 失败或超过 _RUN_FOLLOW_TIMEOUT 时放弃。
+    """
+    deadline = time.monotonic() + _RUN_FOLLOW_TIMEOUT
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        try:
+            data = await agent_client.poll(thread_id, target_state_version - 1, min(_RUN_POLL_WAIT, remaining))
+        except Exception:
+            await asyncio.sleep(min(_RUN_POLL_INTERVAL, max(0.0, remaining)))
+            continue
+        if int(data.get("current_state_version") or 0) >= target_state_version:
+            break
+        if data.get("run_id") == run_id and data.get("run_status") == "failed":
+            return
+    try:
+        data = await agent_client.state(thread_id)
+        await _persist_state(data)
+    except Exception:
+        # 落库失败不影响 Agent 侧结果，前端仍可经 /status 感知版本推进
+        pass
+
+
+def _track_run(run_id: str, thread_id: str, target_state_version: int) -> None:
+    pending = _PENDING_RUNS.setdefault(thread_id, [])
+    if any(target >= target_state_version for target, _ in pending):
+        # 已有跟踪任务会在更高（或相同）版本落库，覆盖本 run 的结果（同一合并轮次的 run 目标版本相同）
+        return
+    task = asyncio.create_task(_follow_run(run_id, thread_id, target_state_version))
+    pending.append((target_state_version, task))
+
+    def _done(t: asyncio.Task) -> None:
+        entries = _PENDING_RUNS.get(thread_id)
+        if entries is None:
+            return
+        entries[:] = [e for e in entries if e[1] is not t]
+        if not entries:
+            _PENDING_RUNS.pop(thread_id, None)
+
+    task.add_done_callback(_done)
+
+
+@router.post("/submit", response_model=SubmitResponse, responses={202: {"model": RunAccepted}})
+async def submit(req: SubmitRequest, background: bool = False):
+    """转调 Agent 执行一轮。
+
+    background=true 时 Agent 立即返回 202（run_id/target_state_version），本接口同样以 202 透传；
+    run 结束后由后台任务拉取快照并落库，前端继续通过 /status 轮询感知版本推进。
+    """
+    payload = await _build_submit_payload(req)
+
+    if background:
+        try:
+            accepted = await agent_client.submit_background(payload)
+        except Exception as ex:
+            raise HTTPException(status_code=502, detail=f"submit failed: {ex}")
+        _track_run(accepted["run_id"], accepted["thread_id"], int(accepted["target_state_version"]))
+        return JSONResponse(status_code=202, content=accepted)
 
     # 直接转调 Agent，并原样返回 + 持久化
     try:
@@ -379,13 +455,62 @@ async def submit(req: SubmitRequest):
     except Exception as ex:
         raise HTTPException(status_code=502, detail=f"submit failed: {ex}")
 
+@router.post("/submit/stream")
+async def submit_stream(req: SubmitRequest):
+    """SSE 代理：转发 Agent /v1/submit/stream 的 token/document/node/state 事件。
+    收到 state 事件时先落库再转发，保证前端随后读取的 /state 已包含本轮结果。"""
+    payload = await _build_submit_payload(req)
+
+    async def events():
+        event: Optional[str] = None
+        try:
+            async for line in agent_client.submit_stream(payload):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:") and event == "state":
+                    try:
+                        await _persist_state(json.loads(line[len("data:"):]))
+                    except Exception:
+                        pass
+                yield line + "\n"
+        except Exception as ex:
+            yield "event: error\ndata: " + json.dumps({"detail": f"submit failed: {ex}"}, ensure_ascii=False) + "\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.get("/status", response_model=PollResponse)
-async def status(thread_id: str, state_version: int):
+async def status(thread_id: str, state_version: int, wait: float = Query(0, ge=0, le=60)):
+    """轮询版本推进。wait > 0 时为长轮询：透传至 Agent /v1/poll，直到版本推进或超时才返回。"""
     try:
-        data = await agent_client.poll(thread_id, state_version)
-        return data
+        data = await agent_client.poll(thread_id, state_version, wait)
     except Exception as ex:
         raise HTTPException(status_code=502, detail=f"status failed: {ex}")
+    if data.get("has_update"):
+        # 后台 run 已推进版本：等待已到达目标版本的落库任务完成，保证前端随后读取的 /state（PostgreSQL）已包含本轮结果
+        current = int(data.get("current_state_version") or 0)
+        reached = [t for target, t in _PENDING_RUNS.get(thread_id, []) if target <= current]
+        if reached:
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.gather(*reached, return_exceptions=True)), timeout=10)
+            except Exception:
+                pass
+    return data
+
+
+@router.get("/runs/{run_id}", response_model=RunResponse)
+async def get_run(run_id: str):
+    try:
+        return await agent_client.run(run_id)
+    except httpx.HTTPStatusError as ex:
+        if ex.response.status_code == 404:
+            raise HTTPException(status_code=404, detail="run not found")
+        raise HTTPException(status_code=502, detail=f"run status failed: {ex}")
+    except Exception as ex:
+        raise HTTPException(status_code=502, detail=f"run status failed: {ex}")
 
 @router.get("/state", response_model=StateResponse)
 async def get_state(thread_id: str, state_version: Optional[int] = None, version: Optional[str] = None):
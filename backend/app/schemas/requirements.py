@@ -33,6 +33,27 @@ class PollResponse(BaseModel):
     client_state_version: int
     current_state_version: int
     has_update: bool
+    # Latest background run of this thread (queued/running/done/failed), if any
+    run_id: Optional[str] = None
+    run_status: Optional[str] = None
+
+class RunAccepted(BaseModel):
+    run_id: str
+    thread_id: str
+    status: str
+    state_version: int
+    target_state_version: int
+
+class RunResponse(BaseModel):
+    run_id: str
+    thread_id: str
+    status: str
+    target_state_version: int
+    state_version: Optional[int] = None
+    error: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
 
 class StateResponse(SubmitResponse):
     # Aggregated thread data (optional) for returning all versions under a thread_id
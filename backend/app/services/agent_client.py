@@ -1,15 +1,37 @@
 import os
 import httpx
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Dict, List
 from ..schemas.requirements import SubmitRequest
 
 class AgentClient:
     def __init__(self):
         # 固定端口一致性：默认指向 2024，允许通过环境变量覆盖
         self.base = os.getenv("AGENT_BASE_URL", "http://127.0.0.1:2024")
-        self.client = httpx.AsyncClient(timeout=30.0)
+        # 连接池显式设置上限（httpx 默认 100 连接、等待空闲连接 30s）：
+        # - client：submit / state / run 等短请求；
+        # - poll_client：长轮询（/v1/poll?wait=25）单独一个连接池。每个挂起的长轮询占用一条连接直至版本推进或超时，
+        #   若与短请求共用连接池，约 100 个打开的页面即可占满连接，submit 排队等待连接后返回 502。
+        #   长轮询连接池满时在 pool 超时（AGENT_POLL_POOL_TIMEOUT）后失败，前端按普通轮询失败重试；
+        # - stream_client：SSE 透传（/v1/submit/stream），每条流在整轮 LLM 期间占用一条连接，同理单独一个连接池；
+        #   池满时在 AGENT_STREAM_POOL_TIMEOUT 后失败（以 SSE error 事件返回），不影响短请求。
+        max_conn = int(os.getenv("AGENT_CLIENT_MAX_CONNECTIONS", "100"))
+        poll_conn = int(os.getenv("AGENT_POLL_MAX_CONNECTIONS", "1000"))
+        self.client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=max_conn, max_keepalive_connections=max_conn),
+        )
+        stream_conn = int(os.getenv("AGENT_STREAM_MAX_CONNECTIONS", "200"))
+        self.stream_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, read=None, pool=float(os.getenv("AGENT_STREAM_POOL_TIMEOUT", "5"))),
+            limits=httpx.Limits(max_connections=stream_conn, max_keepalive_connections=min(stream_conn, 100)),
+        )
+        self.poll_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, pool=float(os.getenv("AGENT_POLL_POOL_TIMEOUT", "5"))),
+            limits=httpx.Limits(max_connections=poll_conn, max_keepalive_connections=min(poll_conn, 100)),
+        )
 
-    async def submit(self, payload: dict):
+    @staticmethod
+    def _to_agent_request(payload: dict) -> dict:
         # Map backend payload to Agent's SubmitRequest shape
         files_in: List[Dict[str, Any]] = []
         for f in (payload.get("file_info") or []):
@@ -38,14 +60,48 @@ class AgentClient:
             # 新增：预载状态（来自 PostgreSQL），仅当 Agent 无旧状态时用于恢复上下文
             "preload_state": payload.get("preload_state") or None,
         }
-        r = await self.client.post(f"{self.base}/v1/submit", json=data)
+        return data
+
+    async def submit(self, payload: dict):
+        r = await self.client.post(f"{self.base}/v1/submit", json=self._to_agent_request(payload))
+        r.raise_for_status()
+        return r.json()
+
+    async def submit_background(self, payload: dict):
+        # 后台模式：Agent 立即返回 202 RunAccepted（run_id / target_state_version），不再等待整轮 LLM
+        r = await self.client.post(
+            f"{self.base}/v1/submit", params={"background": "true"}, json=self._to_agent_request(payload)
+        )
+        r.raise_for_status()
+        return r.json()
+
+    async def submit_stream(self, payload: dict) -> AsyncIterator[str]:
+        # SSE 透传：逐行产出 Agent /v1/submit/stream 的事件流；整轮可能超过 30s，因此不设读超时（stream_client 的默认设置）
+        async with self.stream_client.stream(
+            "POST",
+            f"{self.base}/v1/submit/stream",
+            json=self._to_agent_request(payload),
+        ) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                yield line
+
+    async def run(self, run_id: str):
+        r = await self.client.get(f"{self.base}/v1/runs/{run_id}")
         r.raise_for_status()
         return r.json()
 
-    async def poll(self, thread_id: str, state_version: int):
+    async def poll(self, thread_id: str, state_version: int, wait: float = 0):
         # 注意：Agent 的参数名为 client_state_version
-        r = await self.client.get(
-            f"{self.base}/v1/poll", params={"thread_id": thread_id, "client_state_version": state_version}
+        # wait > 0 为长轮询：Agent 挂起至版本推进或超时，读超时需覆盖等待时长
+        params = {"thread_id": thread_id, "client_state_version": state_version}
+        if wait > 0:
+            params["wait"] = wait
+        client = self.poll_client if wait > 0 else self.client
+        r = await client.get(
+            f"{self.base}/v1/poll",
+            params=params,
+            timeout=httpx.Timeout(30.0, read=wait + 30.0, pool=client.timeout.pool),
         )
         r.raise_for_status()
         return r.json()
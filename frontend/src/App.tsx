@@ -27,6 +27,15 @@ interface PollResponse {
 
 interface StateResponse extends SubmitResponse {}
 
+// 后台模式（?background=true）下的 202 响应
+interface RunAccepted {
+  run_id: string
+  thread_id: string
+  status: string
+  state_version: number
+  target_state_version: number
+}
+
 type ModelConfig = {
   provider?: string
   base_url?: string
@@ -72,6 +81,9 @@ export default function App() {
     }
   }, [])
 
+  // 长轮询：服务端挂起至 state_version 推进或超时，返回后立即发起下一次
+  const POLL_WAIT_SECONDS = 25
+
   function scheduleNextPoll(tid: string, sv: number, delayMs = 1500) {
     if (!mountedRef.current) return
     if (pollTimer.current) window.clearTimeout(pollTimer.current)
@@ -80,7 +92,7 @@ export default function App() {
 
   async function pollOnce(tid: string, sv: number) {
     try {
-      const url = `/api/v1/requirements/status?thread_id=${encodeURIComponent(tid)}&state_version=${encodeURIComponent(String(sv))}`
+      const url = `/api/v1/requirements/status?thread_id=${encodeURIComponent(tid)}&state_version=${encodeURIComponent(String(sv))}&wait=${POLL_WAIT_SECONDS}`
       const res = await fetch(url)
       if (!res.ok) {
         // 后端/Agent 可能短暂 502，稍后重试
@@ -98,12 +110,12 @@ export default function App() {
           setCurrentStatus(sdata.current_status)
           setDoc(sdata.requirements_document)
           setQuestions(sdata.question_list || [])
-          scheduleNextPoll(tid, sdata.state_version, 1500)
+          scheduleNextPoll(tid, sdata.state_version, 0)
           return
         }
       }
-      // 无更新或获取失败则继续按旧版本轮询
-      scheduleNextPoll(tid, sv, 1500)
+      // 无更新（长轮询超时）或获取失败则继续按旧版本轮询
+      scheduleNextPoll(tid, sv, 100)
     } catch (_e) {
       // 网络/暂时错误，继续轻量重试
       scheduleNextPoll(tid, sv, 2000)
@@ -127,7 +139,7 @@ export default function App() {
       // 修正字段名为 model_params（与后端 Pydantic 模型一致）
       if (model_param) payload.model_params = model_param
 
-      const res = await fetch('/api/v1/requirements/submit', {
+      const res = await fetch('/api/v1/requirements/submit?background=true', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(payload),
@@ -136,6 +148,16 @@ export default function App() {
         const text = await res.text()
         throw new Error(`提交失败: ${res.status} ${text}`)
       }
+      if (res.status === 202) {
+        // 本轮在 Agent 后台执行：直接进入 Workspace，由其轮询 /status 等待版本推进；
+        // 带上 run_id 与输入内容，run 失败（版本不会推进）时 Workspace 提示错误并恢复输入
+        const run: RunAccepted = await res.json()
+        navigate(
+          `/workspace?thread_id=${encodeURIComponent(run.thread_id)}&state_version=${encodeURIComponent(String(run.state_version))}&run_id=${encodeURIComponent(run.run_id)}`,
+          { state: { pendingText: input } },
+        )
+        return
+      }
       const data: SubmitResponse = await res.json()
       setThreadId(data.thread_id)
       setStateVersion(data.state_version)
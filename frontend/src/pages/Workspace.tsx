@@ -1,4 +1,5 @@
 import React, { useEffect, useMemo, useRef, useState } from 'react'
+import { useLocation } from 'react-router-dom'
 import TopNav from '../components/TopNav'
 import '../App.css'
 
@@ -20,9 +21,16 @@ interface StateResponse {
 
 interface SubmitResponse extends StateResponse {}
 
+// 后台模式（?background=true）下的 202 响应：本轮已排队，版本推进后经 /status 感知
+interface RunAccepted { run_id: string; thread_id: string; status: string; state_version: number; target_state_version: number }
+// /status 额外返回该线程最近一次后台 run 的 run_id / run_status（queued|running|done|failed）
+interface PollResponse { has_update: boolean; run_id?: string | null; run_status?: string | null }
+interface RunResponse { run_id: string; status: string; error?: string | null }
+
 type ModelConfig = { provider?: string; base_url?: string; model?: string; temperature?: number; max_tokens?: number; api_key?: string }
 
 export default function Workspace() {
+  const location = useLocation()
   const [threadId, setThreadId] = useState<string | null>(null)
   const [stateVersion, setStateVersion] = useState<number | null>(null)
   const [currentStatus, setCurrentStatus] = useState<string>('')
@@ -40,6 +48,9 @@ export default function Workspace() {
   const [selectedByVersion, setSelectedByVersion] = useState<Record<string, Record<string, Set<string>>>>({})
   const [userText, setUserText] = useState('')
   const [submitting, setSubmitting] = useState(false)
+  const [submitError, setSubmitError] = useState<string | null>(null)
+  // 已提交、尚未推进版本的后台 run：失败时不会推进 state_version，需据此提示错误并恢复输入
+  const pendingRunRef = useRef<{ runId: string; text: string } | null>(null)
 
   const pollTimer = useRef<number | null>(null)
   const mountedRef = useRef(true)
@@ -63,7 +74,10 @@ export default function Workspace() {
     const usp = new URLSearchParams(window.location.search)
     const tid = usp.get('thread_id')
     const sv = usp.get('state_version')
+    const runId = usp.get('run_id')
     if (tid) setThreadId(tid)
+    // 首页以后台模式提交后跳转至此：跟踪该 run，失败时把首页输入的内容恢复到输入框
+    if (runId) pendingRunRef.current = { runId, text: (location.state as { pendingText?: string } | null)?.pendingText || '' }
     // 首次加载：无论是否带 state_version，都先用 thread_id 拉取一次当前状态用于回显
     if (tid) {
       ;(async () => {
@@ -84,6 +98,9 @@ export default function Workspace() {
 
   useEffect(() => { if (threadId && stateVersion != null) scheduleNextPoll(threadId, stateVersion, 1500) }, [threadId, stateVersion])
 
+  // 长轮询：服务端挂起至 state_version 推进或超时，返回后立即发起下一次
+  const POLL_WAIT_SECONDS = 25
+
   function scheduleNextPoll(tid: string, sv: number, delay = 5000) {
     if (!mountedRef.current) return
     if (pollTimer.current) window.clearTimeout(pollTimer.current)
@@ -158,22 +175,49 @@ export default function Workspace() {
     }
   }
 
+  // 后台 run 失败：提示错误，并把提交时的输入恢复到输入框（用户已输入新内容时不覆盖）
+  async function handleRunFailed(runId: string) {
+    const pending = pendingRunRef.current
+    if (!pending || pending.runId !== runId) return
+    pendingRunRef.current = null
+    let detail = ''
+    try {
+      const rres = await fetch(`/api/v1/requirements/runs/${encodeURIComponent(runId)}`)
+      if (rres.ok) detail = ((await rres.json()) as RunResponse).error || ''
+    } catch {}
+    if (!mountedRef.current) return
+    setSubmitError(`提交失败${detail ? `：${detail}` : ''}，请重试`)
+    setUserText(prev => prev || pending.text)
+  }
+
   async function pollOnce(tid: string, sv: number) {
     try {
-      const res = await fetch(`/api/v1/requirements/status?thread_id=${encodeURIComponent(tid)}&state_version=${encodeURIComponent(String(sv))}`)
+      // 有未完成的后台 run 时先查一次其状态：run 在长轮询挂起之前就已失败时，不必等到长轮询超时
+      const pending = pendingRunRef.current
+      if (pending) {
+        const rres = await fetch(`/api/v1/requirements/runs/${encodeURIComponent(pending.runId)}`)
+        if (rres.ok && ((await rres.json()) as RunResponse).status === 'failed') {
+          await handleRunFailed(pending.runId)
+          scheduleNextPoll(tid, sv, 100)
+          return
+        }
+      }
+      const res = await fetch(`/api/v1/requirements/status?thread_id=${encodeURIComponent(tid)}&state_version=${encodeURIComponent(String(sv))}&wait=${POLL_WAIT_SECONDS}`)
       if (!res.ok) { scheduleNextPoll(tid, sv, 5000); return }
-      const data = await res.json() as { has_update: boolean }
+      const data = await res.json() as PollResponse
+      if (data.run_status === 'failed' && data.run_id) await handleRunFailed(data.run_id)
       if (data.has_update) {
+        pendingRunRef.current = null
         const sres = await fetch(`/api/v1/requirements/state?thread_id=${encodeURIComponent(tid)}`)
         if (sres.ok) {
           const sdata: StateResponse = await sres.json()
           if (!mountedRef.current) return
           applyStateData(sdata)
-          scheduleNextPoll(tid, sdata.state_version, 5000)
+          scheduleNextPoll(tid, sdata.state_version, 0)
           return
         }
       }
-      scheduleNextPoll(tid, sv, 5000)
+      scheduleNextPoll(tid, sv, 100)
     } catch { scheduleNextPoll(tid, sv, 6000) }
   }
 
@@ -217,12 +261,20 @@ export default function Workspace() {
     const text = buildHumanMessage()
     if (!text) return
     setSubmitting(true)
+    setSubmitError(null)
     try {
       const model_param = getCurrentModelFromStorage()
       const payload: any = { user_id: getUserId(), human_message: text, thread_id: threadId, state_version: stateVersion, timestamp: new Date().toISOString() }
       if (model_param) payload.model_params = model_param
-      const res = await fetch('/api/v1/requirements/submit', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(payload) })
-      if (!res.ok) { console.error('提交失败', res.status); return }
+      const res = await fetch('/api/v1/requirements/submit?background=true', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(payload) })
+      if (!res.ok) { console.error('提交失败', res.status); setSubmitError(`提交失败: ${res.status}`); return }
+      if (res.status === 202) {
+        const run: RunAccepted = await res.json()
+        pendingRunRef.current = { runId: run.run_id, text: userText }
+        scheduleNextPoll(threadId, run.state_version, 1000)
+        setUserText('')
+        return
+      }
       const data: SubmitResponse = await res.json()
       applyStateData(data)
       scheduleNextPoll(threadId, data.state_version, 1000)
@@ -339,6 +391,7 @@ export default function Workspace() {
                 </div>
               ))}
               <textarea value={userText} onChange={e => setUserText(e.target.value)} placeholder="在此补充你的想法..." style={{ width: '100%', height: 100, borderRadius: 12, border: '1px solid #e5e7eb', padding: 10, marginTop: 8 }} />
+              {submitError && <div className="error-tip">{submitError}</div>}
               <div style={{ display: 'flex', justifyContent: 'flex-end', marginTop: 10 }}>
                 <button className="go" onClick={handleSubmitFollowup} disabled={submitting || !threadId}>{submitting ? '提交中...' : '提交'}</button>
               </div>